@@ -6306,32 +6306,145 @@ def get_industry_benchmark(sector, metric):
         return INDUSTRY_BENCHMARKS[sector].get(metric, 0)
     return 0
 
-def get_roast_comment(portfolio_data, total_risk_score):
-    """Generate roast/comment based on portfolio - RANDOMIZED"""
+# ============= PORTFOLIO DATA LOADER =============
+# Everything the Risk Analyzer needs per holding, fetched concurrently: one
+# batched quote request for the whole portfolio, then every (ticker, endpoint)
+# pair goes through one bounded pool so wall time ≈ the slowest single call.
+from typing import NamedTuple, Optional
+
+PORTFOLIO_LOADER_WORKERS = 24  # cap on concurrent FMP calls per analysis
+
+
+class HoldingBundle(NamedTuple):
+    """Per-holding data bundle consumed by calculate_risk_score / get_roast_comment."""
+    ticker: str
+    allocation: float
+    quote: Optional[dict]
+    profile: Optional[dict]
+    ratios_ttm: dict
+    income_df: pd.DataFrame
+    balance_df: pd.DataFrame
+    cash_df: pd.DataFrame
+    name: str
+    sector: str
+    beta: float
+    market_cap: float
+    pe: float
+    ps: float
+    de_ratio: float
+    quick_ratio: float
+
+
+# endpoint name → fetcher(ticker); statement fetches match the analyzer's (annual, 1)
+_HOLDING_FETCHERS = {
+    "profile": lambda t: get_profile(t),
+    "ratios_ttm": lambda t: get_ratios_ttm(t),
+    "income_df": lambda t: get_income_statement(t, 'annual', 1),
+    "income_q": lambda t: get_income_statement(t, 'quarter', 4),  # warms get_eps_ttm's cache
+    "balance_df": lambda t: get_balance_sheet(t, 'annual', 1),
+    "cash_df": lambda t: get_cash_flow(t, 'annual', 1),
+}
+
+
+def load_portfolio_bundles(holdings, max_workers=PORTFOLIO_LOADER_WORKERS):
+    """
+    Resolve all holdings concurrently.
+
+    Args:
+        holdings: [{'ticker', 'allocation'}, ...]
+
+    Returns:
+        (bundles, missing): HoldingBundle list in input order for tickers that
+        returned a quote, and the tickers that didn't.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    tickers = [h['ticker'].upper() for h in holdings]
+    quotes = get_quotes_batch(tuple(dict.fromkeys(tickers)))
+
+    jobs = [(t, field) for t in dict.fromkeys(tickers) for field in _HOLDING_FETCHERS]
+    jobs += [(t, "quote") for t in dict.fromkeys(tickers) if t not in quotes]  # batch miss → single quote
+
+    def _run(job):
+        t, field = job
+        try:
+            return get_quote(t) if field == "quote" else _HOLDING_FETCHERS[field](t)
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as exe:
+        results = dict(zip(jobs, exe.map(_run, jobs)))
+
+    bundles, missing = [], []
+    for h, t in zip(holdings, tickers):
+        quote = quotes.get(t) or results.get((t, "quote"))
+        if not quote:
+            missing.append(t)
+            continue
+        profile = results.get((t, "profile")) or None
+        ratios_ttm = results.get((t, "ratios_ttm")) or {}
+        income_df = _as_df(results.get((t, "income_df")))
+        balance_df = _as_df(results.get((t, "balance_df")))
+        cash_df = _as_df(results.get((t, "cash_df")))
+        sector = profile.get('sector', 'Unknown') if profile else 'Unknown'
+        # /stable/quote carries no beta; the profile does
+        beta = (profile or {}).get('beta') or quote.get('beta') or 1.0
+        bundles.append(HoldingBundle(
+            ticker=t,
+            allocation=h['allocation'],
+            quote=quote,
+            profile=profile,
+            ratios_ttm=ratios_ttm,
+            income_df=income_df,
+            balance_df=balance_df,
+            cash_df=cash_df,
+            name=quote.get('name', t),
+            sector=sector,
+            beta=float(beta),
+            market_cap=quote.get('marketCap', 0) or 0,
+            pe=get_pe_ratio(t, quote, ratios_ttm, income_df),
+            ps=get_ps_ratio(t, ratios_ttm),
+            de_ratio=calculate_debt_to_equity(balance_df),
+            quick_ratio=calculate_quick_ratio(balance_df),
+        ))
+    return bundles, missing
+
+
+def _as_df(value):
+    return value if isinstance(value, pd.DataFrame) else pd.DataFrame()
+
+def get_roast_comment(bundles, total_risk_score, risk=None):
+    """Generate roast/comment based on portfolio (HoldingBundle list) - RANDOMIZED
+
+    `risk` is the optional compute_portfolio_risk result; when present,
+    concentration and volatility roasts use correlation-aware numbers.
+    """
     comments = []
     
-    meme_count = sum(1 for stock in portfolio_data if stock['ticker'] in MEME_STOCKS)
+    meme_count = sum(1 for stock in bundles if stock.ticker in MEME_STOCKS)
     if meme_count > 0:
         comments.append(random.choice(ROASTS['meme_stocks']))
     
-    avg_de = sum(stock['de_ratio'] for stock in portfolio_data if stock['de_ratio'] > 0) / max(len([s for s in portfolio_data if s['de_ratio'] > 0]), 1)
+    avg_de = sum(stock.de_ratio for stock in bundles if stock.de_ratio > 0) / max(len([s for s in bundles if s.de_ratio > 0]), 1)
     if avg_de > 2.5:
         comments.append(random.choice(ROASTS['high_debt']))
     
-    avg_qr = sum(stock['quick_ratio'] for stock in portfolio_data if stock['quick_ratio'] > 0) / max(len([s for s in portfolio_data if s['quick_ratio'] > 0]), 1)
+    avg_qr = sum(stock.quick_ratio for stock in bundles if stock.quick_ratio > 0) / max(len([s for s in bundles if s.quick_ratio > 0]), 1)
     if avg_qr < 0.8:
         comments.append(random.choice(ROASTS['low_liquidity']))
     
-    avg_pe = sum(stock['pe'] for stock in portfolio_data if stock['pe'] > 0) / max(len([s for s in portfolio_data if s['pe'] > 0]), 1)
+    avg_pe = sum(stock.pe for stock in bundles if stock.pe > 0) / max(len([s for s in bundles if s.pe > 0]), 1)
     if avg_pe > 50:
         comments.append(random.choice(ROASTS['overvalued']))
     
-    max_allocation = max(stock['allocation'] for stock in portfolio_data)
-    if max_allocation > 40:
+    max_allocation = max(stock.allocation for stock in bundles)
+    # Many names that all move together are as concentrated as one big bet
+    herded = bool(risk) and len(bundles) >= 3 and risk['diversification_ratio'] < 1.15
+    if max_allocation > 40 or herded:
         comments.append(random.choice(ROASTS['concentrated']))
     
-    avg_beta = sum(stock['beta'] * stock['allocation']/100 for stock in portfolio_data)
-    if avg_beta > 1.5:
+    avg_beta = sum(stock.beta * stock.allocation/100 for stock in bundles)
+    if avg_beta > 1.5 or (risk and risk['vol_annual'] > 0.40):
         comments.append(random.choice(ROASTS['high_beta']))
     
     if total_risk_score > 70:
@@ -6346,16 +6459,17 @@ def get_roast_comment(portfolio_data, total_risk_score):
     
     return "\n\n".join(comments[:3])
 
-def calculate_risk_score(ticker, quote, balance_df, cash_df, sector):
-    """Calculate comprehensive risk score"""
+def calculate_risk_score(bundle):
+    """Calculate comprehensive risk score for one HoldingBundle"""
     risk_score = 0
     risk_factors = []
+    ticker, sector, cash_df = bundle.ticker, bundle.sector, bundle.cash_df
     
     if ticker in MEME_STOCKS:
         risk_score += 25
         risk_factors.append(f"Meme stock detected ({ticker})")
     
-    beta = quote.get('beta', 1.0) if quote else 1.0
+    beta = bundle.beta
     if beta > 1.5:
         risk_score += 30
         risk_factors.append("Very high volatility (Beta > 1.5)")
@@ -6366,7 +6480,7 @@ def calculate_risk_score(ticker, quote, balance_df, cash_df, sector):
         risk_score += 10
         risk_factors.append("Moderate volatility (Beta > 1.0)")
     
-    de_ratio = calculate_debt_to_equity(balance_df)
+    de_ratio = bundle.de_ratio
     industry_de = get_industry_benchmark(sector, 'debt_to_equity')
     
     if de_ratio > 3.0:
@@ -6379,7 +6493,7 @@ def calculate_risk_score(ticker, quote, balance_df, cash_df, sector):
         risk_score += 15
         risk_factors.append(f"Above-industry debt (D/E: {de_ratio:.2f} vs industry {industry_de:.2f})")
     
-    quick_ratio = calculate_quick_ratio(balance_df)
+    quick_ratio = bundle.quick_ratio
     if quick_ratio < 0.5:
         risk_score += 20
         risk_factors.append(f"Liquidity crisis risk (Quick Ratio: {quick_ratio:.2f})")
@@ -6398,6 +6512,46 @@ def calculate_risk_score(ticker, quote, balance_df, cash_df, sector):
     
     return min(risk_score, 100), risk_factors
 
+# ============= LOCAL CACHE DB (SQLite) =============
+# Process-shared, disk-persisted tables for batch-computed data (precomputed
+# scores, price history, ...). Every table here is derived — it can be deleted
+# at any time and the owning batch job rebuilds it. Supabase stays the source
+# of truth for anything user-owned.
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+LOCAL_DB_PATH = os.environ.get(
+    "LOCAL_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".local_cache", "fms_local.db"),
+)
+_LOCAL_DB_INIT_LOCK = threading.Lock()
+_LOCAL_DB_READY = set()  # DDL strings already applied in this process
+
+
+@contextmanager
+def _local_db(ddl=None):
+    """Yield a sqlite3 connection to the local cache DB, committing on exit.
+
+    One connection per call — sqlite connections can't be shared across the
+    worker threads the batch jobs use. Pass the owning table's DDL as `ddl`
+    (CREATE TABLE IF NOT EXISTS ...); it's applied once per process.
+    """
+    os.makedirs(os.path.dirname(LOCAL_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(LOCAL_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        if ddl and ddl not in _LOCAL_DB_READY:
+            with _LOCAL_DB_INIT_LOCK:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(ddl)
+                _LOCAL_DB_READY.add(ddl)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
 # ============= FMP API FUNCTIONS (OPTIMIZED WITH CACHING) =============
 
 @st.cache_data(ttl=3600)
@@ -6742,6 +6896,34 @@ def get_quote(ticker):
     except Exception:
         return None
 
+@st.cache_data(ttl=300)
+def get_quotes_batch(tickers):
+    """Get quotes for many tickers in as few requests as possible.
+
+    Uses the comma-separated /quote endpoint (50 symbols per request, same as
+    the live ticker bar). Returns {SYMBOL: quote_dict}; symbols FMP doesn't
+    return are simply missing.
+    """
+    out = {}
+    syms = [str(t).upper() for t in dict.fromkeys(tickers or []) if t]
+    for i in range(0, len(syms), 50):
+        batch = syms[i:i+50]
+        url = f"{BASE_URL}/quote?symbol={','.join(batch)}&apikey={FMP_API_KEY}"
+        try:
+            response = requests.get(url, timeout=15)
+            data = response.json()
+        except Exception:
+            continue
+        if not isinstance(data, list):
+            continue
+        for q in data:
+            if not isinstance(q, dict) or not q.get("symbol"):
+                continue
+            if q.get("changesPercentage") in (None, 0, 0.0) and q.get("changePercentage") is not None:
+                q["changesPercentage"] = q.get("changePercentage")
+            out[q["symbol"].upper()] = q
+    return out
+
 @st.cache_data(ttl=1800)
 def get_profile(ticker):
     """Get company profile"""
@@ -7411,6 +7593,346 @@ def _dq_pillar_dot(score, max_score, label):
     )
 
 
+_DIP_FETCH_TIMEOUT = 15  # seconds — shared deadline for one ticker's seven fetches
+
+
+def _fetch_dip_row(tk, timeout=_DIP_FETCH_TIMEOUT):
+    """Fetch all Dip Finder inputs for a single ticker concurrently and score it.
+
+    Always returns a dict: a full row on success, or {"ticker", "error"} when a
+    fetch fails or the shared deadline passes, so callers can surface the
+    failure instead of silently dropping the ticker.
+    """
+    import concurrent.futures as _cf
+
+    _inner = _cf.ThreadPoolExecutor(max_workers=7)
+    try:
+        f_quote   = _inner.submit(lambda: get_quote(tk) or {})
+        f_profile = _inner.submit(lambda: get_profile(tk) or {})
+        f_ratios  = _inner.submit(lambda: get_ratios_ttm(tk) or {})
+        f_rev_g   = _inner.submit(lambda: get_revenue_growth(tk))
+        f_cons    = _inner.submit(lambda: get_analyst_consensus(tk) or {})
+        f_pt_con  = _inner.submit(lambda: get_price_target_consensus(tk) or {})
+        f_tech    = _inner.submit(lambda: _get_technicals_for_dip(tk))
+
+        deadline = time.time() + timeout
+        _left = lambda: max(0.0, deadline - time.time())
+        quote   = f_quote.result(timeout=_left())
+        profile = f_profile.result(timeout=_left())
+        ratios  = f_ratios.result(timeout=_left())
+        rev_g   = f_rev_g.result(timeout=_left())
+        cons    = f_cons.result(timeout=_left())
+        pt_con  = f_pt_con.result(timeout=_left())
+        tech    = f_tech.result(timeout=_left())
+
+        if not quote.get("price"):
+            return {"ticker": tk.upper(), "error": "No quote data — check the ticker"}
+
+        return _build_dip_row(tk, quote, profile, ratios, rev_g, cons, pt_con, tech)
+    except _cf.TimeoutError:
+        return {"ticker": tk.upper(), "error": f"Timed out after {timeout}s"}
+    except Exception as e:
+        return {"ticker": tk.upper(), "error": f"Data error: {type(e).__name__}"}
+    finally:
+        # Don't block on stragglers — a timed-out fetch keeps running in the
+        # background and lands in st.cache_data for the next rerun.
+        _inner.shutdown(wait=False)
+
+
+def _build_dip_row(tk, quote, profile, ratios, rev_g, cons, pt_con, tech):
+    """Assemble the Dip Finder row dict (and its DQ score) from raw inputs."""
+    price     = quote.get("price", 0) or 0
+    year_high = quote.get("yearHigh", 0) or 0
+    year_low  = quote.get("yearLow", 0)  or 0
+    pct_high  = ((price - year_high) / year_high * 100) if year_high > 0 else None
+    return {
+        "ticker": tk.upper(),
+        "name":   profile.get("companyName", tk),
+        "price":  price,
+        "year_high": year_high,
+        "year_low":  year_low,
+        "pct_high":  pct_high,
+        "sector": profile.get("sector", ""),
+        "quote":  quote,
+        "profile": profile,
+        "ratios": ratios,
+        "rev_growth": rev_g,
+        "consensus":  cons,
+        "pt_consensus": pt_con,
+        "tech":   tech,
+        "dq":     _score_dip_quality(quote, profile, ratios, rev_g, cons, pt_con, tech),
+    }
+
+
+# ============= PRECOMPUTED DQ TABLE (nightly batch) =============
+# The Dip Finder's slow inputs (profile, TTM ratios, revenue growth, analyst
+# consensus, price targets, 1y technicals) change at most daily, so a batch
+# job computes them for the whole universe off-hours and stores one row per
+# ticker in the local cache DB. On page view we only pull one batched live
+# quote and re-run _score_dip_quality — which is pure Python — so the
+# price-dependent pillars (PT upside, P/E, P/S, BB/MA/52w position) are
+# always current while the page renders instantly.
+
+DQ_BATCH_HOUR_UTC = int(os.environ.get("DQ_BATCH_HOUR_UTC", "8"))  # 4am ET
+DQ_MAX_AGE_HOURS  = 36   # older rows fall back to the live 7-fetch path
+DQ_BATCH_WORKERS  = 8    # tickers in flight; each fans out to 7 fetches
+
+_DQ_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS dip_dq_scores (
+    ticker           TEXT PRIMARY KEY,
+    computed_at      REAL NOT NULL,
+    price_at_compute REAL,
+    total            INTEGER,
+    verdict          TEXT,
+    scores_json      TEXT,
+    inputs_json      TEXT
+);
+CREATE TABLE IF NOT EXISTS dip_dq_runs (
+    started_at  REAL PRIMARY KEY,
+    elapsed_s   REAL,
+    workers     INTEGER,
+    n_tickers   INTEGER,
+    n_ok        INTEGER,
+    n_failed    INTEGER,
+    p50_s       REAL,
+    p95_s       REAL,
+    max_s       REAL
+);
+"""
+
+
+def _dq_universe():
+    """Macro Nexus + Top-100 tickers, de-duplicated, Macro Nexus order first."""
+    return list(dict.fromkeys([t.upper() for t in _MACRO_NEXUS_TICKERS + TOP_100_TICKERS]))
+
+
+def _reprice_dip_tech(tech, price):
+    """Re-derive the price-relative technical fields at a live price.
+
+    RSI/ATR/volume stay at their end-of-day values; SMA, Bollinger and 52w
+    levels are kept and the live price is re-positioned against them.
+    """
+    if not tech or not price:
+        return tech or {}
+    t = dict(tech)
+    t["price"] = price
+    if t.get("sma50") is not None:
+        t["above_sma50"] = price > t["sma50"]
+    if t.get("sma200") is not None:
+        t["above_sma200"] = price > t["sma200"]
+    lo, hi = t.get("bb_lower"), t.get("bb_upper")
+    if lo is not None and hi is not None:
+        t["bb_pct"] = (price - lo) / (hi - lo) if hi != lo else 0.5
+    # 52w levels: back them out of the stored % distances, then re-apply
+    old = tech.get("price")
+    if old:
+        if tech.get("pct_from_52w_high") is not None:
+            high_52w = max(old / (1 + tech["pct_from_52w_high"] / 100), price)
+            t["pct_from_52w_high"] = (price - high_52w) / high_52w * 100
+        if tech.get("pct_from_52w_low") is not None:
+            low_52w = min(old / (1 + tech["pct_from_52w_low"] / 100), price)
+            t["pct_from_52w_low"] = (price - low_52w) / low_52w * 100
+    return t
+
+
+def _rescore_dip_row(stored, live_quote):
+    """Turn a stored dip_dq_scores row into a live Dip Finder row."""
+    inputs = json.loads(stored["inputs_json"])
+    quote = dict(inputs.get("quote") or {})
+    if live_quote and live_quote.get("price"):
+        quote.update(live_quote)
+    price = quote.get("price") or stored["price_at_compute"] or 0
+
+    ratios = dict(inputs.get("ratios") or {})
+    old_price = stored["price_at_compute"]
+    if old_price and price and price != old_price:
+        # P/S scales linearly with price between batch runs
+        for k in ("priceToSalesRatioTTM", "priceSalesRatioTTM"):
+            if ratios.get(k):
+                try:
+                    ratios[k] = float(ratios[k]) * price / old_price
+                except (TypeError, ValueError):
+                    pass
+
+    row = _build_dip_row(
+        stored["ticker"], quote, inputs.get("profile") or {}, ratios,
+        inputs.get("rev_growth"), inputs.get("consensus") or {},
+        inputs.get("pt_consensus") or {}, _reprice_dip_tech(inputs.get("tech"), price),
+    )
+    row["computed_at"] = stored["computed_at"]
+    return row
+
+
+def _store_dq_rows(rows):
+    """Upsert scored Dip Finder rows into dip_dq_scores."""
+    now = time.time()
+    payload = []
+    for r in rows:
+        inputs = {k: r.get(k) for k in ("quote", "profile", "ratios", "rev_growth",
+                                        "consensus", "pt_consensus", "tech")}
+        payload.append((
+            r["ticker"], now, r.get("price"), r["dq"]["total"], r["dq"]["verdict"],
+            json.dumps(r["dq"]["scores"]), json.dumps(inputs, default=str),
+        ))
+    with _local_db(_DQ_TABLE_DDL) as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO dip_dq_scores "
+            "(ticker, computed_at, price_at_compute, total, verdict, scores_json, inputs_json) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            payload,
+        )
+
+
+def load_precomputed_dq(tickers, max_age_hours=DQ_MAX_AGE_HOURS, live_quotes=True):
+    """Return {TICKER: dip_row} for every ticker with a fresh precomputed row.
+
+    Rows are re-scored against one batched live quote request. Tickers that
+    are missing or stale are left out so the caller can fetch them live.
+    """
+    syms = [t.upper() for t in tickers]
+    if not syms:
+        return {}
+    cutoff = time.time() - max_age_hours * 3600
+    try:
+        with _local_db(_DQ_TABLE_DDL) as conn:
+            qmarks = ",".join("?" * len(syms))
+            stored = conn.execute(
+                f"SELECT * FROM dip_dq_scores WHERE computed_at >= ? AND ticker IN ({qmarks})",
+                [cutoff] + syms,
+            ).fetchall()
+    except Exception:
+        return {}
+    if not stored:
+        return {}
+    quotes = get_quotes_batch(tuple(r["ticker"] for r in stored)) if live_quotes else {}
+    out = {}
+    for r in stored:
+        try:
+            out[r["ticker"]] = _rescore_dip_row(r, quotes.get(r["ticker"]))
+        except Exception:
+            continue
+    return out
+
+
+def run_dq_batch(tickers=None, max_workers=DQ_BATCH_WORKERS, persist=True):
+    """Compute DQ rows for the universe (or `tickers`) and store them.
+
+    Returns run stats — wall time, per-ticker latency percentiles, ok/failed
+    counts — which are also appended to dip_dq_runs so batch runtime can be
+    tracked over time.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    tickers = list(tickers) if tickers else _dq_universe()
+    started = time.time()
+    latencies, rows, failed = [], [], []
+
+    def _timed(tk):
+        t0 = time.time()
+        r = _fetch_dip_row(tk)
+        return r, time.time() - t0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as exe:
+        for fut in as_completed([exe.submit(_timed, tk) for tk in tickers]):
+            r, dt = fut.result()
+            latencies.append(dt)
+            (failed if r.get("error") else rows).append(r)
+
+    if persist and rows:
+        _store_dq_rows(rows)
+
+    lat = np.array(latencies) if latencies else np.zeros(1)
+    stats = {
+        "started_at": started,
+        "elapsed_s":  round(time.time() - started, 2),
+        "workers":    max_workers,
+        "n_tickers":  len(tickers),
+        "n_ok":       len(rows),
+        "n_failed":   len(failed),
+        "p50_s":      round(float(np.percentile(lat, 50)), 2),
+        "p95_s":      round(float(np.percentile(lat, 95)), 2),
+        "max_s":      round(float(lat.max()), 2),
+        "failed":     [f["ticker"] for f in failed],
+    }
+    if persist:
+        try:
+            with _local_db(_DQ_TABLE_DDL) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO dip_dq_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    tuple(stats[k] for k in ("started_at", "elapsed_s", "workers", "n_tickers",
+                                             "n_ok", "n_failed", "p50_s", "p95_s", "max_s")),
+                )
+        except Exception as e:
+            print(f"[DQ_BATCH] Could not record run stats: {e}")
+    print(f"[DQ_BATCH] {stats['n_ok']}/{stats['n_tickers']} tickers in {stats['elapsed_s']}s "
+          f"(p50 {stats['p50_s']}s, p95 {stats['p95_s']}s, workers={max_workers})")
+    return stats
+
+
+def benchmark_dq_batch(sample_size=20, worker_counts=(4, 8, 16)):
+    """Time run_dq_batch on a fixed universe sample at several pool sizes.
+
+    Runs without persisting. The first pass warms st.cache_data, so it's
+    reported separately as the cold number; the rest are warm-cache timings.
+    Returns a DataFrame with one row per run.
+    """
+    sample = _dq_universe()[:sample_size]
+    runs = []
+    for i, w in enumerate((worker_counts[0],) + tuple(worker_counts)):
+        s = run_dq_batch(sample, max_workers=w, persist=False)
+        s["cache"] = "cold" if i == 0 else "warm"
+        runs.append(s)
+    df = pd.DataFrame(runs)
+    df["tickers_per_s"] = (df["n_tickers"] / df["elapsed_s"].clip(lower=0.01)).round(1)
+    return df[["cache", "workers", "n_tickers", "n_ok", "elapsed_s", "tickers_per_s",
+               "p50_s", "p95_s", "max_s"]]
+
+
+def get_last_dq_run():
+    """Most recent dip_dq_runs row as a dict, or None."""
+    try:
+        with _local_db(_DQ_TABLE_DDL) as conn:
+            r = conn.execute("SELECT * FROM dip_dq_runs ORDER BY started_at DESC LIMIT 1").fetchone()
+        return dict(r) if r else None
+    except Exception:
+        return None
+
+
+def _start_daily_job(name, hour, fn, last_run_fn):
+    """Start a daemon thread that runs `fn()` once a day at `hour` UTC.
+
+    Wakes every 10 minutes; runs when the UTC hour is `hour` and
+    `last_run_fn()` (epoch seconds of the last run, or None) is over 20 hours
+    old. `hour` < 0 disables the job (e.g. when an external cron drives it).
+    `name` tags log lines and the thread. Wrap callers in st.cache_resource
+    so each job starts once per process.
+    """
+    if hour < 0:
+        return None
+
+    def _loop():
+        while True:
+            try:
+                last = last_run_fn()
+                due = not last or time.time() - last > 20 * 3600
+                if due and datetime.utcnow().hour == hour:
+                    fn()
+            except Exception as e:
+                print(f"[{name}] Scheduler error: {e}")
+            time.sleep(600)
+
+    th = threading.Thread(target=_loop, name=f"{name.lower().replace('_', '-')}-scheduler", daemon=True)
+    th.start()
+    return th
+
+
+@st.cache_resource(show_spinner=False)
+def _start_dq_scheduler():
+    """Start (once per process) the nightly DQ batch at DQ_BATCH_HOUR_UTC (-1 disables)."""
+    return _start_daily_job("DQ_BATCH", DQ_BATCH_HOUR_UTC, run_dq_batch,
+                            lambda: (get_last_dq_run() or {}).get("started_at"))
+
+
 def render_dip_finder_page(tickers, chart_title="Dip Finder"):
     """
     Supercharged Dip Finder:
@@ -7434,131 +7956,84 @@ def render_dip_finder_page(tickers, chart_title="Dip Finder"):
     # ── Fetch all data in parallel ──────────────────────────────────────────
     from concurrent.futures import ThreadPoolExecutor, as_completed
 
-    def _fetch_one(tk):
-        """Fetch all data for a single ticker concurrently."""
-        try:
-            import concurrent.futures as _cf
-            with _cf.ThreadPoolExecutor(max_workers=7) as _inner:
-                f_quote   = _inner.submit(lambda: get_quote(tk) or {})
-                f_profile = _inner.submit(lambda: get_profile(tk) or {})
-                f_ratios  = _inner.submit(lambda: get_ratios_ttm(tk) or {})
-                f_rev_g   = _inner.submit(lambda: get_revenue_growth(tk))
-                f_cons    = _inner.submit(lambda: get_analyst_consensus(tk) or {})
-                f_pt_con  = _inner.submit(lambda: get_price_target_consensus(tk) or {})
-                f_tech    = _inner.submit(lambda: _get_technicals_for_dip(tk))
-
-                quote   = f_quote.result(timeout=15)
-                profile = f_profile.result(timeout=15)
-                ratios  = f_ratios.result(timeout=15)
-                rev_g   = f_rev_g.result(timeout=15)
-                cons    = f_cons.result(timeout=15)
-                pt_con  = f_pt_con.result(timeout=15)
-                tech    = f_tech.result(timeout=15)
-
-            price     = quote.get("price", 0) or 0
-            year_high = quote.get("yearHigh", 0) or 0
-            year_low  = quote.get("yearLow", 0)  or 0
-            pct_high  = ((price - year_high) / year_high * 100) if year_high > 0 else None
-            name      = profile.get("companyName", tk)
-            sector    = profile.get("sector", "")
-            dq        = _score_dip_quality(quote, profile, ratios, rev_g, cons, pt_con, tech)
-
-            return {
-                "ticker": tk.upper(),
-                "name":   name,
-                "price":  price,
-                "year_high": year_high,
-                "year_low":  year_low,
-                "pct_high":  pct_high,
-                "sector": sector,
-                "quote":  quote,
-                "profile": profile,
-                "ratios": ratios,
-                "rev_growth": rev_g,
-                "consensus":  cons,
-                "pt_consensus": pt_con,
-                "tech":   tech,
-                "dq":     dq,
-            }
-        except Exception:
-            return None
-
-    all_rows = []
-    with st.spinner(f"Crunching signals for {len(tickers)} stock(s)…"):
-        with ThreadPoolExecutor(max_workers=min(len(tickers), 10)) as outer:
-            futures = {outer.submit(_fetch_one, tk): tk for tk in tickers}
-            for future in as_completed(futures):
-                result = future.result()
-                if result:
-                    all_rows.append(result)
-
-    if not all_rows:
-        st.warning("Could not fetch data for any tickers. Check that they are valid.")
-        return
-
-    # Sort by DQ score descending
-    all_rows.sort(key=lambda r: r["dq"]["total"], reverse=True)
-
-    # ── Filters ─────────────────────────────────────────────────────────────
-    # ── DQ Score legend ─────────────────────────────────────────────────────
-    st.markdown("""
-    <div style="background:#EBF5FB; border:1px solid #90CAF9; border-radius:12px;
-                padding:12px 20px; margin-bottom:16px; font-size:12px; color:#1a1a1a;">
-        <b>DQ Score (0–100):</b> Ranks dip quality across 6 signals — analyst targets, valuation, technicals, momentum, moat, AI risk.
-        <br>
-        <span style="color:#00C853; font-weight:700;">■ 72+ Strong Buy</span> &nbsp;
-        <span style="color:#00BFA5; font-weight:700;">■ 55–71 Quality</span> &nbsp;
-        <span style="color:#E6AC00; font-weight:700;">■ 40–54 Watch</span> &nbsp;
-        <span style="color:#FF6D00; font-weight:700;">■ 25–39 Risky</span> &nbsp;
-        <span style="color:#FF1744; font-weight:700;">■ 0–24 Knife</span>
-    </div>
-    """, unsafe_allow_html=True)
-
-    with st.expander("⚙️ Filters", expanded=False):
-        fc1, fc2, fc3 = st.columns(3)
-        with fc1:
-            min_dq = st.slider("Min DQ Score", 0, 100, 0, 5, key=f"df_mindq_{chart_title}")
-        with fc2:
-            verdict_filter = st.multiselect(
-                "Verdict",
-                ["Strong Buy Dip", "Quality Dip", "Watch Zone", "Risky Dip", "Falling Knife"],
-                default=[],
-                key=f"df_verdict_{chart_title}",
-                placeholder="All",
-            )
-        with fc3:
-            max_rsi = st.slider("Max RSI", 0, 100, 100, 5, key=f"df_rsi_{chart_title}")
-
-    filtered = []
-    for r in all_rows:
+    def _passes_filters(r):
         if r["dq"]["total"] < min_dq:
-            continue
+            return False
         if verdict_filter and r["dq"]["verdict"] not in verdict_filter:
-            continue
+            return False
         rsi_val = r["tech"].get("rsi")
         if rsi_val is not None and rsi_val > max_rsi:
-            continue
-        filtered.append(r)
+            return False
+        return True
 
-    if not filtered:
-        st.info("No stocks match the current filters.")
-        return
+    def _card_html(row):
+        dq = row["dq"]
+        pct_str = f"{row['pct_high']:+.1f}%" if row["pct_high"] is not None else "N/A"
+        pt_med = (row["pt_consensus"] or {}).get("targetMedian") or (row["pt_consensus"] or {}).get("targetConsensus")
+        upside = (pt_med - row["price"]) / row["price"] * 100 if pt_med and row["price"] > 0 else None
+        upside_str = f"+{upside:.1f}% PT" if upside is not None else "No PT"
+        return f"""
+            <div style="background:{CARD_BG_SOLID}; border:2px solid {dq['badge_color']};
+                        border-radius:14px; padding:18px 20px; margin-bottom:12px;">
+                <div style="display:flex; justify-content:space-between; align-items:flex-start;">
+                    <div>
+                        <div style="font-size:18px; font-weight:700; color:#1a1a1a;">{row['ticker']}</div>
+                        <div style="font-size:11px; color:rgba(26,26,26,0.6); max-width:160px;
+                                    overflow:hidden; text-overflow:ellipsis; white-space:nowrap;">
+                            {row['name']}
+                        </div>
+                    </div>
+                    <div style="text-align:right;">
+                        <div style="font-size:16px; font-weight:700; color:#1a1a1a;">${row['price']:.2f}</div>
+                        <div style="font-size:11px; color:#FF6B6B;">{pct_str} from high</div>
+                        <div style="font-size:11px; color:#00C853;">{upside_str}</div>
+                    </div>
+                </div>
+                <div style="margin:10px 0 6px 0; display:flex; align-items:center; gap:10px;">
+                    <span style="background:{dq['badge_bg']}; color:{dq['badge_color']};
+                                 border:1px solid {dq['badge_border']}; border-radius:20px;
+                                 padding:3px 12px; font-size:12px; font-weight:700;">
+                        {dq['verdict']}
+                    </span>
+                    <div style="font-size:20px; font-weight:800; color:{dq['badge_color']}; display:inline-block;">
+                        {dq['total']} <span style="font-size:12px; color:rgba(26,26,26,0.5); font-weight:400;">/100</span>
+                    </div>
+                </div>
+                <div style="display:flex; gap:5px; flex-wrap:wrap;">
+                    {_dq_pillar_dot(dq['scores']['analyst_target'], 25, 'PT')}
+                    {_dq_pillar_dot(dq['scores']['valuation'], 25, 'Val')}
+                    {_dq_pillar_dot(dq['scores']['technicals'], 20, 'Tech')}
+                    {_dq_pillar_dot(dq['scores']['momentum'], 15, 'Mom')}
+                    {_dq_pillar_dot(dq['scores']['moat'], 10, 'Moat')}
+                    {_dq_pillar_dot(dq['scores']['disruption'], 5, 'AI Risk')}
+                </div>
+            </div>
+            """
 
-    # ── Hero card — Best Dip ─────────────────────────────────────────────────
-    best = filtered[0]
-    b    = best["dq"]
-    b_pt = best["pt_consensus"]
-    b_t  = best["tech"]
-    b_pct_high = best["pct_high"]
-    b_price    = best["price"]
-    b_pt_med   = b_pt.get("targetMedian") or b_pt.get("targetConsensus")
-    b_upside   = (b_pt_med - b_price) / b_price * 100 if b_pt_med and b_price > 0 else None
-
-    hero_upside_str = f"+{b_upside:.1f}% to PT" if b_upside is not None else ""
-    hero_dip_str    = f"{b_pct_high:+.1f}% from 52W high" if b_pct_high is not None else ""
-    hero_rsi_str    = f"RSI {b_t.get('rsi', 0):.0f}" if b_t.get("rsi") else ""
+    def _error_card_html(row):
+        return f"""
+            <div style="background:{CARD_BG_SOLID}; border:2px dashed #BDBDBD;
+                        border-radius:14px; padding:18px 20px; margin-bottom:12px;">
+                <div style="font-size:18px; font-weight:700; color:#1a1a1a;">{sanitize_ticker(row['ticker'])}</div>
+                <div style="font-size:12px; color:#C62828; margin-top:6px;">⚠️ {row['error']}</div>
+                <div style="font-size:11px; color:{TEXT_DIM}; margin-top:4px;">Not ranked — refresh to retry.</div>
+            </div>
+            """
 
-    st.markdown(f"""
+    def _hero_html(best):
+        b    = best["dq"]
+        b_pt = best["pt_consensus"]
+        b_t  = best["tech"]
+        b_pct_high = best["pct_high"]
+        b_price    = best["price"]
+        b_pt_med   = b_pt.get("targetMedian") or b_pt.get("targetConsensus")
+        b_upside   = (b_pt_med - b_price) / b_price * 100 if b_pt_med and b_price > 0 else None
+
+        hero_upside_str = f"+{b_upside:.1f}% to PT" if b_upside is not None else ""
+        hero_dip_str    = f"{b_pct_high:+.1f}% from 52W high" if b_pct_high is not None else ""
+        hero_rsi_str    = f"RSI {b_t.get('rsi', 0):.0f}" if b_t.get("rsi") else ""
+
+        return f"""
     <div style="background:linear-gradient(135deg,{b['badge_bg']} 0%,{CARD_BG} 100%);
                 border:2px solid {b['badge_color']}; border-radius:18px;
                 padding:24px 28px; margin-bottom:20px; position:relative;">
@@ -7599,59 +8074,129 @@ def render_dip_finder_page(tickers, chart_title="Dip Finder"):
             {_dq_pillar_dot(b['scores']['disruption'], 5, 'Disruption')}
         </div>
     </div>
+    """
+
+    # ── Filters ─────────────────────────────────────────────────────────────
+    # ── DQ Score legend ─────────────────────────────────────────────────────
+    st.markdown("""
+    <div style="background:#EBF5FB; border:1px solid #90CAF9; border-radius:12px;
+                padding:12px 20px; margin-bottom:16px; font-size:12px; color:#1a1a1a;">
+        <b>DQ Score (0–100):</b> Ranks dip quality across 6 signals — analyst targets, valuation, technicals, momentum, moat, AI risk.
+        <br>
+        <span style="color:#00C853; font-weight:700;">■ 72+ Strong Buy</span> &nbsp;
+        <span style="color:#00BFA5; font-weight:700;">■ 55–71 Quality</span> &nbsp;
+        <span style="color:#E6AC00; font-weight:700;">■ 40–54 Watch</span> &nbsp;
+        <span style="color:#FF6D00; font-weight:700;">■ 25–39 Risky</span> &nbsp;
+        <span style="color:#FF1744; font-weight:700;">■ 0–24 Knife</span>
+    </div>
     """, unsafe_allow_html=True)
 
-    # ── Card grid ────────────────────────────────────────────────────────────
-    st.markdown(f"#### All Stocks ({len(filtered)} shown)")
+    # Filters are read before the fetch so cards can be filtered as they stream in.
+    with st.expander("⚙️ Filters", expanded=False):
+        fc1, fc2, fc3 = st.columns(3)
+        with fc1:
+            min_dq = st.slider("Min DQ Score", 0, 100, 0, 5, key=f"df_mindq_{chart_title}")
+        with fc2:
+            verdict_filter = st.multiselect(
+                "Verdict",
+                ["Strong Buy Dip", "Quality Dip", "Watch Zone", "Risky Dip", "Falling Knife"],
+                default=[],
+                key=f"df_verdict_{chart_title}",
+                placeholder="All",
+            )
+        with fc3:
+            max_rsi = st.slider("Max RSI", 0, 100, 100, 5, key=f"df_rsi_{chart_title}")
 
-    # 2 columns of cards
+    # ── Progressive layout: hero + one placeholder slot per ticker ──────────
+    # Cards stream into their slot as each ticker's fetches complete; the
+    # hero and the ranked order are settled once every ticker has reported.
+    hero_slot   = st.empty()
+    status_slot = st.empty()
+    grid_header = st.empty()
     cols = st.columns(2)
-    for idx, row in enumerate(filtered):
-        dq  = row["dq"]
-        col = cols[idx % 2]
-        with col:
-            pct_str = f"{row['pct_high']:+.1f}%" if row["pct_high"] is not None else "N/A"
-            pt_med = (row["pt_consensus"] or {}).get("targetMedian") or (row["pt_consensus"] or {}).get("targetConsensus")
-            upside = (pt_med - row["price"]) / row["price"] * 100 if pt_med and row["price"] > 0 else None
-            upside_str = f"+{upside:.1f}% PT" if upside is not None else "No PT"
+    slots = [cols[i % 2].empty() for i in range(len(tickers))]
+    slot_for = {tk.upper(): slots[i] for i, tk in enumerate(tickers)}
 
-            st.markdown(f"""
-            <div style="background:{CARD_BG_SOLID}; border:2px solid {dq['badge_color']};
-                        border-radius:14px; padding:18px 20px; margin-bottom:12px;">
-                <div style="display:flex; justify-content:space-between; align-items:flex-start;">
-                    <div>
-                        <div style="font-size:18px; font-weight:700; color:#1a1a1a;">{row['ticker']}</div>
-                        <div style="font-size:11px; color:rgba(26,26,26,0.6); max-width:160px;
-                                    overflow:hidden; text-overflow:ellipsis; white-space:nowrap;">
-                            {row['name']}
-                        </div>
-                    </div>
-                    <div style="text-align:right;">
-                        <div style="font-size:16px; font-weight:700; color:#1a1a1a;">${row['price']:.2f}</div>
-                        <div style="font-size:11px; color:#FF6B6B;">{pct_str} from high</div>
-                        <div style="font-size:11px; color:#00C853;">{upside_str}</div>
-                    </div>
-                </div>
-                <div style="margin:10px 0 6px 0; display:flex; align-items:center; gap:10px;">
-                    <span style="background:{dq['badge_bg']}; color:{dq['badge_color']};
-                                 border:1px solid {dq['badge_border']}; border-radius:20px;
-                                 padding:3px 12px; font-size:12px; font-weight:700;">
-                        {dq['verdict']}
-                    </span>
-                    <div style="font-size:20px; font-weight:800; color:{dq['badge_color']}; display:inline-block;">
-                        {dq['total']} <span style="font-size:12px; color:rgba(26,26,26,0.5); font-weight:400;">/100</span>
-                    </div>
-                </div>
-                <div style="display:flex; gap:5px; flex-wrap:wrap;">
-                    {_dq_pillar_dot(dq['scores']['analyst_target'], 25, 'PT')}
-                    {_dq_pillar_dot(dq['scores']['valuation'], 25, 'Val')}
-                    {_dq_pillar_dot(dq['scores']['technicals'], 20, 'Tech')}
-                    {_dq_pillar_dot(dq['scores']['momentum'], 15, 'Mom')}
-                    {_dq_pillar_dot(dq['scores']['moat'], 10, 'Moat')}
-                    {_dq_pillar_dot(dq['scores']['disruption'], 5, 'AI Risk')}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+    with hero_slot.container():
+        show_skeleton_loader(height=180, message="Ranking the best dip…")
+    grid_header.markdown(f"#### All Stocks (loading {len(tickers)}…)")
+    for tk, slot in slot_for.items():
+        with slot.container():
+            show_skeleton_loader(height=150, message=f"Crunching {sanitize_ticker(tk)}…")
+
+    all_rows = []
+    failed_rows = []
+
+    def _show(result):
+        slot = slot_for.get(result["ticker"])
+        if result.get("error"):
+            failed_rows.append(result)
+            if slot is not None:
+                slot.markdown(_error_card_html(result), unsafe_allow_html=True)
+        else:
+            all_rows.append(result)
+            if slot is not None:
+                if _passes_filters(result):
+                    slot.markdown(_card_html(result), unsafe_allow_html=True)
+                else:
+                    slot.empty()
+        status_slot.caption(
+            f"Loaded {len(all_rows) + len(failed_rows)}/{len(slot_for)} — {len(failed_rows)} failed"
+        )
+
+    # Precomputed rows (nightly batch, re-scored at the live price) land first;
+    # only tickers outside the table or with stale rows take the 7-fetch path.
+    _start_dq_scheduler()
+    precomputed = load_precomputed_dq(list(slot_for))
+    for tk in slot_for:
+        if tk in precomputed:
+            _show(precomputed[tk])
+
+    pending = [tk for tk in slot_for if tk not in precomputed]
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(len(pending), 10)) as outer:
+            futures = [outer.submit(_fetch_dip_row, tk) for tk in pending]
+            for future in as_completed(futures):
+                _show(future.result())
+
+    status_slot.empty()
+
+    if not all_rows:
+        hero_slot.empty()
+        grid_header.empty()
+        st.warning("Could not fetch data for any tickers. Check that they are valid.")
+        return
+
+    # Sort by DQ score descending
+    all_rows.sort(key=lambda r: r["dq"]["total"], reverse=True)
+    filtered = [r for r in all_rows if _passes_filters(r)]
+
+    # ── Final pass: ranked cards first, failures after, spare slots cleared ─
+    ranked = [_card_html(r) for r in filtered] + [_error_card_html(r) for r in failed_rows]
+    for i, slot in enumerate(slots):
+        if i < len(ranked):
+            slot.markdown(ranked[i], unsafe_allow_html=True)
+        else:
+            slot.empty()
+
+    if not filtered:
+        hero_slot.info("No stocks match the current filters.")
+        grid_header.empty()
+        return
+
+    # ── Hero card — Best Dip ─────────────────────────────────────────────────
+    hero_slot.markdown(_hero_html(filtered[0]), unsafe_allow_html=True)
+
+    # ── Card grid ────────────────────────────────────────────────────────────
+    _failed_note = f" · {len(failed_rows)} failed" if failed_rows else ""
+    grid_header.markdown(f"#### All Stocks ({len(filtered)} shown{_failed_note})")
+    if precomputed:
+        _oldest = min(r["computed_at"] for r in precomputed.values())
+        st.caption(
+            f"{len(precomputed)} of {len(slot_for)} scored from the nightly DQ table "
+            f"(inputs as of {datetime.fromtimestamp(_oldest).strftime('%b %d %H:%M')}, "
+            f"re-priced live)"
+        )
 
     # ── Detail drill-down ─────────────────────────────────────────────────────
     st.markdown("---")
@@ -8073,173 +8618,523 @@ def get_company_logo(ticker):
     return f"https://s3-symbol-logo.tradingview.com/{ticker_upper.lower()}--big.svg"
 
 
-def display_stock_with_logo(ticker, size=30):
-    """Display stock ticker with logo inline using HTML"""
-    safe_ticker = sanitize_ticker(ticker)
-    logo_url = get_company_logo(safe_ticker)
-    if logo_url:
-        return f'<img src="{logo_url}" width="{size}" height="{size}" style="vertical-align: middle; margin-right: 8px; border-radius: 4px;"> <strong>{safe_ticker}</strong>'
-    return f'<strong>{safe_ticker}</strong>'
+def display_stock_with_logo(ticker, size=30):
+    """Display stock ticker with logo inline using HTML"""
+    safe_ticker = sanitize_ticker(ticker)
+    logo_url = get_company_logo(safe_ticker)
+    if logo_url:
+        return f'<img src="{logo_url}" width="{size}" height="{size}" style="vertical-align: middle; margin-right: 8px; border-radius: 4px;"> <strong>{safe_ticker}</strong>'
+    return f'<strong>{safe_ticker}</strong>'
+
+@st.cache_data(ttl=900)
+def get_stock_specific_news(ticker, limit=10):
+    """Get STOCK-SPECIFIC news using Perplexity API (FMP news endpoint is legacy)"""
+    import json
+    
+    perplexity_api_key = os.environ.get('PERPLEXITY_API_KEY', '')
+    if not perplexity_api_key:
+        return []
+    
+    try:
+        # Use Perplexity to get recent news about the stock
+        content = cached_chat_completion(
+            "perplexity",
+            [
+                {"role": "system", "content": "You are a financial news aggregator. Return ONLY a JSON array of news articles. No other text."},
+                {"role": "user", "content": f"""Find the {limit} most recent news articles about {ticker} stock from the past 7 days.
+Return ONLY a valid JSON array with this exact format (no other text):
+[
+  {{"title": "Article headline", "url": "https://source.com/article", "publishedDate": "2025-12-30", "source": "Source Name"}},
+  ...
+]
+Include real URLs from reputable financial news sources like Reuters, Bloomberg, CNBC, Yahoo Finance, MarketWatch, etc."""}
+            ],
+            max_tokens=1500, temperature=0.1, ttl_class="news", timeout=15
+        )
+        if content:
+            # Try to parse JSON from the response
+            try:
+                # Find JSON array in the response
+                start_idx = content.find('[')
+                end_idx = content.rfind(']') + 1
+                if start_idx != -1 and end_idx > start_idx:
+                    json_str = content[start_idx:end_idx]
+                    articles = json.loads(json_str)
+                    if isinstance(articles, list) and len(articles) > 0:
+                        return articles[:limit]
+            except json.JSONDecodeError:
+                pass
+    except Exception as e:
+        pass
+    
+    return []
+
+
+# ============= AI RESPONSE CACHE (disk-backed) =============
+# Provider responses in the local cache DB keyed on sha256(provider, model,
+# normalized prompt, temperature), so identical prompts are answered from
+# disk across reruns, restarts and worker processes. Each caller picks a TTL
+# class; the table is kept under AI_CACHE_MAX_MB by evicting least recently
+# used rows. Hits / misses and the tokens (and rough $) a hit avoided are
+# counted per TTL class in ai_cache_stats.
+import hashlib
+
+AI_CACHE_TTL_CLASSES = {
+    "news": 30 * 60,            # headlines move fast
+    "chat": 3600,
+    "analysis": 6 * 3600,       # risk flags, verdicts, JSON analyses
+    "reference": 86400,         # price targets and other slow facts
+    "grading": 7 * 86400,       # same thesis + same prices → same grade
+}
+AI_CACHE_MAX_MB = float(os.environ.get("AI_CACHE_MAX_MB", "64"))
+AI_TOKEN_PRICE_PER_M = {"perplexity": 1.0, "grok": 5.0, "openai": 0.6}   # blended $/1M tokens (estimate)
+_AI_CACHE_EVICT_EVERY = 50      # writes between size checks
+
+_AI_CACHE_DDL = """
+CREATE TABLE IF NOT EXISTS ai_cache (
+    key        TEXT PRIMARY KEY,
+    provider   TEXT,
+    model      TEXT,
+    ttl_class  TEXT,
+    content    TEXT NOT NULL,
+    tokens     INTEGER,
+    created_at REAL,
+    expires_at REAL,
+    last_used  REAL,
+    hits       INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ai_cache_last_used ON ai_cache (last_used);
+CREATE TABLE IF NOT EXISTS ai_cache_stats (
+    ttl_class    TEXT PRIMARY KEY,
+    hits         INTEGER DEFAULT 0,
+    misses       INTEGER DEFAULT 0,
+    tokens_saved INTEGER DEFAULT 0,
+    cost_saved   REAL DEFAULT 0
+);
+"""
+_AI_CACHE_WRITES = [0]
+
+
+def _normalize_prompt(messages):
+    """Role-tagged message text with whitespace runs collapsed."""
+    return "\n".join(f"{m.get('role', 'user')}: {' '.join(str(m.get('content', '')).split())}"
+                     for m in messages)
+
+
+def ai_cache_key(provider, model, messages, temperature):
+    raw = json.dumps([provider, model, _normalize_prompt(messages), round(float(temperature or 0), 2)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _ai_cache_count(conn, ttl_class, hit, tokens=0, cost=0.0):
+    conn.execute("INSERT OR IGNORE INTO ai_cache_stats (ttl_class) VALUES (?)", (ttl_class,))
+    conn.execute(
+        "UPDATE ai_cache_stats SET hits = hits + ?, misses = misses + ?, tokens_saved = tokens_saved + ?, "
+        "cost_saved = cost_saved + ? WHERE ttl_class = ?",
+        (int(hit), int(not hit), int(tokens), float(cost), ttl_class),
+    )
+
+
+def ai_cache_get(keys, ttl_class):
+    """First fresh (key, content) among `keys` (in order), else (None, None). Counts one hit/miss."""
+    now = time.time()
+    try:
+        with _local_db(_AI_CACHE_DDL) as conn:
+            rows = {r["key"]: r for r in conn.execute(
+                f"SELECT key, provider, content, tokens FROM ai_cache "
+                f"WHERE key IN ({','.join('?' * len(keys))}) AND expires_at >= ?", list(keys) + [now])}
+            key = next((k for k in keys if k in rows), None)
+            if key is None:
+                _ai_cache_count(conn, ttl_class, False)
+                return None, None
+            row = rows[key]
+            conn.execute("UPDATE ai_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            tokens = row["tokens"] or 0
+            _ai_cache_count(conn, ttl_class, True, tokens,
+                            tokens * AI_TOKEN_PRICE_PER_M.get(row["provider"], 1.0) / 1e6)
+            return key, row["content"]
+    except Exception as e:
+        print(f"[AI_CACHE] get failed: {e}")
+        return None, None
+
+
+def ai_cache_put(key, provider, model, ttl_class, content, tokens=None):
+    if not content:
+        return
+    now = time.time()
+    try:
+        with _local_db(_AI_CACHE_DDL) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, provider, model, ttl_class, content, tokens, "
+                "created_at, expires_at, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, provider, model, ttl_class, content, tokens, now,
+                 now + AI_CACHE_TTL_CLASSES.get(ttl_class, 3600), now),
+            )
+            _AI_CACHE_WRITES[0] += 1
+            if _AI_CACHE_WRITES[0] % _AI_CACHE_EVICT_EVERY == 1:
+                _evict_ai_cache(conn)
+    except Exception as e:
+        print(f"[AI_CACHE] put failed: {e}")
+
+
+def _evict_ai_cache(conn):
+    """Drop expired rows, then least recently used rows until under the size budget."""
+    conn.execute("DELETE FROM ai_cache WHERE expires_at < ?", (time.time(),))
+    budget = AI_CACHE_MAX_MB * 1024 * 1024
+    rows = conn.execute("SELECT key, LENGTH(content) AS size FROM ai_cache ORDER BY last_used DESC").fetchall()
+    sizes = np.cumsum([r["size"] for r in rows]) if rows else []
+    stale = [(r["key"],) for r, total in zip(rows, sizes) if total > budget * 0.9]
+    if stale:
+        conn.executemany("DELETE FROM ai_cache WHERE key = ?", stale)
+        print(f"[AI_CACHE] evicted {len(stale)} entries")
+
+
+def get_ai_cache_stats():
+    """{'classes': [{ttl_class, hits, misses, hit_rate, tokens_saved, cost_saved}], 'entries', 'size_mb'}."""
+    try:
+        with _local_db(_AI_CACHE_DDL) as conn:
+            classes = [dict(r) for r in conn.execute("SELECT * FROM ai_cache_stats ORDER BY ttl_class")]
+            size = conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(LENGTH(content)), 0) AS b FROM ai_cache").fetchone()
+    except Exception:
+        return {"classes": [], "entries": 0, "size_mb": 0.0}
+    for c in classes:
+        total = c["hits"] + c["misses"]
+        c["hit_rate"] = round(c["hits"] / total, 3) if total else None
+    return {"classes": classes, "entries": size["n"], "size_mb": round(size["b"] / 1048576, 2)}
+
+
+def _post_chat(provider, payload, timeout):
+    """POST a chat completion → (status, content, total tokens)."""
+    cfg = LLM_PROVIDERS[provider]
+    response = requests.post(
+        cfg["url"], json=payload, timeout=timeout,
+        headers={"Authorization": f"Bearer {os.environ.get(cfg['key'], '')}",
+                 "Content-Type": "application/json"},
+    )
+    if response.status_code != 200:
+        return response.status_code, "", 0
+    data = response.json()
+    content = data.get("choices", [{}])[0].get("message", {}).get("content", "") or ""
+    return 200, content, (data.get("usage") or {}).get("total_tokens") or 0
+
+
+def cached_chat_completion(provider, messages, max_tokens=1000, temperature=0.3, ttl_class="analysis",
+                           timeout=30, overrides=None):
+    """Single-provider chat completion through the AI cache. Returns content or None."""
+    cfg = LLM_PROVIDERS[provider]
+    if not os.environ.get(cfg["key"], ""):
+        return None
+    key = ai_cache_key(provider, cfg["model"], messages, temperature) if ttl_class else None
+    if key:
+        _, cached = ai_cache_get([key], ttl_class)
+        if cached is not None:
+            return cached
+    payload = {"model": cfg["model"], "messages": messages, "max_tokens": max_tokens}
+    if temperature is not None:
+        payload["temperature"] = temperature
+    payload.update(overrides or {})
+    try:
+        status, content, tokens = _post_chat(provider, payload, timeout)
+    except Exception:
+        return None
+    if status != 200 or not content:
+        return None
+    if key:
+        ai_cache_put(key, provider, cfg["model"], ttl_class, content, tokens)
+    return content
+
+
+# ============= LLM PROVIDER ROUTER (hedged racing) =============
+# Instead of waiting out a 30 s timeout per provider in sequence, the router
+# sends to the first provider and, if it hasn't produced a valid answer after
+# a hedge delay (its recent p95 latency, clamped), launches the next one too.
+# The first response that passes the caller's validator wins; providers not
+# yet started are skipped and in-flight losers are abandoned (their outcome is
+# still recorded). Per-provider latency/error histograms are kept process-wide
+# and a provider whose recent error rate or p95 degrades is moved to the back.
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+LLM_PROVIDERS = {
+    "perplexity": {"url": "https://api.perplexity.ai/chat/completions", "model": "sonar", "key": "PERPLEXITY_API_KEY"},
+    "grok": {"url": "https://api.x.ai/v1/chat/completions", "model": "grok-beta", "key": "GROK_API_KEY"},
+    "openai": {"url": "https://api.openai.com/v1/chat/completions", "model": "gpt-4o-mini", "key": "OPENAI_API_KEY"},
+}
+LLM_TIMEOUT_S = 30
+LLM_HEDGE_DELAY_S = float(os.environ.get("LLM_HEDGE_DELAY_S", "0") or 0)  # fixed delay; 0 = p95-based
+LLM_HEDGE_DEFAULT_S = 6.0       # until a provider has enough samples
+LLM_HEDGE_BOUNDS_S = (1.5, 15.0)
+LLM_STATS_WINDOW = 50           # recent calls per provider used for p95 / error rate
+LLM_STATS_HORIZON_S = 900       # ...within this age, so a demoted provider gets retried later
+LLM_DEGRADED_ERROR_RATE = 0.5
+LLM_DEGRADED_P95_S = 20.0
+LLM_LATENCY_BUCKETS_S = (0.5, 1, 2, 4, 8, 16, 30)
+
+_LLM_STATS = {}
+_LLM_STATS_LOCK = threading.Lock()
+_LLM_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm")
+
+
+def _llm_stats(provider):
+    s = _LLM_STATS.get(provider)
+    if s is None:
+        s = _LLM_STATS[provider] = {
+            "recent": deque(maxlen=LLM_STATS_WINDOW),        # (ts, ok, seconds)
+            "latency_hist": [0] * (len(LLM_LATENCY_BUCKETS_S) + 1),
+            "errors": {}, "calls": 0, "wins": 0,
+            "ttft": deque(maxlen=LLM_STATS_WINDOW),          # streaming time-to-first-token
+        }
+    return s
+
+
+def _record_llm_outcome(provider, seconds, error=None):
+    with _LLM_STATS_LOCK:
+        s = _llm_stats(provider)
+        s["calls"] += 1
+        s["recent"].append((time.time(), error is None, seconds))
+        if error is None:
+            s["latency_hist"][int(np.searchsorted(LLM_LATENCY_BUCKETS_S, seconds))] += 1
+        else:
+            s["errors"][error] = s["errors"].get(error, 0) + 1
+
+
+def _llm_health(provider):
+    """(p95 seconds of recent successes or None, recent error rate, degraded?)."""
+    cutoff = time.time() - LLM_STATS_HORIZON_S
+    with _LLM_STATS_LOCK:
+        recent = [(good, sec) for ts, good, sec in _llm_stats(provider)["recent"] if ts >= cutoff]
+    ok = [sec for good, sec in recent if good]
+    p95 = float(np.percentile(ok, 95)) if len(ok) >= 5 else None
+    err = (len(recent) - len(ok)) / len(recent) if len(recent) >= 5 else 0.0
+    degraded = err >= LLM_DEGRADED_ERROR_RATE or (p95 is not None and p95 >= LLM_DEGRADED_P95_S)
+    return p95, err, degraded
+
+
+def _llm_hedge_delay(provider):
+    if LLM_HEDGE_DELAY_S > 0:
+        return LLM_HEDGE_DELAY_S
+    p95, _, _ = _llm_health(provider)
+    lo, hi = LLM_HEDGE_BOUNDS_S
+    return LLM_HEDGE_DEFAULT_S if p95 is None else min(max(p95, lo), hi)
+
+
+def llm_provider_order(preferred):
+    """Configured providers in preference order, degraded ones moved to the back."""
+    usable = [p for p in preferred if os.environ.get(LLM_PROVIDERS[p]["key"], "")]
+    return sorted(usable, key=lambda p: _llm_health(p)[2])   # stable: keeps preference among equals
+
+
+def get_llm_provider_stats():
+    """Per-provider summary rows for the debug panel."""
+    rows = []
+    for p in LLM_PROVIDERS:
+        with _LLM_STATS_LOCK:
+            s = _llm_stats(p)
+            hist, errors, calls, wins = list(s["latency_hist"]), dict(s["errors"]), s["calls"], s["wins"]
+            ttft = list(s["ttft"])
+        p95, err, degraded = _llm_health(p)
+        rows.append({
+            "provider": p, "calls": calls, "wins": wins,
+            "p95_s": None if p95 is None else round(p95, 2), "error_rate": round(err, 2),
+            "ttft_p50_s": round(float(np.median(ttft)), 2) if ttft else None,
+            "degraded": degraded, "errors": errors,
+            "latency_hist": dict(zip([f"≤{b}s" for b in LLM_LATENCY_BUCKETS_S] + ["slower"], hist)),
+        })
+    return rows
+
+
+def _llm_attempt(provider, messages, max_tokens, temperature, overrides, validate, cache=None):
+    """One provider call → (provider, parsed value or None). Records latency / error."""
+    cfg = LLM_PROVIDERS[provider]
+    payload = {"model": cfg["model"], "messages": messages, "max_tokens": max_tokens,
+               "temperature": temperature}
+    payload.update(overrides.get(provider, {}))
+    t0 = time.time()
+    try:
+        status, content, tokens = _post_chat(provider, payload, LLM_TIMEOUT_S)
+        if status != 200:
+            _record_llm_outcome(provider, time.time() - t0, f"http_{status}")
+            return provider, None
+        value = validate(content, provider) if content else None
+        _record_llm_outcome(provider, time.time() - t0, None if value is not None else "invalid")
+        if value is not None and cache:
+            ai_cache_put(ai_cache_key(provider, cfg["model"], messages, payload["temperature"]),
+                         provider, cfg["model"], cache, content, tokens)
+        return provider, value
+    except requests.Timeout:
+        _record_llm_outcome(provider, time.time() - t0, "timeout")
+    except Exception as e:
+        _record_llm_outcome(provider, time.time() - t0, type(e).__name__)
+    return provider, None
+
+
+def route_llm(messages, validate, providers=("perplexity", "grok", "openai"), max_tokens=2000,
+              temperature=0.1, overrides=None, label="llm", cache=None):
+    """
+    Race providers with hedging and return (value, provider) or (None, None).
+
+    Args:
+        messages: chat messages (same for every provider)
+        validate: fn(content, provider) → parsed value, or None to reject
+        providers: preference order; degraded providers are tried last
+        overrides: {provider: {payload keys}} e.g. response_format or temperature
+        cache: AI_CACHE_TTL_CLASSES key; a fresh cached answer from any of the
+               providers is returned without a network call
+    """
+    order = llm_provider_order(providers)
+    if not order:
+        return None, None
+    overrides = overrides or {}
+    if cache:
+        keys = {ai_cache_key(p, LLM_PROVIDERS[p]["model"], messages,
+                             overrides.get(p, {}).get("temperature", temperature)): p for p in order}
+        hit_key, content = ai_cache_get(list(keys), cache)
+        value = validate(content, keys[hit_key]) if content else None
+        if value is not None:
+            return value, keys[hit_key]
+    t0 = time.time()
+    pending, queue = set(), list(order)
+    next_hedge = t0
+
+    def launch():
+        provider = queue.pop(0)
+        pending.add(_LLM_POOL.submit(_llm_attempt, provider, messages, max_tokens, temperature,
+                                     overrides, validate, cache))
+        return time.time() + _llm_hedge_delay(provider)
+
+    while pending or queue:
+        if queue and (not pending or time.time() >= next_hedge):
+            next_hedge = launch()
+        timeout = max(0.0, next_hedge - time.time()) if queue else None
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for fut in done:
+            pending.discard(fut)
+            provider, value = fut.result()
+            if value is None:
+                next_hedge = 0.0          # a failure hands over immediately
+                continue
+            with _LLM_STATS_LOCK:
+                _llm_stats(provider)["wins"] += 1
+            print(f"[LLM] {label}: {provider} won in {time.time() - t0:.2f}s "
+                  f"({len(order) - len(queue)} launched, {len(pending)} abandoned)")
+            return value, provider
+    print(f"[LLM] {label}: all providers failed after {time.time() - t0:.2f}s")
+    return None, None
+
+
+def _iter_sse_deltas(response):
+    """Text deltas from an OpenAI-compatible server-sent-event stream (Perplexity / Grok / OpenAI)."""
+    for raw in response.iter_lines():
+        # SSE is UTF-8 by spec; requests would guess ISO-8859-1 from a bare text/event-stream
+        line = raw.decode("utf-8", errors="replace") if isinstance(raw, bytes) else raw
+        if not line or not line.startswith("data:"):
+            continue                                  # blank separators / comments / event names
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        try:
+            delta = json.loads(data).get("choices", [{}])[0].get("delta", {}).get("content")
+        except (ValueError, IndexError, AttributeError):
+            continue
+        if delta:
+            yield delta
 
-@st.cache_data(ttl=900)
-def get_stock_specific_news(ticker, limit=10):
-    """Get STOCK-SPECIFIC news using Perplexity API (FMP news endpoint is legacy)"""
-    import json
-    
-    perplexity_api_key = os.environ.get('PERPLEXITY_API_KEY', '')
-    if not perplexity_api_key:
-        return []
-    
-    try:
-        # Use Perplexity to get recent news about the stock
-        perplexity_url = "https://api.perplexity.ai/chat/completions"
-        perplexity_headers = {
-            "Authorization": f"Bearer {perplexity_api_key}",
-            "Content-Type": "application/json"
-        }
-        perplexity_payload = {
-            "model": "sonar",
-            "messages": [
-                {"role": "system", "content": "You are a financial news aggregator. Return ONLY a JSON array of news articles. No other text."},
-                {"role": "user", "content": f"""Find the {limit} most recent news articles about {ticker} stock from the past 7 days.
-Return ONLY a valid JSON array with this exact format (no other text):
-[
-  {{"title": "Article headline", "url": "https://source.com/article", "publishedDate": "2025-12-30", "source": "Source Name"}},
-  ...
-]
-Include real URLs from reputable financial news sources like Reuters, Bloomberg, CNBC, Yahoo Finance, MarketWatch, etc."""}
-            ],
-            "max_tokens": 1500,
-            "temperature": 0.1
-        }
-        
-        response = requests.post(perplexity_url, headers=perplexity_headers, json=perplexity_payload, timeout=15)
-        if response.status_code == 200:
-            content = response.json().get('choices', [{}])[0].get('message', {}).get('content', '')
-            
-            # Try to parse JSON from the response
-            try:
-                # Find JSON array in the response
-                start_idx = content.find('[')
-                end_idx = content.rfind(']') + 1
-                if start_idx != -1 and end_idx > start_idx:
-                    json_str = content[start_idx:end_idx]
-                    articles = json.loads(json_str)
-                    if isinstance(articles, list) and len(articles) > 0:
-                        return articles[:limit]
-            except json.JSONDecodeError:
-                pass
-    except Exception as e:
-        pass
-    
-    return []
+
+def stream_llm(messages, providers=("perplexity", "openai"), max_tokens=1000, temperature=0.7,
+               overrides=None, label="stream", cache=None):
+    """
+    Yield text chunks from the first provider whose stream produces a token.
+
+    Providers are tried in llm_provider_order; a provider that errors or
+    closes before its first token hands over to the next one. Once tokens have
+    been shown the answer is committed to that provider (a mid-stream failure
+    ends the answer early). Time-to-first-token is logged and kept in the
+    provider stats. A fresh cached answer is yielded whole; completed streams
+    are written to the AI cache under `cache`.
+    """
+    overrides = overrides or {}
+    order = llm_provider_order(providers)
+    if cache and order:
+        keys = {ai_cache_key(p, LLM_PROVIDERS[p]["model"], messages,
+                             overrides.get(p, {}).get("temperature", temperature)): p for p in order}
+        _, content = ai_cache_get(list(keys), cache)
+        if content:
+            yield content
+            return
+
+    for provider in order:
+        cfg = LLM_PROVIDERS[provider]
+        payload = {"model": cfg["model"], "messages": messages, "max_tokens": max_tokens,
+                   "temperature": temperature, "stream": True}
+        payload.update(overrides.get(provider, {}))
+        t0 = time.time()
+        parts = []
+        try:
+            # The with-block releases the connection on every exit: bad status,
+            # empty stream, errors, or the caller dropping the generator.
+            with requests.post(
+                cfg["url"], json=payload, stream=True, timeout=LLM_TIMEOUT_S,
+                headers={"Authorization": f"Bearer {os.environ.get(cfg['key'], '')}",
+                         "Content-Type": "application/json", "Accept": "text/event-stream"},
+            ) as response:
+                if response.status_code != 200:
+                    _record_llm_outcome(provider, time.time() - t0, f"http_{response.status_code}")
+                    continue
+                for delta in _iter_sse_deltas(response):
+                    if not parts:
+                        ttft = time.time() - t0
+                        with _LLM_STATS_LOCK:
+                            _llm_stats(provider)["ttft"].append(ttft)
+                        print(f"[LLM] {label}: {provider} first token after {ttft:.2f}s")
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            _record_llm_outcome(provider, time.time() - t0, "timeout" if isinstance(e, requests.Timeout)
+                                else type(e).__name__)
+            if parts:
+                print(f"[LLM] {label}: {provider} stream broke after {len(parts)} chunks: {e}")
+                return
+            continue
+        if not parts:
+            _record_llm_outcome(provider, time.time() - t0, "empty_stream")
+            continue
+        _record_llm_outcome(provider, time.time() - t0)
+        with _LLM_STATS_LOCK:
+            _llm_stats(provider)["wins"] += 1
+        content = "".join(parts)
+        print(f"[LLM] {label}: {provider} streamed {len(content)} chars in {time.time() - t0:.2f}s")
+        if cache:
+            # Streams carry no usage block; ~4 chars per token for the savings estimate
+            ai_cache_put(ai_cache_key(provider, cfg["model"], messages, payload["temperature"]),
+                         provider, cfg["model"], cache, content, len(content) // 4)
+        return
 
 
-def call_perplexity_json(prompt: str, max_tokens: int = 2000, temperature: float = 0.1) -> dict:
+def call_perplexity_json(prompt: str, max_tokens: int = 2000, temperature: float = 0.1,
+                         cache_ttl: str = "analysis") -> dict:
     """
     Calls Perplexity and returns parsed JSON dict if possible, else None.
-    Falls back to Grok then OpenAI if Perplexity fails.
+    Grok and OpenAI are hedged in via route_llm when Perplexity is slow or fails.
     
     Args:
         prompt: The user prompt (should instruct to return JSON only)
         max_tokens: Maximum response tokens
         temperature: Response randomness (lower = more deterministic)
+        cache_ttl: AI cache TTL class (None to always ask the provider)
     
     Returns:
         dict if JSON parsed successfully, None otherwise
     """
-    import json
-    
-    # TRY PERPLEXITY FIRST
-    perplexity_api_key = os.environ.get('PERPLEXITY_API_KEY', '')
-    if perplexity_api_key:
-        try:
-            perplexity_url = "https://api.perplexity.ai/chat/completions"
-            perplexity_headers = {
-                "Authorization": f"Bearer {perplexity_api_key}",
-                "Content-Type": "application/json"
-            }
-            perplexity_payload = {
-                "model": "sonar",
-                "messages": [
-                    {"role": "system", "content": "You are a technical assistant. Return ONLY valid JSON with no markdown, no code blocks, no preamble, no explanation. Just pure JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": max_tokens,
-                "temperature": temperature
-            }
-            
-            response = requests.post(perplexity_url, headers=perplexity_headers, json=perplexity_payload, timeout=30)
-            
-            if response.status_code == 200:
-                content = response.json().get('choices', [{}])[0].get('message', {}).get('content', '')
-                if content:
-                    result = _parse_json_content(content)
-                    if result:
-                        return result
-        except Exception as e:
-            pass
-    
-    # TRY GROK AS FALLBACK
-    grok_api_key = os.environ.get('GROK_API_KEY', '')
-    if grok_api_key:
-        try:
-            grok_url = "https://api.x.ai/v1/chat/completions"
-            grok_headers = {
-                "Authorization": f"Bearer {grok_api_key}",
-                "Content-Type": "application/json"
-            }
-            grok_payload = {
-                "model": "grok-beta",
-                "messages": [
-                    {"role": "system", "content": "You are a technical assistant. Return ONLY valid JSON with no markdown, no code blocks, no preamble. Just pure JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": max_tokens,
-                "temperature": temperature
-            }
-            
-            response = requests.post(grok_url, headers=grok_headers, json=grok_payload, timeout=30)
-            
-            if response.status_code == 200:
-                content = response.json().get('choices', [{}])[0].get('message', {}).get('content', '')
-                if content:
-                    result = _parse_json_content(content)
-                    if result:
-                        return result
-        except Exception as e:
-            pass
-    
-    # TRY OPENAI AS LAST FALLBACK
-    openai_api_key = os.environ.get('OPENAI_API_KEY', '')
-    if openai_api_key:
-        try:
-            openai_url = "https://api.openai.com/v1/chat/completions"
-            openai_headers = {
-                "Authorization": f"Bearer {openai_api_key}",
-                "Content-Type": "application/json"
-            }
-            openai_payload = {
-                "model": "gpt-4o-mini",
-                "messages": [
-                    {"role": "system", "content": "You are a financial analysis AI. Return ONLY valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                "response_format": {"type": "json_object"},
-                "max_tokens": max_tokens,
-                "temperature": temperature
-            }
-            
-            response = requests.post(openai_url, headers=openai_headers, json=openai_payload, timeout=30)
-            
-            if response.status_code == 200:
-                content = response.json().get('choices', [{}])[0].get('message', {}).get('content', '')
-                if content:
-                    return json.loads(content)
-        except Exception as e:
-            pass
-    
-    return None
+    messages = [
+        {"role": "system", "content": "You are a technical assistant. Return ONLY valid JSON with no markdown, no code blocks, no preamble, no explanation. Just pure JSON."},
+        {"role": "user", "content": prompt}
+    ]
+    result, _ = route_llm(
+        messages, lambda content, provider: _parse_json_content(content) or None,
+        providers=("perplexity", "grok", "openai"), max_tokens=max_tokens, temperature=temperature,
+        overrides={"openai": {"response_format": {"type": "json_object"}}}, label="json", cache=cache_ttl,
+    )
+    return result
 
 def _parse_json_content(content: str) -> dict:
     """Helper to parse JSON from API response content"""
@@ -8796,36 +9691,30 @@ def get_price_target_consensus(ticker):
 @st.cache_data(ttl=86400)
 def get_ai_price_target(ticker, company_name):
     """Fallback: Get price target from Perplexity AI if FMP has no data"""
+    pre = load_ai_pregen(ticker, "price_target")
+    if pre is not None:
+        return pre.get("value")
+    return _generate_ai_price_target(ticker, company_name)
+
+
+def _generate_ai_price_target(ticker, company_name):
+    """Live Perplexity lookup behind get_ai_price_target (also used by the nightly pre-generation)."""
     if not PERPLEXITY_API_KEY:
         return None
     
     try:
-        headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "sonar",
-            "messages": [
+        content = cached_chat_completion(
+            "perplexity",
+            [
                 {
                     "role": "user",
                     "content": f"What is the current average 12-month analyst price target for {company_name} ({ticker})? Just give me the dollar amount as a number, nothing else. If you don't know, say 'unknown'."
                 }
             ],
-            "max_tokens": 50
-        }
-        
-        response = requests.post(
-            "https://api.perplexity.ai/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=15
+            max_tokens=50, temperature=None, ttl_class="reference", timeout=15
         )
         
-        if response.status_code == 200:
-            result = response.json()
-            content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
+        if content:
             import re
             match = re.search(r'\$?([\d,]+\.?\d*)', content)
             if match:
@@ -10252,30 +11141,715 @@ def get_historical_price(ticker, years=5):
         pass
     return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
-def get_historical_ohlc(ticker, years=5):
-    """Get historical OHLC data for candlestick charts from FMP"""
-    
-    # Use the CORRECT endpoint from FMP docs: /historical-price-eod/full
-    url = f"{BASE_URL}/historical-price-eod/full?symbol={ticker}&apikey={FMP_API_KEY}"
-    
-    try:
-        response = requests.get(url, timeout=15)
-        data = response.json()
-        
-        if data and isinstance(data, list) and len(data) > 0:
+# Process-wide OHLC cache keyed by the covering date range: one frame per
+# ticker, remembered with the earliest date it was fetched from. Any request
+# whose window starts on/after that date (e.g. 1y after a 5y chart load) is
+# sliced from memory instead of hitting FMP again.
+_OHLC_CACHE_TTL = 3600
+_OHLC_CACHE_MAX_TICKERS = 256
+_OHLC_RANGE_CACHE = OrderedDict()  # TICKER -> (from_date, fetched_at, df)
+_OHLC_RANGE_LOCK = threading.Lock()
+
+
+def _ohlc_cache_lookup(ticker, from_date):
+    with _OHLC_RANGE_LOCK:
+        hit = _OHLC_RANGE_CACHE.get(ticker)
+        if not hit:
+            return None
+        cached_from, fetched_at, df = hit
+        if time.time() - fetched_at > _OHLC_CACHE_TTL:
+            del _OHLC_RANGE_CACHE[ticker]
+            return None
+        if cached_from > from_date:
+            return None
+        _OHLC_RANGE_CACHE.move_to_end(ticker)
+        return df
+
+
+def _ohlc_cache_store(ticker, from_date, df):
+    with _OHLC_RANGE_LOCK:
+        hit = _OHLC_RANGE_CACHE.get(ticker)
+        # Never replace a wider, still-fresh frame with a narrower one
+        if hit and hit[0] <= from_date and time.time() - hit[1] <= _OHLC_CACHE_TTL:
+            return
+        _OHLC_RANGE_CACHE[ticker] = (from_date, time.time(), df)
+        _OHLC_RANGE_CACHE.move_to_end(ticker)
+        while len(_OHLC_RANGE_CACHE) > _OHLC_CACHE_MAX_TICKERS:
+            _OHLC_RANGE_CACHE.popitem(last=False)
+
+
+def get_historical_ohlc(ticker, years=5, from_date=None, to_date=None):
+    """Get historical OHLC data for candlestick charts from FMP.
+
+    The date range is sent to FMP (`from`/`to`) so long-listed names don't
+    download decades of bars to use the last `years`. `from_date`/`to_date`
+    (YYYY-MM-DD or datetime) override `years` for explicit windows.
+    """
+    ticker = (ticker or "").upper()
+    start = pd.Timestamp(from_date) if from_date is not None else \
+        pd.Timestamp((datetime.now() - timedelta(days=years*365)).date())
+    end = pd.Timestamp(to_date) if to_date is not None else None
+
+    df = _ohlc_cache_lookup(ticker, start)
+    if df is None:
+        # Use the CORRECT endpoint from FMP docs: /historical-price-eod/full
+        url = (f"{BASE_URL}/historical-price-eod/full?symbol={ticker}"
+               f"&from={start.strftime('%Y-%m-%d')}&apikey={FMP_API_KEY}")
+        if end is not None:
+            url += f"&to={end.strftime('%Y-%m-%d')}"
+        try:
+            response = requests.get(url, timeout=15)
+            data = response.json()
+            if not (data and isinstance(data, list) and len(data) > 0):
+                return pd.DataFrame()
             df = pd.DataFrame(data)
-            
-            if not df.empty:
-                df['date'] = pd.to_datetime(df['date'])
-                df = df.sort_values('date')
-                cutoff = datetime.now() - timedelta(days=years*365)
-                df = df[df['date'] >= cutoff]
-                return df
+            if df.empty:
+                return pd.DataFrame()
+            df['date'] = pd.to_datetime(df['date'])
+            df = df.sort_values('date').reset_index(drop=True)
+        except Exception:
+            return pd.DataFrame()
+        # Only open-ended (up-to-today) frames can serve later requests
+        if end is None:
+            _ohlc_cache_store(ticker, start, df)
+
+    mask = df['date'] >= start
+    if end is not None:
+        mask &= df['date'] <= end
+    return df[mask].copy()
+
+# ============= LOCAL PRICE STORE (daily bars) =============
+# Daily close / adjusted close per ticker in the local cache DB, synced
+# incrementally from FMP (only bars newer than the last stored date are
+# fetched; a request reaching further back than what's stored backfills once).
+# Engines that need dates × tickers matrices read them via get_price_panel.
+PRICE_STORE_RESYNC_S = 6 * 3600  # re-check a ticker for new bars at most this often
+
+_PRICE_STORE_DDL = """
+CREATE TABLE IF NOT EXISTS price_bars (
+    ticker    TEXT NOT NULL,
+    date      TEXT NOT NULL,
+    close     REAL,
+    adj_close REAL,
+    volume    REAL,
+    PRIMARY KEY (ticker, date)
+);
+CREATE TABLE IF NOT EXISTS price_sync (
+    ticker       TEXT PRIMARY KEY,
+    covered_from TEXT,
+    synced_at    REAL
+);
+"""
+
+
+def _fetch_eod_bars(ticker, from_date):
+    """Close + dividend-adjusted close bars for `ticker` since `from_date` (YYYY-MM-DD)."""
+    ohlc = get_historical_ohlc(ticker, from_date=from_date)
+    if ohlc is None or ohlc.empty:
+        return pd.DataFrame()
+    bars = ohlc[["date", "close"] + (["volume"] if "volume" in ohlc.columns else [])].copy()
+    try:
+        url = (f"{BASE_URL}/historical-price-eod/dividend-adjusted?symbol={ticker}"
+               f"&from={from_date}&apikey={FMP_API_KEY}")
+        adj = requests.get(url, timeout=15).json()
+        if isinstance(adj, list) and adj:
+            adj = pd.DataFrame(adj)[["date", "adjClose"]]
+            adj["date"] = pd.to_datetime(adj["date"])
+            bars = bars.merge(adj.rename(columns={"adjClose": "adj_close"}), on="date", how="left")
     except Exception:
         pass
-    
-    return pd.DataFrame()
+    if "adj_close" not in bars.columns:
+        bars["adj_close"] = bars["close"]
+    if "volume" not in bars.columns:
+        bars["volume"] = None
+    bars["adj_close"] = bars["adj_close"].fillna(bars["close"])
+    return bars
+
+
+def sync_price_store(tickers, start, max_workers=8, force=False):
+    """Bring the local price store up to date for `tickers` from `start` (YYYY-MM-DD).
+
+    Per ticker: skip if synced recently and already covering `start`; else fetch
+    from the last stored bar (incremental) or from `start` (backfill). Returns
+    the list of tickers that were actually fetched.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    syms = [t.upper() for t in dict.fromkeys(tickers) if t]
+    if not syms:
+        return []
+    now = time.time()
+    with _local_db(_PRICE_STORE_DDL) as conn:
+        qm = ",".join("?" * len(syms))
+        sync = {r["ticker"]: r for r in conn.execute(
+            f"SELECT ticker, covered_from, synced_at FROM price_sync WHERE ticker IN ({qm})", syms)}
+        last = {r["ticker"]: r["last"] for r in conn.execute(
+            f"SELECT ticker, MAX(date) AS last FROM price_bars WHERE ticker IN ({qm}) GROUP BY ticker", syms)}
+
+    plan = {}
+    for tk in syms:
+        s = sync.get(tk)
+        covered = s is not None and s["covered_from"] <= start
+        if covered and not force and now - (s["synced_at"] or 0) < PRICE_STORE_RESYNC_S:
+            continue
+        plan[tk] = last[tk] if covered and last.get(tk) else start
+
+    if not plan:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(plan))) as exe:
+        fetched = dict(zip(plan, exe.map(lambda kv: _fetch_eod_bars(*kv), plan.items())))
+
+    with _local_db(_PRICE_STORE_DDL) as conn:
+        for tk, bars in fetched.items():
+            if bars is not None and not bars.empty:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO price_bars (ticker, date, close, adj_close, volume) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(tk, d.strftime("%Y-%m-%d"), float(c), float(a), None if v is None or pd.isna(v) else float(v))
+                     for d, c, a, v in zip(bars["date"], bars["close"], bars["adj_close"], bars["volume"])],
+                )
+            prev_from = sync[tk]["covered_from"] if tk in sync else None
+            conn.execute(
+                "INSERT OR REPLACE INTO price_sync (ticker, covered_from, synced_at) VALUES (?, ?, ?)",
+                (tk, min(start, prev_from) if prev_from else start, now),
+            )
+    return list(fetched)
+
+
+@st.cache_data(ttl=900, show_spinner=False)
+def get_price_panel(tickers, start, end=None, field="close"):
+    """Dates × tickers DataFrame of daily prices from the local price store.
+
+    `tickers` should be a tuple (cache key). `field` is "close" (as traded) or
+    "adj_close" (dividend-adjusted, for return math). Syncs missing bars first.
+    Tickers with no data come back as all-NaN columns.
+    """
+    syms = [t.upper() for t in dict.fromkeys(tickers) if t]
+    if not syms:
+        return pd.DataFrame()
+    start = pd.Timestamp(start).strftime("%Y-%m-%d")
+    try:
+        sync_price_store(syms, start)
+    except Exception as e:
+        print(f"[PRICE_STORE] Sync failed: {e}")
+    col = "adj_close" if field == "adj_close" else "close"
+    sql = (f"SELECT ticker, date, {col} AS px FROM price_bars "
+           f"WHERE ticker IN ({','.join('?' * len(syms))}) AND date >= ?")
+    params = syms + [start]
+    if end is not None:
+        sql += " AND date <= ?"
+        params.append(pd.Timestamp(end).strftime("%Y-%m-%d"))
+    with _local_db(_PRICE_STORE_DDL) as conn:
+        long = pd.read_sql_query(sql, conn, params=params)
+    if long.empty:
+        return pd.DataFrame(columns=syms)
+    panel = long.pivot(index="date", columns="ticker", values="px")
+    panel.index = pd.to_datetime(panel.index)
+    return panel.sort_index().reindex(columns=syms)
+
+
+# ============= CORPORATE ACTIONS (splits / dividends) =============
+# Paper trades are stored as executed (shares and price at trade time), while
+# FMP bars are split-adjusted. Split and dividend history for held tickers is
+# pulled concurrently into the local cache DB; apply_corporate_actions then
+# restates the ledger in today's share units and accrues dividends as cash
+# (shares held before each ex-date × amount, credited on the pay date), all
+# with array ops over the whole ledger.
+CORP_ACTIONS_RESYNC_S = 24 * 3600
+
+_CORP_ACTIONS_DDL = """
+CREATE TABLE IF NOT EXISTS corp_splits (
+    ticker TEXT NOT NULL,
+    date   TEXT NOT NULL,
+    ratio  REAL NOT NULL,
+    PRIMARY KEY (ticker, date)
+);
+CREATE TABLE IF NOT EXISTS corp_dividends (
+    ticker   TEXT NOT NULL,
+    ex_date  TEXT NOT NULL,
+    pay_date TEXT,
+    amount   REAL NOT NULL,
+    PRIMARY KEY (ticker, ex_date)
+);
+CREATE TABLE IF NOT EXISTS corp_sync (
+    ticker    TEXT PRIMARY KEY,
+    synced_at REAL
+);
+"""
+
+
+def _fetch_corporate_actions(ticker):
+    """(splits [(date, ratio)], dividends [(ex_date, pay_date, amount)]) from FMP; None on failure."""
+    try:
+        splits = requests.get(f"{BASE_URL}/splits?symbol={ticker}&apikey={FMP_API_KEY}", timeout=15).json()
+        divs = requests.get(f"{BASE_URL}/dividends?symbol={ticker}&apikey={FMP_API_KEY}", timeout=15).json()
+    except Exception:
+        return None
+    split_rows = [
+        (s["date"][:10], float(s["numerator"]) / float(s["denominator"]))
+        for s in (splits if isinstance(splits, list) else [])
+        if s.get("date") and s.get("numerator") and s.get("denominator")
+    ]
+    div_rows = [
+        (d["date"][:10], (d.get("paymentDate") or d["date"])[:10], float(d["dividend"]))
+        for d in (divs if isinstance(divs, list) else [])
+        if d.get("date") and d.get("dividend")
+    ]
+    return split_rows, div_rows
+
+
+def sync_corporate_actions(tickers, max_workers=8, force=False):
+    """Refresh split/dividend history for tickers not synced within CORP_ACTIONS_RESYNC_S."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    syms = [t.upper() for t in dict.fromkeys(tickers) if t]
+    if not syms:
+        return []
+    now = time.time()
+    with _local_db(_CORP_ACTIONS_DDL) as conn:
+        synced = {r["ticker"]: r["synced_at"] for r in conn.execute(
+            f"SELECT ticker, synced_at FROM corp_sync WHERE ticker IN ({','.join('?' * len(syms))})", syms)}
+    stale = [t for t in syms if force or now - (synced.get(t) or 0) >= CORP_ACTIONS_RESYNC_S]
+    if not stale:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(stale))) as exe:
+        fetched = dict(zip(stale, exe.map(_fetch_corporate_actions, stale)))
+
+    with _local_db(_CORP_ACTIONS_DDL) as conn:
+        for tk, res in fetched.items():
+            if res is None:
+                continue                      # keep what we have, retry next refresh
+            splits, divs = res
+            conn.executemany("INSERT OR REPLACE INTO corp_splits (ticker, date, ratio) VALUES (?, ?, ?)",
+                             [(tk, d, r) for d, r in splits])
+            conn.executemany("INSERT OR REPLACE INTO corp_dividends (ticker, ex_date, pay_date, amount) "
+                             "VALUES (?, ?, ?, ?)", [(tk, ex, pay, amt) for ex, pay, amt in divs])
+            conn.execute("INSERT OR REPLACE INTO corp_sync (ticker, synced_at) VALUES (?, ?)", (tk, now))
+    return [t for t, res in fetched.items() if res is not None]
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_corporate_actions(tickers):
+    """(splits DataFrame [ticker, date, ratio], dividends DataFrame [ticker, ex_date, pay_date, amount])."""
+    syms = [t.upper() for t in dict.fromkeys(tickers) if t]
+    empty = (pd.DataFrame(columns=["ticker", "date", "ratio"]),
+             pd.DataFrame(columns=["ticker", "ex_date", "pay_date", "amount"]))
+    if not syms:
+        return empty
+    try:
+        sync_corporate_actions(syms)
+    except Exception as e:
+        print(f"[CORP_ACTIONS] Sync failed: {e}")
+    qm = ",".join("?" * len(syms))
+    with _local_db(_CORP_ACTIONS_DDL) as conn:
+        splits = pd.read_sql_query(f"SELECT ticker, date, ratio FROM corp_splits WHERE ticker IN ({qm})",
+                                   conn, params=syms)
+        divs = pd.read_sql_query(f"SELECT ticker, ex_date, pay_date, amount FROM corp_dividends "
+                                 f"WHERE ticker IN ({qm})", conn, params=syms)
+    splits["date"] = pd.to_datetime(splits["date"])
+    divs["ex_date"] = pd.to_datetime(divs["ex_date"])
+    divs["pay_date"] = pd.to_datetime(divs["pay_date"])
+    return splits.sort_values(["ticker", "date"]), divs.sort_values(["ticker", "ex_date"])
+
+
+def _split_factors(splits, tickers, days):
+    """Cumulative split ratio after each (ticker, day): multiply shares, divide prices by it."""
+    factor = np.ones(len(days))
+    for tk, grp in splits.groupby("ticker"):
+        mask = np.asarray(tickers) == tk
+        if not mask.any():
+            continue
+        # after[k] = product of ratios for splits k.. (splits on/after day → not yet applied)
+        after = np.cumprod(grp["ratio"].values[::-1])[::-1]
+        after = np.append(after, 1.0)
+        idx = np.searchsorted(grp["date"].values, np.asarray(days)[mask], side="right")
+        factor[mask] = after[idx]
+    return factor
+
+
+def apply_corporate_actions(transactions, asof=None):
+    """
+    Restate a trade ledger for splits and accrue its dividends.
+
+    Args:
+        transactions: trades in load_trades_from_db display format (newest first)
+        asof: dividends with a pay date after this are reported as accrued, not paid
+
+    Returns dict:
+        transactions: split-adjusted trades (same format; totals unchanged)
+        ledger: adjusted trades plus one 'DIV' row per paid dividend (for the NAV engine)
+        dividends: DataFrame [ticker, ex_date, pay_date, shares, amount, cash, paid]
+        dividend_cash: paid dividends, accrued: declared but not yet paid
+        splits_applied: trades whose quantity changed
+    """
+    out = {"transactions": transactions, "ledger": transactions, "dividends": pd.DataFrame(),
+           "dividend_cash": 0.0, "accrued": 0.0, "splits_applied": 0}
+    tx = _trades_frame(transactions)
+    if tx.empty:
+        return out
+    tickers = tuple(sorted(tx["ticker"].unique()))
+    splits, divs = get_corporate_actions(tickers)
+    splits = splits[splits["date"] <= pd.Timestamp(asof or datetime.now().date())]   # announced, not yet effective
+
+    # Splits: restate each trade in post-split units (shares × f, price ÷ f)
+    factor = _split_factors(splits, tx["ticker"].values, tx["day"].values)
+    changed = factor != 1.0
+    adjusted = transactions
+    if changed.any():
+        adjusted = []
+        for t, f in zip(reversed(transactions), factor):      # factor is oldest-first
+            if f != 1.0:
+                f = float(f)
+                t = dict(t, shares=t["shares"] * f, price=t["price"] / f, split_factor=f)
+            adjusted.append(t)
+        adjusted.reverse()
+        tx = tx.assign(dshares=tx["dshares"].values * factor)
+    out["transactions"], out["splits_applied"] = adjusted, int(changed.sum())
+
+    # Dividends: adjusted shares held at the close before each ex-date,
+    # converted back to the units the per-share amount was declared in
+    divs = divs[divs["ticker"].isin(tickers) & (divs["ex_date"] > tx["day"].min())]
+    if divs.empty:
+        return out
+    held = np.zeros(len(divs))
+    for tk, grp in tx.groupby("ticker"):
+        mask = (divs["ticker"] == tk).values
+        if mask.any():
+            cum = np.concatenate(([0.0], np.cumsum(grp["dshares"].values)))
+            held[mask] = cum[np.searchsorted(grp["day"].values, divs["ex_date"].values[mask], side="left")]
+    held = np.clip(held, 0.0, None)
+    ex_factor = _split_factors(splits, divs["ticker"].values, divs["ex_date"].values)
+    events = divs.assign(shares=held, amount=divs["amount"].values / ex_factor)
+    events["cash"] = held * events["amount"].values
+    events = events[events["cash"] > 0].reset_index(drop=True)
+    today = pd.Timestamp(asof or datetime.now().date())
+    events["paid"] = events["pay_date"].fillna(events["ex_date"]) <= today
+    out["dividends"] = events
+    out["dividend_cash"] = float(events.loc[events["paid"], "cash"].sum())
+    out["accrued"] = float(events.loc[~events["paid"], "cash"].sum())
+
+    paid = events[events["paid"]]
+    if not paid.empty:
+        div_rows = [{"date": d.strftime("%Y-%m-%d"), "type": "DIV", "ticker": tk, "shares": sh,
+                     "price": amt, "total": cash}
+                    for d, tk, sh, amt, cash in zip(paid["pay_date"].fillna(paid["ex_date"]), paid["ticker"],
+                                                    paid["shares"], paid["amount"], paid["cash"])]
+        # Newest first, dividends after same-day trades
+        ledger = sorted(list(reversed(adjusted)) + div_rows, key=lambda t: str(t["date"])[:10])
+        out["ledger"] = ledger[::-1]
+    return out
+
+
+def _corp_cache_sig(transactions):
+    return (len(transactions), str(transactions[0].get("date")) if transactions else None,
+            datetime.now().strftime("%Y-%m-%d"))
+
+
+def get_corporate_adjusted(book_key, transactions):
+    """apply_corporate_actions once per refresh per book (fail-soft: ledger as-is)."""
+    cache = st.session_state.setdefault("_corp_cache", {})
+    sig = _corp_cache_sig(transactions)
+    hit = cache.get(book_key)
+    if hit and hit[0] == sig:
+        return hit[1]
+    try:
+        result = apply_corporate_actions(transactions)
+    except Exception as e:
+        print(f"[CORP_ACTIONS] {book_key}: {e}")
+        result = {"transactions": transactions, "ledger": transactions, "dividends": pd.DataFrame(),
+                  "dividend_cash": 0.0, "accrued": 0.0, "splits_applied": 0}
+    cache[book_key] = (sig, result)
+    return result
+
+
+def extend_corporate_adjusted(book_key, transactions):
+    """
+    Cached result after a new trade was put at the front of `transactions`.
+
+    A trade made today needs no split restatement and hasn't earned a paid
+    dividend, so the cached result for the ledger before it just grows by one
+    row. Falls back to get_corporate_adjusted when there is nothing to extend.
+    """
+    cache = st.session_state.get("_corp_cache", {})
+    hit = cache.get(book_key)
+    before = _corp_cache_sig(transactions[1:])
+    if not transactions or not hit or hit[0] != before:
+        return get_corporate_adjusted(book_key, transactions)
+    trade = transactions[0]
+    result = dict(hit[1], transactions=[trade] + list(hit[1]["transactions"]),
+                  ledger=[trade] + list(hit[1]["ledger"]))
+    cache[book_key] = (_corp_cache_sig(transactions), result)
+    return result
+
+
+# ============= PORTFOLIO RISK ENGINE (covariance) =============
+# Portfolio volatility, VaR/CVaR and risk contributions from a Ledoit-Wolf
+# shrinkage covariance of aligned daily returns (local price store). Pure
+# NumPy on an obs × names matrix, so a 20-name book evaluates in milliseconds
+# once the panel is cached.
+from statistics import NormalDist
+
+RISK_LOOKBACK_DAYS = 504   # ~2 trading years
+RISK_MIN_OBS = 60          # names with less history than this are left out
+TRADING_DAYS = 252
+
+
+def shrinkage_covariance(returns):
+    """Ledoit-Wolf (2004) covariance shrunk toward a scaled identity.
+
+    `returns` is a T × N array with no NaNs. Returns (cov, shrinkage in [0, 1]).
+    """
+    x = returns - returns.mean(axis=0)
+    t, n = x.shape
+    sample = x.T @ x / t
+    mu = np.trace(sample) / n
+    target = mu * np.eye(n)
+    d2 = np.sum((sample - target) ** 2) / n
+    if d2 <= 0:
+        return sample, 0.0
+    # Σ_t ||x_t x_tᵀ − S||² = Σ_t ||x_t||⁴ − T·||S||²
+    b_bar2 = (np.sum(np.sum(x ** 2, axis=1) ** 2) / t - np.sum(sample ** 2)) / (t * n)
+    shrink = float(min(max(b_bar2, 0.0), d2) / d2)
+    return shrink * target + (1 - shrink) * sample, shrink
+
+
+def _aligned_returns(tickers, lookback=RISK_LOOKBACK_DAYS, panel=None):
+    """(returns DataFrame [obs × covered names], excluded names) from the price store."""
+    if panel is None:
+        start = (datetime.now() - timedelta(days=int(lookback * 1.5) + 10)).strftime("%Y-%m-%d")
+        panel = get_price_panel(tuple(tickers), start, field="adj_close")
+    if panel.empty:
+        return pd.DataFrame(), list(tickers)
+    rets = panel.reindex(columns=list(tickers)).tail(lookback + 1).pct_change().iloc[1:]
+    counts = rets.notna().sum()
+    covered = [t for t in tickers if counts.get(t, 0) >= RISK_MIN_OBS]
+    excluded = [t for t in tickers if t not in covered]
+    return rets[covered].dropna(), excluded
+
+
+def compute_portfolio_risk(weights, confidence=0.95, lookback=RISK_LOOKBACK_DAYS, panel=None):
+    """
+    Covariance risk model for a long-only book.
+
+    Args:
+        weights: {ticker: weight}; renormalized over names with enough history
+        confidence: VaR/CVaR confidence level (one-day horizon)
+        panel: optional dates × tickers price panel (otherwise read from the store)
+
+    Returns dict (None if fewer than RISK_MIN_OBS aligned days):
+        vol_daily, vol_annual, var_param, cvar_param, var_hist, cvar_hist
+        (losses as positive fractions of the book), marginal / component /
+        component_pct risk per ticker, asset_vol, diversification_ratio,
+        corr (DataFrame), shrinkage, n_obs, excluded
+    """
+    tickers = [t.upper() for t, w in weights.items() if w and w > 0]
+    if not tickers:
+        return None
+    w_in = {t.upper(): float(w) for t, w in weights.items() if w and w > 0}
+    if panel is None:
+        rets, excluded = get_return_matrix(tuple(sorted(tickers)), lookback)
+    else:
+        rets, excluded = _aligned_returns(tickers, lookback, panel)
+    if rets.empty or len(rets) < RISK_MIN_OBS:
+        return None
+
+    names = list(rets.columns)
+    r = rets.values
+    w = np.array([w_in[t] for t in names])
+    w = w / w.sum()
+
+    cov, shrink = shrinkage_covariance(r)
+    port_var = float(w @ cov @ w)
+    vol = np.sqrt(port_var)
+    asset_vol = np.sqrt(np.diag(cov))
+
+    marginal = cov @ w / vol            # ∂σ/∂wᵢ
+    component = w * marginal            # sums to σ
+    z = NormalDist().inv_cdf(confidence)
+    pdf_z = np.exp(-z * z / 2) / np.sqrt(2 * np.pi)
+
+    port_rets = r @ w
+    var_hist = float(-np.quantile(port_rets, 1 - confidence))
+    tail = port_rets[port_rets <= -var_hist]
+    cvar_hist = float(-tail.mean()) if len(tail) else var_hist
+
+    ann = np.sqrt(TRADING_DAYS)
+    return {
+        "tickers": names,
+        "weights": dict(zip(names, w.tolist())),
+        "vol_daily": float(vol),
+        "vol_annual": float(vol * ann),
+        "var_param": float(z * vol),
+        "cvar_param": float(vol * pdf_z / (1 - confidence)),
+        "var_hist": var_hist,
+        "cvar_hist": cvar_hist,
+        "confidence": confidence,
+        "marginal": dict(zip(names, (marginal * ann).tolist())),
+        "component": dict(zip(names, (component * ann).tolist())),
+        "component_pct": dict(zip(names, (component / vol).tolist())),
+        "asset_vol": dict(zip(names, (asset_vol * ann).tolist())),
+        "diversification_ratio": float(w @ asset_vol / vol),
+        "corr": pd.DataFrame(cov / np.outer(asset_vol, asset_vol), index=names, columns=names),
+        "shrinkage": shrink,
+        "n_obs": int(len(r)),
+        "excluded": excluded,
+    }
+
+
+
+# ── Correlation / overlap analytics ──────────────────────────
+# "NVDA + AMD + AVGO is one bet": pairwise and rolling correlations,
+# average-linkage clusters on the correlation distance, effective number of
+# independent bets (squared diversification ratio) and cluster-level weight
+# and risk. Return matrices are cached per ticker set so reruns reuse them.
+CORR_LOOKBACK_DAYS = 252
+CORR_ROLLING_WINDOW = 63          # ~1 quarter
+CORR_TOP_PAIRS = 5                # pairs shown over time in the overlap panel
+CORR_CLUSTER_THRESHOLD = 0.6      # names whose average correlation ≥ this share a cluster
+
+
+@st.cache_data(ttl=900, show_spinner=False)
+def get_return_matrix(tickers, lookback=CORR_LOOKBACK_DAYS):
+    """Aligned daily returns (obs × covered names) for a tuple of tickers, plus excluded names."""
+    return _aligned_returns(list(tickers), lookback)
+
+
+def rolling_correlations(returns, window=CORR_ROLLING_WINDOW):
+    """Correlation matrix over the trailing `window` rows for every date (T−window+1 × N × N).
+
+    Uses running sums of x, x² and xᵢxⱼ, so all pairs and dates come out of
+    a handful of array ops instead of a per-pair rolling loop.
+    """
+    x = np.asarray(returns, dtype=float)
+    t, n = x.shape
+    if t < window:
+        return np.empty((0, n, n))
+    pad = lambda a: np.concatenate((np.zeros((1,) + a.shape[1:]), np.cumsum(a, axis=0)))
+    s1, s2 = pad(x), pad(x * x)
+    sxy = pad(x[:, :, None] * x[:, None, :])
+    w1 = s1[window:] - s1[:-window]
+    w2 = s2[window:] - s2[:-window]
+    wxy = sxy[window:] - sxy[:-window]
+    cov = wxy / window - (w1[:, :, None] * w1[:, None, :]) / window ** 2
+    var = w2 / window - (w1 / window) ** 2
+    sd = np.sqrt(np.clip(var, 1e-18, None))
+    return cov / (sd[:, :, None] * sd[:, None, :])
+
+
+def correlation_clusters(corr, threshold=CORR_CLUSTER_THRESHOLD):
+    """Average-linkage agglomerative clusters on d = √(½(1−ρ)); cut where ρ̄ < threshold.
+
+    Returns a list of clusters (lists of column indices), largest first.
+    """
+    n = corr.shape[0]
+    dist = np.sqrt(np.clip(0.5 * (1.0 - np.asarray(corr)), 0.0, None))
+    cut = np.sqrt(0.5 * (1.0 - threshold))
+    clusters = [[i] for i in range(n)]
+    d = dist.copy()
+    np.fill_diagonal(d, np.inf)
+    active = list(range(n))
+    while len(active) > 1:
+        sub = d[np.ix_(active, active)]
+        k = int(np.argmin(sub))
+        a, b = active[k // len(active)], active[k % len(active)]
+        if d[a, b] > cut:
+            break
+        na, nb = len(clusters[a]), len(clusters[b])
+        merged = (d[a] * na + d[b] * nb) / (na + nb)   # average linkage update
+        d[a], d[:, a] = merged, merged
+        d[a, a] = np.inf
+        clusters[a] = clusters[a] + clusters[b]
+        active.remove(b)
+    return sorted((clusters[i] for i in active), key=len, reverse=True)
+
+
+def compute_correlation_analytics(weights, lookback=CORR_LOOKBACK_DAYS, window=CORR_ROLLING_WINDOW,
+                                  threshold=CORR_CLUSTER_THRESHOLD, returns=None):
+    """
+    Overlap analytics for a long-only book.
+
+    Args:
+        weights: {ticker: weight}
+        returns: optional obs × names returns DataFrame (else the cached matrix)
+
+    Returns dict or None (< 2 names with enough history):
+        corr (DataFrame), rolling_now (DataFrame, last `window` days),
+        pairs (DataFrame: a, b, corr_1y, corr_recent, change; most correlated first),
+        rolling_avg (Series: weighted average pairwise correlation over the trailing
+        `window` days, per date), rolling_pairs (DataFrame: dates × top-pair labels),
+        clusters ([{'tickers', 'weight', 'risk_share', 'avg_corr'}]),
+        effective_bets (risk-based), effective_names (1 / Σw²), excluded, n_obs
+    """
+    w_in = {t.upper(): float(w) for t, w in weights.items() if w and w > 0}
+    if returns is None:
+        returns, excluded = get_return_matrix(tuple(sorted(w_in)), lookback)
+    else:
+        excluded = [t for t in w_in if t not in returns.columns]
+    names = [t for t in returns.columns if t in w_in]
+    if len(names) < 2 or len(returns) < max(window, RISK_MIN_OBS):
+        return None
+
+    x = returns[names].values
+    w = np.array([w_in[t] for t in names])
+    w = w / w.sum()
+    corr = np.corrcoef(x, rowvar=False)
+    rolling = rolling_correlations(x, window)
+    recent = rolling[-1]
+    dates = returns.index[window - 1:]
+
+    iu = np.triu_indices(len(names), 1)
+    pairs = pd.DataFrame({
+        "a": np.array(names)[iu[0]], "b": np.array(names)[iu[1]],
+        "corr_1y": corr[iu], "corr_recent": recent[iu],
+    })
+    pairs["change"] = pairs["corr_recent"] - pairs["corr_1y"]
+    pairs = pairs.sort_values("corr_1y", ascending=False).reset_index(drop=True)
+
+    # Correlation over time: weighted average across all pairs + the top pairs
+    ww = np.outer(w, w)
+    np.fill_diagonal(ww, 0.0)
+    rolling_avg = pd.Series((rolling * ww).sum(axis=(1, 2)) / ww.sum(), index=dates)
+    col = {t: i for i, t in enumerate(names)}
+    rolling_pairs = pd.DataFrame({f"{r.a} / {r.b}": rolling[:, col[r.a], col[r.b]]
+                                  for r in pairs.head(CORR_TOP_PAIRS).itertuples()}, index=dates)
+
+    # Risk shares: component risk from the shrinkage covariance
+    cov, _ = shrinkage_covariance(x)
+    port_var = float(w @ cov @ w)
+    comp = w * (cov @ w) / port_var
+
+    # Effective bets: squared diversification ratio (Σwσ / σₚ)² — equals N for
+    # N uncorrelated equal-vol names and collapses to 1 for perfectly correlated ones
+    effective_bets = float((w @ np.sqrt(np.diag(cov))) ** 2 / port_var)
+
+    clusters = []
+    for idx in correlation_clusters(corr, threshold):
+        sub = corr[np.ix_(idx, idx)]
+        avg = float((sub.sum() - len(idx)) / (len(idx) * (len(idx) - 1))) if len(idx) > 1 else 1.0
+        clusters.append({
+            "tickers": [names[i] for i in idx],
+            "weight": float(w[idx].sum()),
+            "risk_share": float(comp[idx].sum()),
+            "avg_corr": avg,
+        })
+    clusters.sort(key=lambda c: c["weight"], reverse=True)
+
+    return {
+        "corr": pd.DataFrame(corr, index=names, columns=names),
+        "rolling_now": pd.DataFrame(recent, index=names, columns=names),
+        "pairs": pairs,
+        "rolling_avg": rolling_avg,
+        "rolling_pairs": rolling_pairs,
+        "clusters": clusters,
+        "effective_bets": effective_bets,
+        "effective_names": float(1.0 / np.sum(w ** 2)),
+        "excluded": excluded,
+        "n_obs": int(len(x)),
+        "window": window,
+    }
+
 
 @st.cache_data(ttl=3600)
 def get_price_target(ticker):
@@ -10427,17 +12001,19 @@ def get_ps_ratio(ticker, ratios_ttm):
 # ============= AI RISK ANALYSIS (PERPLEXITY API) =============
 @st.cache_data(ttl=3600)
 def get_ai_risk_analysis(ticker, company_name):
+    """Red/green flags for `ticker`: the nightly pre-generated row when fresh, else a live call."""
+    pre = load_ai_pregen(ticker, "risk")
+    if pre is not None:
+        return pre
+    return _generate_ai_risk_analysis(ticker, company_name)
+
+
+def _generate_ai_risk_analysis(ticker, company_name):
     """Use Perplexity API to analyze recent news and identify red/green flags"""
     if not USE_AI_ANALYSIS or not PERPLEXITY_API_KEY:
         return None
     
     try:
-        url = "https://api.perplexity.ai/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         prompt = f"""Analyze the stock {ticker} ({company_name}) based on news from the last 30 days.
 
 Provide your analysis in this EXACT format (use simple language a middle schooler would understand):
@@ -10456,24 +12032,15 @@ OVERALL: [One sentence summary - is this stock looking good or risky right now?]
 
 Remember: Use simple words like "the company is making less money" instead of "declining revenue margins"."""
 
-        payload = {
-            "model": "sonar",
-            "messages": [
+        content = cached_chat_completion(
+            "perplexity",
+            [
                 {"role": "system", "content": "You are a helpful financial analyst who explains things simply for beginners. Always search for recent news about the company."},
                 {"role": "user", "content": prompt}
             ],
-            "temperature": 0.3,
-            "max_tokens": 800
-        }
-        
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            data = response.json()
-            content = data.get('choices', [{}])[0].get('message', {}).get('content', '')
-            return parse_ai_risk_response(content)
-        else:
-            return None
+            max_tokens=800, temperature=0.3, ttl_class="analysis"
+        )
+        return parse_ai_risk_response(content) if content else None
     except Exception as e:
         return None
 
@@ -10629,12 +12196,6 @@ def call_ai_with_context(task_name, context, prompt_template):
     cache_key = f"{task_name}_{context.get('ticker')}_{context.get('user_tier')}_{context.get('risk_profile', {}).get('label')}"
     
     try:
-        url = "https://api.perplexity.ai/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         system_prompt = f"""You are an AI financial analyst assistant. 
 User Context:
 - Tier: {context.get('user_tier', 'free')}
@@ -10646,24 +12207,14 @@ User Context:
 
 Respond in JSON format when asked for structured output."""
 
-        payload = {
-            "model": "sonar",
-            "messages": [
+        return cached_chat_completion(
+            "perplexity",
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt_template}
             ],
-            "temperature": 0.3,
-            "max_tokens": 1000
-        }
-        
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            data = response.json()
-            content = data.get('choices', [{}])[0].get('message', {}).get('content', '')
-            return content
-        else:
-            return None
+            max_tokens=1000, temperature=0.3, ttl_class="analysis"
+        )
     except Exception as e:
         return None
 
@@ -10962,87 +12513,286 @@ def _render_valuation_signal_box(stats, multiple_label):
 """
 
 
+# ============= CONTRIBUTION SCENARIO ENGINE (lump sum / DCA) =============
+# Any contribution schedule × any number of tickers over adjusted closes from
+# the local price store. Contributions land on the first trading day on/after
+# their calendar date (searchsorted), shares accumulate with a cumulative sum,
+# and every scenario comes back as a full daily value path for charting.
+SCHEDULE_FREQUENCIES = {
+    "once": None,
+    "weekly": pd.DateOffset(weeks=1),
+    "biweekly": pd.DateOffset(weeks=2),
+    "monthly": pd.DateOffset(months=1),      # same day-of-month as the start
+    "month_start": "MS",                     # calendar-aligned: 1st of each month
+    "month_end": "ME",                       # calendar-aligned: last day of each month
+}
+
+
+def build_contribution_schedule(start, end, frequency="biweekly", amount=100.0):
+    """Calendar dates → contribution amounts (pd.Series), first contribution at `start`."""
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+    step = SCHEDULE_FREQUENCIES[frequency]
+    if step is None:
+        dates = pd.DatetimeIndex([start])
+    elif isinstance(step, str):
+        try:
+            dates = pd.date_range(start, end, freq=step)
+        except ValueError:  # pandas < 2.2 spells month-end "M"
+            dates = pd.date_range(start, end, freq="M" if step == "ME" else step)
+    else:
+        dates = pd.date_range(start, end, freq=step)
+    return pd.Series(float(amount), index=dates)
+
+
+def get_scenario_prices(tickers, years):
+    """Dates × tickers adjusted closes for the last `years` years (store first, legacy endpoint fallback)."""
+    start = (datetime.now() - timedelta(days=int(years * 365.25))).strftime("%Y-%m-%d")
+    syms = tuple(t.upper() for t in tickers)
+    panel = get_price_panel(syms, start, field="adj_close")
+    for t in syms:
+        if t not in panel.columns or panel[t].isna().all():
+            legacy = get_historical_adjusted_prices(t, years)
+            if not legacy.empty and 'price' in legacy.columns:
+                col = legacy.set_index('date')['price']
+                panel = panel.reindex(panel.index.union(col.index)) if not panel.empty else pd.DataFrame(index=col.index)
+                panel[t] = col
+    return panel.sort_index().reindex(columns=list(syms)).dropna(how="all")
+
+
+def simulate_contributions(prices, schedule):
+    """
+    Replay a contribution schedule into every column of `prices`.
+
+    A contribution dated before a column's first price is not made for that
+    column (the ticker hadn't listed yet) and is counted in `skipped` instead.
+
+    Args:
+        prices: dates × tickers adjusted closes
+        schedule: pd.Series of amounts indexed by calendar date
+
+    Returns dict:
+        value: dates × tickers DataFrame of position value
+        invested: dates × tickers DataFrame of cumulative dollars contributed
+        shares / final_value / total_invested / return_pct: {ticker: ...}
+        payments / skipped: {ticker: contributions made / dated before listing}
+    """
+    idx, cols = prices.index, list(prices.columns)
+    pos = idx.searchsorted(schedule.index)
+    keep = pos < len(idx)
+    pos, amounts = pos[keep], schedule.values[keep].astype(float)
+
+    # Buy at the first available price on/after the contribution, once listed
+    listed = prices.notna().values.cumsum(axis=0) > 0
+    active = listed[pos]
+    spend = np.where(active, amounts[:, None], 0.0)
+    buy_px = prices.ffill().values[pos]
+    buys = np.divide(spend, buy_px, out=np.zeros_like(spend), where=active & (buy_px > 0))
+
+    delta = np.zeros(prices.shape)
+    np.add.at(delta, pos, buys)
+    shares = delta.cumsum(axis=0)
+    value = pd.DataFrame(shares * prices.ffill().fillna(0.0).values, index=idx, columns=cols)
+
+    paid = np.zeros(prices.shape)
+    np.add.at(paid, pos, spend)
+    invested = pd.DataFrame(paid.cumsum(axis=0), index=idx, columns=cols)
+    total_in = invested.iloc[-1] if len(idx) else pd.Series(0.0, index=cols)
+    final = value.iloc[-1] if len(idx) else pd.Series(0.0, index=cols)
+    return {
+        "value": value,
+        "invested": invested,
+        "shares": dict(zip(cols, shares[-1].tolist())) if len(idx) else {},
+        "final_value": final.to_dict(),
+        "total_invested": total_in.to_dict(),
+        "return_pct": {t: ((final[t] - total_in[t]) / total_in[t] * 100) if total_in[t] else 0.0
+                       for t in cols},
+        "payments": dict(zip(cols, active.sum(axis=0).astype(int).tolist())),
+        "skipped": dict(zip(cols, (~active).sum(axis=0).astype(int).tolist())),
+    }
+
+
+def _merge_contribution_runs(runs, columns):
+    """Combine simulate_contributions() results over disjoint column sets."""
+    out = {
+        "value": pd.concat([r["value"] for r in runs], axis=1)[columns],
+        "invested": pd.concat([r["invested"] for r in runs], axis=1)[columns],
+    }
+    for k in ("shares", "final_value", "total_invested", "return_pct", "payments", "skipped"):
+        out[k] = {t: v for r in runs for t, v in r[k].items()}
+    return out
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def run_contribution_scenarios(tickers, years=5, frequency="biweekly", amount=100.0, lump_sum=None):
+    """DCA (and optional lump sum) for each ticker over the last `years` years.
+
+    Each ticker's schedule starts at its own first price, so a recent listing
+    isn't credited with contributions (or a lump sum) from before it traded;
+    `starts` holds those dates. `tickers` should be a tuple. Returns
+    {'dca': simulate_contributions(...), 'lump': ... or None, 'prices', 'starts'} or None.
+    """
+    prices = get_scenario_prices(tickers, years)
+    if prices.empty or len(prices) < 2:
+        return None
+    end = prices.index[-1]
+    starts = prices.apply(pd.Series.first_valid_index).dropna()
+    groups = [(start, list(cols)) for start, cols in starts.groupby(starts).groups.items()]
+    dca = [simulate_contributions(prices[cols], build_contribution_schedule(start, end, frequency, amount))
+           for start, cols in groups]
+    out = {
+        "prices": prices,
+        "starts": starts.to_dict(),
+        "dca": _merge_contribution_runs(dca, list(starts.index)),
+        "lump": None,
+    }
+    if lump_sum:
+        lump = [simulate_contributions(prices[cols], build_contribution_schedule(start, end, "once", lump_sum))
+                for start, cols in groups]
+        out["lump"] = _merge_contribution_runs(lump, list(starts.index))
+    return out
+
+# ============= MONTE CARLO PROJECTIONS (block bootstrap) =============
+# Forward-looking companion to the scenario engine: resamples blocks of the
+# ticker's own historical daily log returns (price store) so fat tails and
+# short-term momentum survive, and simulates a contribution plan for 10k+
+# paths in one NumPy pass. Blocks are whole contribution periods, so each
+# period's growth is a prefix-sum difference — no per-day path matrix needed.
+MC_DEFAULT_PATHS = 10_000
+MC_HISTORY_YEARS = 10
+MC_BLOCK_TRADING_DAYS = 20
+MC_PERCENTILES = (5, 25, 50, 75, 95)
+MC_MAX_BAND_POINTS = 260  # fan resolution; long horizons are sampled down to this
+# frequency → (trading days per period, periods per year)
+MC_PERIODS = {"weekly": (5, 52), "biweekly": (10, 26), "monthly": (21, 12)}
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def project_contribution_plan(ticker, amount, frequency="weekly", horizon_years=5, initial=0.0,
+                              n_paths=MC_DEFAULT_PATHS, seed=7):
+    """
+    Simulate future values of "invest `amount` every period (+ `initial` now)".
+
+    Returns dict or None (not enough history):
+        dates: period-end dates (≤ MC_MAX_BAND_POINTS), invested: cumulative
+        dollars at those dates, bands: {percentile: np.array of value there},
+        final: {percentile: final value}, prob_loss: share of paths ending
+        below total invested, n_paths, history_days, elapsed_ms
+    """
+    t0 = time.perf_counter()
+    period_days, per_year = MC_PERIODS[frequency]
+    n_periods = int(round(horizon_years * per_year))
+    if n_periods < 1:
+        return None
+
+    start = (datetime.now() - timedelta(days=int(MC_HISTORY_YEARS * 365.25))).strftime("%Y-%m-%d")
+    px = get_price_panel((ticker.upper(),), start, field="adj_close")
+    series = px[ticker.upper()].dropna() if ticker.upper() in px.columns else pd.Series(dtype=float)
+    log_ret = np.diff(np.log(series.values[series.values > 0]))
+    periods_per_block = max(1, MC_BLOCK_TRADING_DAYS // period_days)
+    block_days = periods_per_block * period_days
+    if len(log_ret) < max(block_days * 10, 252):
+        return None
+
+    # Period log-growth for every (path, period): sample block starts, read
+    # each period inside the block off the history's prefix sums.
+    rng = np.random.default_rng(seed)
+    csum = np.concatenate(([0.0], np.cumsum(log_ret))).astype(np.float32)
+    n_blocks = -(-n_periods // periods_per_block)
+    starts = rng.integers(0, len(log_ret) - block_days + 1, size=(n_paths, n_blocks))
+    offsets = np.arange(periods_per_block) * period_days
+    lo = (starts[:, :, None] + offsets).reshape(n_paths, -1)[:, :n_periods]
+    growth = csum[lo + period_days] - csum[lo]
+
+    # W_k = Σ_{i≤k} c_i · exp(L_k − L_{i−1}), contributions at the start of each period
+    contrib = np.full(n_periods, float(amount))
+    contrib[0] += float(initial)
+    disc = np.exp(-np.cumsum(growth, axis=1))               # exp(−L_k)
+    disc_prev = np.concatenate((np.ones((n_paths, 1), np.float32), disc[:, :-1]), axis=1)
+    wealth = np.cumsum(contrib.astype(np.float32) * disc_prev, axis=1) / disc
+
+    invested = np.cumsum(contrib)
+    sel = np.unique(np.linspace(0, n_periods - 1, min(n_periods, MC_MAX_BAND_POINTS)).astype(int))
+    q = np.percentile(wealth[:, sel], MC_PERCENTILES, axis=0)
+    step = {"weekly": pd.DateOffset(weeks=1), "biweekly": pd.DateOffset(weeks=2),
+            "monthly": pd.DateOffset(months=1)}[frequency]
+    today = pd.Timestamp(datetime.now().date())
+    dates = pd.DatetimeIndex([today + step * (int(k) + 1) for k in sel])
+
+    return {
+        "dates": dates,
+        "invested": invested[sel],
+        "bands": dict(zip(MC_PERCENTILES, q)),
+        "final": {p: float(v[-1]) for p, v in zip(MC_PERCENTILES, q)},
+        "total_invested": float(invested[-1]),
+        "prob_loss": float((wealth[:, -1] < invested[-1]).mean()),
+        "n_paths": n_paths,
+        "history_days": int(len(log_ret)),
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+    }
+
+
+def render_projection_fan(proj, title, key):
+    """Percentile fan (5–95 / 25–75 / median) vs dollars invested."""
+    d, b = proj["dates"], proj["bands"]
+    fig = go.Figure()
+    for lo, hi, alpha in ((5, 95, 0.15), (25, 75, 0.3)):
+        fig.add_trace(go.Scatter(x=d, y=b[hi], line=dict(width=0), showlegend=False, hoverinfo="skip"))
+        fig.add_trace(go.Scatter(x=d, y=b[lo], fill="tonexty", fillcolor=f"rgba(0,217,255,{alpha})",
+                                 line=dict(width=0), name=f"{lo}th–{hi}th percentile"))
+    fig.add_trace(go.Scatter(x=d, y=b[50], name="Median", line=dict(color="#00D9FF", width=2)))
+    fig.add_trace(go.Scatter(x=d, y=proj["invested"], name="$ put in",
+                             line=dict(color="#888888", width=1, dash="dot")))
+    fig.update_layout(title=title, yaxis_title="Value ($)", height=360, hovermode="x unified",
+                      legend=dict(orientation="h", y=-0.2), margin=dict(l=10, r=10, t=40, b=10))
+    st.plotly_chart(fig, use_container_width=True, key=key)
+    st.caption(f"{proj['n_paths']:,} simulated paths stitched from ~1-month chunks of "
+               f"{proj['history_days']:,} days of real returns. {proj['prob_loss']*100:.0f}% of paths end "
+               "below what you put in. Not a prediction — a range of plausible outcomes.")
+
 def calculate_four_scenarios(ticker, years=5, base_amount=100):
-    """Calculate the four investment scenarios using adjusted close prices"""
-    stock_data = get_historical_adjusted_prices(ticker, years)
-    spy_data = get_historical_adjusted_prices("SPY", years)
-    
-    if stock_data.empty or spy_data.empty:
+    """Calculate the four investment scenarios using adjusted close prices
+
+    Lump sum vs paycheck (every 2 weeks, by calendar date) for `ticker` and SPY,
+    via the contribution scenario engine. `paths` holds the daily value of each
+    scenario and `invested_paths` the matching dollars put in. `start_dates`
+    differ when the ticker listed after the start of the window.
+    """
+    sym = ticker.upper()
+    run = run_contribution_scenarios(tuple(dict.fromkeys((sym, "SPY"))), years, "biweekly",
+                                     base_amount, lump_sum=base_amount)
+    if not run or not run["prices"].notna().any().all():
         return None
     
     results = {
         "timeline_years": years,
         "base_amount": base_amount,
-        "scenarios": {}
-    }
-    
-    stock_start = stock_data['price'].iloc[0]
-    stock_end = stock_data['price'].iloc[-1]
-    spy_start = spy_data['price'].iloc[0]
-    spy_end = spy_data['price'].iloc[-1]
-    
-    if stock_start > 0:
-        shares = base_amount / stock_start
-        final_value = shares * stock_end
-        results["scenarios"]["lump_stock"] = {
-            "name": f"Lump Sum {ticker}",
-            "invested": base_amount,
-            "final_value": final_value,
-            "return_pct": ((final_value - base_amount) / base_amount) * 100,
-            "shares": shares
-        }
-    
-    if spy_start > 0:
-        shares = base_amount / spy_start
-        final_value = shares * spy_end
-        results["scenarios"]["lump_sp500"] = {
-            "name": "Lump Sum S&P 500",
-            "invested": base_amount,
-            "final_value": final_value,
-            "return_pct": ((final_value - base_amount) / base_amount) * 100,
-            "shares": shares
-        }
-    
-    biweekly_periods = years * 26
-    total_invested = base_amount * biweekly_periods
-    
-    stock_interval = max(1, len(stock_data) // biweekly_periods)
-    stock_shares = 0
-    stock_invested = 0
-    for i in range(0, min(len(stock_data), biweekly_periods * stock_interval), stock_interval):
-        if i < len(stock_data) and stock_data['price'].iloc[i] > 0:
-            stock_shares += base_amount / stock_data['price'].iloc[i]
-            stock_invested += base_amount
-    
-    if stock_shares > 0:
-        final_value = stock_shares * stock_end
-        results["scenarios"]["dca_stock"] = {
-            "name": f"Paycheck {ticker}",
-            "invested": stock_invested,
-            "final_value": final_value,
-            "return_pct": ((final_value - stock_invested) / stock_invested) * 100 if stock_invested > 0 else 0,
-            "shares": stock_shares,
-            "payments": biweekly_periods
+        "scenarios": {},
+        "paths": {},
+        "invested_paths": {},
+        "start_dates": {"stock": run["starts"][sym], "sp500": run["starts"]["SPY"]}
+    }
+    
+    lump, dca = run["lump"], run["dca"]
+    for suffix, col, label in (("stock", sym, ticker), ("sp500", "SPY", "S&P 500")):
+        results["scenarios"][f"lump_{suffix}"] = {
+            "name": f"Lump Sum {label}",
+            "invested": lump["total_invested"][col],
+            "final_value": lump["final_value"][col],
+            "return_pct": lump["return_pct"][col],
+            "shares": lump["shares"][col]
         }
-    
-    spy_interval = max(1, len(spy_data) // biweekly_periods)
-    spy_shares = 0
-    spy_invested = 0
-    for i in range(0, min(len(spy_data), biweekly_periods * spy_interval), spy_interval):
-        if i < len(spy_data) and spy_data['price'].iloc[i] > 0:
-            spy_shares += base_amount / spy_data['price'].iloc[i]
-            spy_invested += base_amount
-    
-    if spy_shares > 0:
-        final_value = spy_shares * spy_end
-        results["scenarios"]["dca_sp500"] = {
-            "name": "Paycheck S&P 500",
-            "invested": spy_invested,
-            "final_value": final_value,
-            "return_pct": ((final_value - spy_invested) / spy_invested) * 100 if spy_invested > 0 else 0,
-            "shares": spy_shares,
-            "payments": biweekly_periods
+        results["scenarios"][f"dca_{suffix}"] = {
+            "name": f"Paycheck {label}",
+            "invested": dca["total_invested"][col],
+            "final_value": dca["final_value"][col],
+            "return_pct": dca["return_pct"][col],
+            "shares": dca["shares"][col],
+            "payments": dca["payments"][col]
         }
+        results["paths"][f"lump_{suffix}"] = lump["value"][col]
+        results["paths"][f"dca_{suffix}"] = dca["value"][col]
+        results["invested_paths"][f"lump_{suffix}"] = lump["invested"][col]
+        results["invested_paths"][f"dca_{suffix}"] = dca["invested"][col]
     
     return results
 
@@ -11331,9 +13081,14 @@ def clean_ai_response(text):
     text = re.sub(r'\n\n\n+', '\n\n', text)
     return text.strip()
 
-def get_chatbot_response(user_message, context=None):
-    """Get AI response - tries Perplexity first, then OpenAI as fallback"""
-    
+_CHATBOT_PROVIDERS = ("grok", "perplexity", "openai")
+_CHATBOT_OVERRIDES = {"perplexity": {"temperature": 0.5}}
+_CHATBOT_NO_KEYS = "❌ No API keys configured. Please add GROK_API_KEY, PERPLEXITY_API_KEY or OPENAI_API_KEY to your environment variables."
+_CHATBOT_UNAVAILABLE = "I'm having trouble connecting to the AI service. Please try again in a moment."
+
+
+def _chatbot_messages(user_message, context=None):
+    """System prompt (with page / ticker context) + user message for the assistant."""
     # Build context-aware system prompt
     system_prompt = """You are a friendly, knowledgeable AI investment assistant for "Investing Made Simple". 
 Your role is to help users understand investing concepts and answer questions about stocks and markets.
@@ -11362,101 +13117,46 @@ When the user asks to find stocks (like "find stocks with P/E under 12"), you MU
         if context.get('unhinged_mode'):
             system_prompt += "\nUNHINGED MODE: Be witty and add playful roast commentary while still being helpful."
     
-    # Try Grok FIRST (best for real-time X/Twitter content and stock questions)
-    if GROK_API_KEY:
-        try:
-            response = requests.post(
-                "https://api.x.ai/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {GROK_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "grok-beta",
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message}
-                    ],
-                    "max_tokens": 1000,
-                    "temperature": 0.7
-                },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                if content and len(content) > 50:  # Only accept substantial responses
-                    return clean_ai_response(content)
-            print(f"[CHATBOT] Grok failed: {response.status_code} - {response.text[:200]}")
-        except Exception as e:
-            print(f"[CHATBOT] Grok error: {e}")
-    
-    # Try Perplexity SECOND (has web search for current data)
-    if PERPLEXITY_API_KEY:
-        try:
-            response = requests.post(
-                "https://api.perplexity.ai/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "sonar",
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message}
-                    ],
-                    "max_tokens": 1000,
-                    "temperature": 0.5
-                },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                if content and len(content) > 50:
-                    return clean_ai_response(content)
-            print(f"[CHATBOT] Perplexity failed: {response.status_code} - {response.text[:200]}")
-        except Exception as e:
-            print(f"[CHATBOT] Perplexity error: {e}")
-    
-    # Try OpenAI as THIRD fallback
-    if OPENAI_API_KEY:
-        try:
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message}
-                    ],
-                    "max_tokens": 1000,
-                    "temperature": 0.7
-                },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                if content:
-                    return clean_ai_response(content)
-            print(f"[CHATBOT] OpenAI failed: {response.status_code} - {response.text[:200]}")
-        except Exception as e:
-            print(f"[CHATBOT] OpenAI error: {e}")
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}]
+
+
+def get_chatbot_response(user_message, context=None):
+    """Get AI response - Grok, Perplexity and OpenAI raced via route_llm"""
+    # Grok first (real-time X/Twitter content), Perplexity (web search), OpenAI —
+    # raced with hedging so a slow provider doesn't hold up the answer
+    def _accept(content, provider):
+        # Grok / Perplexity must give a substantial answer; OpenAI is the last resort
+        if provider != "openai" and len(content) <= 50:
+            return None
+        return clean_ai_response(content)
+
+    reply, _ = route_llm(
+        _chatbot_messages(user_message, context), _accept, providers=_CHATBOT_PROVIDERS,
+        max_tokens=1000, temperature=0.7, overrides=_CHATBOT_OVERRIDES, label="chatbot", cache="chat",
+    )
+    if reply:
+        return reply
     
     # All failed
     if not GROK_API_KEY and not PERPLEXITY_API_KEY and not OPENAI_API_KEY:
-        return "❌ No API keys configured. Please add GROK_API_KEY, PERPLEXITY_API_KEY or OPENAI_API_KEY to your environment variables."
+        return _CHATBOT_NO_KEYS
     
-    return "I'm having trouble connecting to the AI service. Please try again in a moment."
+    return _CHATBOT_UNAVAILABLE
+
+
+def stream_chatbot_response(user_message, context=None):
+    """Streaming variant of get_chatbot_response: yields raw text chunks (clean the joined text)."""
+    if not GROK_API_KEY and not PERPLEXITY_API_KEY and not OPENAI_API_KEY:
+        yield _CHATBOT_NO_KEYS
+        return
+    got_any = False
+    for chunk in stream_llm(_chatbot_messages(user_message, context), providers=_CHATBOT_PROVIDERS,
+                            max_tokens=1000, temperature=0.7, overrides=_CHATBOT_OVERRIDES,
+                            label="chatbot", cache="chat"):
+        got_any = True
+        yield chunk
+    if not got_any:
+        yield _CHATBOT_UNAVAILABLE
 
 def render_ai_chatbot():
     """Render the AI chatbot using sidebar button + st.dialog - STAYS OPEN after messages"""
@@ -11560,9 +13260,18 @@ def render_ai_chatbot():
                     "unhinged_mode": st.session_state.get("unhinged_mode", False)
                 }
 
-                # Show response immediately in the dialog
-                with st.spinner("🔍 Searching & thinking..."):
-                    response = get_chatbot_response(user_input.strip(), context)
+                # Stream the answer into the dialog as tokens arrive
+                _ai_bubble = lambda text: f'<div style="background: rgba(33,150,243,0.15); padding: 10px 15px; border-radius: 10px; margin: 8px 0; color: #333;"><strong>🤖 AI:</strong> {text}</div>'
+                reply_slot = st.empty()
+                reply_slot.markdown(_ai_bubble("🔍 Searching & thinking..."), unsafe_allow_html=True)
+                response, _last_paint = "", 0.0
+                for _chunk in stream_chatbot_response(user_input.strip(), context):
+                    response += _chunk
+                    if time.time() - _last_paint > 0.05:
+                        reply_slot.markdown(_ai_bubble(response + " ▌"), unsafe_allow_html=True)
+                        _last_paint = time.time()
+                response = clean_ai_response(response) or _CHATBOT_UNAVAILABLE
+                reply_slot.markdown(_ai_bubble(response), unsafe_allow_html=True)
 
                 # Increment query counter
                 st.session_state.ai_query_count = st.session_state.get("ai_query_count", 0) + 1
@@ -11581,9 +13290,6 @@ def render_ai_chatbot():
                 # Add AI response
                 st.session_state.chat_messages.append({"role": "assistant", "content": response})
             
-                # Display the new response immediately
-                st.markdown(f'<div style="background: rgba(33,150,243,0.15); padding: 10px 15px; border-radius: 10px; margin: 8px 0; color: #333;"><strong>🤖 AI:</strong> {response}</div>', unsafe_allow_html=True)
-            
             # Note: NOT calling st.rerun() to keep dialog open
         
         if clear_btn:
@@ -12369,28 +14075,18 @@ def signup_dialog():
 
 # ============= COFFEE COMPARISON CALCULATOR =============
 def calculate_coffee_investment(ticker, weekly_amount, years=5):
-    """Calculate what weekly coffee money would be worth if invested"""
+    """Calculate what weekly coffee money would be worth if invested
+
+    Real weekly buys over adjusted closes (contribution scenario engine).
+    Returns (total_invested, final_value) or (None, None).
+    """
     try:
-        price_data = get_historical_price(ticker, years)
-        if price_data.empty or 'price' not in price_data.columns:
+        sym = ticker.upper()
+        run = run_contribution_scenarios((sym,), years, "weekly", weekly_amount)
+        if not run or run["dca"]["payments"].get(sym, 0) == 0:
             return None, None
-        
-        price_data = price_data.sort_values('date')
-        start_price = price_data['price'].iloc[0]
-        end_price = price_data['price'].iloc[-1]
-        
-        total_return = (end_price - start_price) / start_price
-        weeks = years * 52
-        total_invested = weekly_amount * weeks
-        
-        avg_weekly_return = (1 + total_return) ** (1 / weeks) - 1
-        
-        future_value = 0
-        for week in range(weeks):
-            weeks_remaining = weeks - week
-            future_value += weekly_amount * ((1 + avg_weekly_return) ** weeks_remaining)
-        
-        return total_invested, future_value
+        dca = run["dca"]
+        return dca["total_invested"][sym], dca["final_value"][sym]
     except Exception:
         return None, None
 
@@ -12439,6 +14135,16 @@ def render_coffee_calculator(ticker, stock_name):
         ''', unsafe_allow_html=True)
     else:
         st.info(f"Unable to calculate coffee investment for {ticker}. Try a different stock.")
+    
+    # Forward-looking: same habit, next N years (Monte Carlo)
+    horizon = st.slider("…and if you kept it up for the next", min_value=1, max_value=30, value=10,
+                        step=1, format="%d years", key=f"coffee_horizon_{ticker}")
+    proj = project_contribution_plan(ticker, weekly_amount, "weekly", horizon)
+    if proj:
+        lo, mid, hi = proj["final"][5], proj["final"][50], proj["final"][95]
+        st.markdown(f"In **{horizon} years** your ${proj['total_invested']:,.0f} could be worth "
+                    f"**${mid:,.0f}** (typical), with a realistic range of ${lo:,.0f} – ${hi:,.0f}.")
+        render_projection_fan(proj, f"${weekly_amount}/week into {ticker}: possible futures", key=f"coffee_fan_{ticker}")
 
 # ============= PROGRESS GAMIFICATION =============
 def render_progress_bar(current_step, total_steps, section_name, disable_celebrations=False):
@@ -12725,7 +14431,7 @@ if 'user_profile' not in st.session_state:
     }
 
 # ============= TRADE VALIDATION & PERSISTENCE =============
-STARTING_CASH = 100000.0
+STARTING_CASH = 100000.0   # rebuild_paper_book() in the README SQL hardcodes the same amount
 
 def calculate_cash_from_db(user_id, portfolio_type='user'):
     """
@@ -12736,10 +14442,15 @@ def calculate_cash_from_db(user_id, portfolio_type='user'):
     if not SUPABASE_ENABLED:
         # No DB - use STARTING_CASH (don't trust stale session state)
         return STARTING_CASH, None
+
+    # Materialized balance row: one-row read instead of a ledger replay
+    book = load_materialized_book(user_id, portfolio_type, with_positions=False)
+    if book is not None:
+        return book['cash'], None
     
     try:
         # Fetch all trades for this user/portfolio from DB
-        query = supabase.table("trades").select("*")
+        query = supabase.table("trades").select("trade_type, total")
         
         if portfolio_type == 'founder':
             # Founder trades are public, filter by portfolio_type only
@@ -12807,40 +14518,67 @@ def validate_and_insert_trade(user_id, portfolio_type, action, ticker, shares, p
         sess_key = 'founder_cash' if portfolio_type == 'founder' else 'cash'
         return st.session_state.get(sess_key, STARTING_CASH)
     
-    # ============= DETERMINE CURRENT POSITIONS (session state) =============
-    sess_txns_key = 'founder_transactions' if portfolio_type == 'founder' else 'transactions'
-    current_portfolio = rebuild_portfolio_from_trades(st.session_state.get(sess_txns_key, []))
+    def _insufficient_funds_msg(cash_available):
+        shortfall = estimated_cost - cash_available
+        return (
+            f"❌ **Insufficient Funds**\n\n"
+            f"This trade requires **${estimated_cost:,.2f}**\n"
+            f"but you only have **${cash_available:,.2f}** available.\n\n"
+            f"You need **${shortfall:,.2f}** more.\n\n"
+            f"Please reduce quantity."
+        )
+
+    def _insufficient_shares_msg(held):
+        return (
+            f"❌ **Insufficient Shares**\n\n"
+            f"You want to sell **{shares} shares** of {ticker_up}, "
+            f"but you only hold **{held:.4f} shares**.\n\n"
+            f"Please reduce the quantity."
+        )
+
+    no_position_msg = f"❌ **No Position Found**\n\nYou don't own any shares of **{ticker_up}**. You can only sell stocks you hold."
+
+    # ============= ATOMIC DB PATH (materialized balances) =============
+    # apply_paper_trade() checks cash/shares against the materialized rows,
+    # inserts the trade and updates both tables in one transaction. None means
+    # the SQL function isn't installed → fall through to the ledger path.
+    rpc_result = None
+    if SUPABASE_ENABLED and (portfolio_type == 'founder' or user_id):
+        rpc_result = _apply_trade_rpc(user_id, portfolio_type, action, ticker_up, shares, price)
+    if rpc_result is not None and not rpc_result.get("ok"):
+        reason = rpc_result.get("reason")
+        if reason == "INSUFFICIENT_FUNDS":
+            return False, _insufficient_funds_msg(float(rpc_result.get("cash", 0)))
+        if reason == "INSUFFICIENT_SHARES":
+            held = float(rpc_result.get("shares", 0) or 0)
+            return False, _insufficient_shares_msg(held) if held > 0 else no_position_msg
+        if reason == "NOT_AUTHORIZED":
+            return False, "❌ **Trade not saved**\n\nYou can only trade your own portfolio. Please log in again."
+        return False, f"❌ **Trade not saved**\n\n{rpc_result.get('detail') or reason}"
+    db_saved = bool(rpc_result and rpc_result.get("ok"))
+
+    # ============= DETERMINE CURRENT POSITIONS (session state, split-adjusted) =============
+    # Positions are shown and ordered in post-split units; the page already
+    # rebuilt the session portfolio from its corporate-adjusted ledger.
+    current_portfolio = st.session_state.get('founder_portfolio' if portfolio_type == 'founder' else 'portfolio', [])
     
     # ============= VALIDATE BUY =============
-    if action == "Buy":
+    if action == "Buy" and not db_saved:
         cash_available = _get_current_cash()
         
         if estimated_cost > cash_available + 1e-6:  # tiny float tolerance
-            shortfall = estimated_cost - cash_available
-            return False, (
-                f"❌ **Insufficient Funds**\n\n"
-                f"This trade requires **${estimated_cost:,.2f}**\n"
-                f"but you only have **${cash_available:,.2f}** available.\n\n"
-                f"You need **${shortfall:,.2f}** more.\n\n"
-                f"Please reduce quantity."
-            )
+            return False, _insufficient_funds_msg(cash_available)
     
     # ============= VALIDATE SELL =============
-    if action == "Sell":
+    if action == "Sell" and not db_saved:
         position = next((p for p in current_portfolio if p["ticker"].upper() == ticker_up), None)
         if not position:
-            return False, f"❌ **No Position Found**\n\nYou don't own any shares of **{ticker_up}**. You can only sell stocks you hold."
+            return False, no_position_msg
         if float(shares) > float(position["shares"]) + 1e-6:
-            return False, (
-                f"❌ **Insufficient Shares**\n\n"
-                f"You want to sell **{shares} shares** of {ticker_up}, "
-                f"but you only hold **{position['shares']:.4f} shares**.\n\n"
-                f"Please reduce the quantity."
-            )
+            return False, _insufficient_shares_msg(float(position["shares"]))
     
     # ============= INSERT INTO DATABASE (BEST EFFORT) =============
-    db_saved = False
-    if SUPABASE_ENABLED:
+    if SUPABASE_ENABLED and rpc_result is None:
         try:
             trade_data = {
                 "portfolio_type": portfolio_type,
@@ -12886,14 +14624,21 @@ def validate_and_insert_trade(user_id, portfolio_type, action, ticker, shares, p
             st.session_state.founder_cash -= estimated_cost
         else:
             st.session_state.founder_cash += estimated_cost
-        st.session_state.founder_portfolio = rebuild_portfolio_from_trades(st.session_state.founder_transactions)
+        st.session_state.founder_portfolio = rebuild_portfolio_from_trades(
+            extend_corporate_adjusted("founder", st.session_state.founder_transactions)["transactions"])
     else:
         st.session_state.transactions.insert(0, transaction)
         if action == "Buy":
             st.session_state.cash -= estimated_cost
         else:
             st.session_state.cash += estimated_cost
-        st.session_state.portfolio = rebuild_portfolio_from_trades(st.session_state.transactions)
+        st.session_state.portfolio = rebuild_portfolio_from_trades(
+            extend_corporate_adjusted("user", st.session_state.transactions)["transactions"])
+
+    # The DB function returns the post-trade balance — prefer it over local math
+    if rpc_result and rpc_result.get("cash") is not None:
+        cash_key = 'founder_cash' if portfolio_type == 'founder' else 'cash'
+        st.session_state[cash_key] = float(rpc_result["cash"])
     
     # Success message
     action_word = "Bought" if action == "Buy" else "Sold"
@@ -13008,6 +14753,837 @@ def rebuild_portfolio_from_trades(transactions):
     
     return portfolio
 
+# ============= TAX-LOT LEDGER (FIFO / LIFO / HIFO / specific / average cost) =============
+# rebuild_portfolio_from_trades collapses a ticker into one average price; this
+# keeps every buy as a lot so sales realize gains against the right cost and
+# holding period. Lots live in per-ticker array.array columns (qty / cost /
+# opened day / lot id) with a consumed-head offset, so a FIFO sale is O(lots
+# touched) and a ledger of 100k trades replays in well under a second.
+# Realized pieces are appended to flat columns and only turned into a
+# DataFrame for reporting. A previous state can be extended with new trades
+# (same prefix check as the NAV engine).
+from array import array
+
+TAX_LOT_METHODS = {
+    "fifo": "FIFO",
+    "lifo": "LIFO",
+    "hifo": "HIFO (highest cost first)",
+    "specific": "Specific lots (FIFO when none picked)",
+    "average": "Average cost",
+}
+LONG_TERM_DAYS = 365          # held more than a year → long-term
+_LOT_EPS = 1e-9
+
+
+def _new_lot_state(method):
+    return {
+        "method": method, "books": {}, "n_trades": 0, "signature": [], "unmatched": 0.0,
+        "realized": {"ticker": [], "lot": array("q"), "qty": array("d"), "opened": array("q"),
+                     "closed": array("q"), "cost": array("d"), "proceeds": array("d")},
+    }
+
+
+def _lot_book(state, ticker):
+    book = state["books"].get(ticker)
+    if book is None:
+        book = state["books"][ticker] = {
+            "qty": array("d"), "cost": array("d"), "opened": array("q"), "lot": array("q"),
+            "head": 0, "open_qty": 0.0, "open_cost": 0.0,
+        }
+    return book
+
+
+def _lot_order(book, method, wanted=None):
+    """Indices of open lots in the order a sale consumes them.
+
+    For method="specific", `wanted` lot ids are closed first (in the order
+    given); whatever is still to sell comes from the remaining lots FIFO.
+    """
+    qty, head, n = book["qty"], book["head"], len(book["qty"])
+    if method == "specific" and wanted:
+        open_idx = [j for j in range(head, n) if qty[j] > _LOT_EPS]
+        by_id = {book["lot"][j]: j for j in open_idx}
+        chosen = list(dict.fromkeys(by_id[l] for l in wanted if l in by_id))
+        picked = set(chosen)
+        return iter(chosen + [j for j in open_idx if j not in picked])
+    if method == "lifo":
+        return (j for j in range(n - 1, head - 1, -1) if qty[j] > _LOT_EPS)
+    if method == "hifo":
+        return iter(sorted((j for j in range(head, n) if qty[j] > _LOT_EPS), key=lambda j: -book["cost"][j]))
+    return (j for j in range(head, n) if qty[j] > _LOT_EPS)      # fifo / average
+
+
+def _apply_lot_trades(state, rows, start_id):
+    """Apply oldest-first (ticker, is_buy, shares, price, day, lots) rows to `state` in place."""
+    method, realized = state["method"], state["realized"]
+    for k, (ticker, is_buy, shares, price, day, wanted) in enumerate(rows):
+        if shares <= _LOT_EPS:
+            continue                                 # cash-only rows (dividends)
+        book = _lot_book(state, ticker)
+        if is_buy:
+            book["qty"].append(shares)
+            book["cost"].append(price)
+            book["opened"].append(day)
+            book["lot"].append(start_id + k)
+            book["open_qty"] += shares
+            book["open_cost"] += shares * price
+            continue
+
+        remaining = shares
+        avg = book["open_cost"] / book["open_qty"] if book["open_qty"] > _LOT_EPS else 0.0
+        for j in _lot_order(book, method, wanted):
+            take = min(book["qty"][j], remaining)
+            basis = avg if method == "average" else book["cost"][j]
+            book["qty"][j] -= take
+            book["open_qty"] -= take
+            book["open_cost"] -= take * basis
+            realized["ticker"].append(ticker)
+            realized["lot"].append(book["lot"][j])
+            realized["qty"].append(take)
+            realized["opened"].append(book["opened"][j])
+            realized["closed"].append(day)
+            realized["cost"].append(take * basis)
+            realized["proceeds"].append(take * price)
+            remaining -= take
+            if remaining <= _LOT_EPS:
+                break
+        if remaining > _LOT_EPS:
+            state["unmatched"] += remaining      # sold more than held: ignored like the position rebuild
+
+        # Drop fully consumed lots from both ends so scans stay short
+        qty = book["qty"]
+        while book["head"] < len(qty) and qty[book["head"]] <= _LOT_EPS:
+            book["head"] += 1
+        while len(qty) > book["head"] and qty[-1] <= _LOT_EPS:
+            for col in ("qty", "cost", "opened", "lot"):
+                book[col].pop()
+        if book["open_qty"] <= _LOT_EPS:
+            book["open_qty"] = book["open_cost"] = 0.0
+        if method == "average" and book["open_qty"] > 0:
+            # Remaining shares all carry the pooled average basis
+            unit = book["open_cost"] / book["open_qty"]
+            for j in range(book["head"], len(qty)):
+                book["cost"][j] = unit
+
+
+def build_tax_lots(transactions, method="fifo", prev=None, lot_picks=None):
+    """
+    Replay a trade ledger into tax lots.
+
+    Args:
+        transactions: trades in load_trades_from_db display format (newest first).
+                      With method="specific" a SELL may carry 'lots': a lot id
+                      or list of lot ids to close first.
+        method: one of TAX_LOT_METHODS
+        prev: an earlier state for the same book and method; when its trades are
+              a prefix of `transactions` only the new trades are applied.
+        lot_picks: {trade index: [lot ids]} for method="specific", overriding any
+                   'lots' on the row. Trade index and lot id are both positions in
+                   the oldest-first ledger (a lot's id is its BUY's index).
+
+    Returns: state dict (feed to tax_lot_report) or None when there are no trades.
+    """
+    if method not in TAX_LOT_METHODS:
+        raise ValueError(f"Unknown lot method: {method}")
+    tx = _trades_frame(transactions)
+    if tx.empty:
+        return None
+
+    days = tx["day"].values.astype("datetime64[D]").astype(np.int64)
+    wanted = [None] * len(tx)
+    if method == "specific":
+        row_lots = tx["lots"].tolist() if "lots" in tx.columns else wanted
+        for k, picks in enumerate(row_lots):
+            if isinstance(picks, (list, tuple)):
+                wanted[k] = tuple(int(l) for l in picks)
+            elif picks is not None and pd.notna(picks):
+                wanted[k] = (int(picks),)
+        for k, picks in (lot_picks or {}).items():
+            if 0 <= int(k) < len(wanted):
+                wanted[int(k)] = tuple(int(l) for l in picks)
+
+    signature = list(zip(tx["date"].astype(str).tolist(), tx["ticker"].tolist(), tx["dshares"].tolist(),
+                         wanted))
+    if (prev is not None and prev["method"] == method
+            and signature[:prev["n_trades"]] == prev["signature"]):
+        state, start = prev, prev["n_trades"]
+    else:
+        state, start = _new_lot_state(method), 0
+
+    rows = zip(tx["ticker"].tolist()[start:], (tx["dshares"].values[start:] > 0).tolist(),
+               np.abs(tx["dshares"].values[start:]).tolist(), tx["price"].astype(float).tolist()[start:],
+               days[start:].tolist(), wanted[start:])
+    _apply_lot_trades(state, rows, start)
+    state["n_trades"], state["signature"] = len(signature), signature
+    return state
+
+
+def tax_lot_report(state, prices=None, asof=None):
+    """
+    Realized / unrealized P&L and holding periods from a build_tax_lots state.
+
+    Args:
+        prices: {ticker: current price} for unrealized P&L (open lots without a
+                price get NaN)
+        asof: date for open-lot holding periods (default today)
+
+    Returns dict:
+        realized (DataFrame per closed lot piece), open_lots (DataFrame),
+        positions (DataFrame per ticker: shares, cost_basis, avg_cost,
+        market_value, unrealized), totals {realized, short_term, long_term,
+        unrealized, unrealized_short, unrealized_long, cost_basis, unmatched}
+    """
+    r = state["realized"]
+    realized = pd.DataFrame({
+        "ticker": r["ticker"], "lot": np.frombuffer(r["lot"], dtype=np.int64),
+        "qty": np.frombuffer(r["qty"]), "opened": np.frombuffer(r["opened"], dtype=np.int64),
+        "closed": np.frombuffer(r["closed"], dtype=np.int64),
+        "cost": np.frombuffer(r["cost"]), "proceeds": np.frombuffer(r["proceeds"]),
+    })
+    realized["gain"] = realized["proceeds"] - realized["cost"]
+    realized["days_held"] = realized["closed"] - realized["opened"]
+    realized["term"] = np.where(realized["days_held"] > LONG_TERM_DAYS, "long", "short")
+    for col in ("opened", "closed"):
+        realized[col] = realized[col].values.astype("datetime64[D]")
+
+    today = np.datetime64(pd.Timestamp(asof or datetime.now().date()).date(), "D").astype(np.int64)
+    open_parts = []
+    for ticker, book in state["books"].items():
+        h = book["head"]
+        qty = np.frombuffer(book["qty"])[h:]
+        keep = qty > _LOT_EPS
+        if not keep.any():
+            continue
+        open_parts.append(pd.DataFrame({
+            "ticker": ticker, "lot": np.frombuffer(book["lot"], dtype=np.int64)[h:][keep],
+            "qty": qty[keep], "cost_px": np.frombuffer(book["cost"])[h:][keep],
+            "opened": np.frombuffer(book["opened"], dtype=np.int64)[h:][keep],
+        }))
+    open_lots = (pd.concat(open_parts, ignore_index=True) if open_parts else
+                 pd.DataFrame(columns=["ticker", "lot", "qty", "cost_px", "opened"]))
+    open_lots["days_held"] = today - open_lots["opened"].astype(np.int64)
+    open_lots["term"] = np.where(open_lots["days_held"] > LONG_TERM_DAYS, "long", "short")
+    open_lots["opened"] = open_lots["opened"].values.astype(np.int64).astype("datetime64[D]")
+    open_lots["cost"] = open_lots["qty"] * open_lots["cost_px"]
+    px_map = {t.upper(): p for t, p in (prices or {}).items() if p}
+    open_lots["price"] = open_lots["ticker"].map(px_map).astype(float)
+    open_lots["market_value"] = open_lots["qty"] * open_lots["price"]
+    open_lots["unrealized"] = open_lots["market_value"] - open_lots["cost"]
+
+    positions = open_lots.groupby("ticker").agg(
+        shares=("qty", "sum"), cost_basis=("cost", "sum"),
+        market_value=("market_value", lambda s: s.sum(min_count=1)),
+        unrealized=("unrealized", lambda s: s.sum(min_count=1)),
+    ).reset_index() if not open_lots.empty else pd.DataFrame(
+        columns=["ticker", "shares", "cost_basis", "market_value", "unrealized"])
+    positions["avg_cost"] = positions["cost_basis"] / positions["shares"].where(positions["shares"] > 0)
+
+    by_term = realized.groupby("term")["gain"].sum()
+    unreal_by_term = open_lots.groupby("term")["unrealized"].sum()
+    totals = {
+        "realized": float(realized["gain"].sum()),
+        "short_term": float(by_term.get("short", 0.0)),
+        "long_term": float(by_term.get("long", 0.0)),
+        "unrealized": float(open_lots["unrealized"].sum()),
+        "unrealized_short": float(unreal_by_term.get("short", 0.0)),
+        "unrealized_long": float(unreal_by_term.get("long", 0.0)),
+        "cost_basis": float(open_lots["cost"].sum()),
+        "unmatched": float(state["unmatched"]),
+    }
+    return {"realized": realized, "open_lots": open_lots, "positions": positions, "totals": totals}
+
+
+def get_tax_lots(book_key, transactions, method="fifo", lot_picks=None):
+    """Session-cached build_tax_lots; extends the previous state when only new trades arrived."""
+    if not transactions:
+        return None
+    cache = st.session_state.setdefault("_lot_cache", {})
+    key = (book_key, method)
+    try:
+        state = build_tax_lots(transactions, method, prev=cache.pop(key, None), lot_picks=lot_picks)
+    except Exception as e:
+        print(f"[LOTS] {book_key}/{method}: {e}")
+        return None
+    if state is not None:
+        cache[key] = state
+    return state
+
+
+def _render_lot_picker(transactions, picks, key):
+    """Choose which lots a past sale closed; `picks` ({trade index: [lot ids]}) is edited in place."""
+    n = len(transactions)
+    oldest_first = list(reversed(transactions))
+    sells = [k for k, t in enumerate(oldest_first) if str(t.get("type", "")).upper() == "SELL"]
+    if not sells:
+        return
+    with st.expander("🎯 Pick lots for a sale"):
+        k = st.selectbox(
+            "Sale", sells[::-1], key=f"{key}_pick_sale",
+            format_func=lambda k: (f"{str(oldest_first[k]['date'])[:10]} · SELL "
+                                   f"{float(oldest_first[k]['shares']):g} {oldest_first[k]['ticker']}"))
+        ticker = str(oldest_first[k]["ticker"]).upper()
+        buys = [j for j in range(k) if str(oldest_first[j].get("type", "")).upper() == "BUY"
+                and str(oldest_first[j]["ticker"]).upper() == ticker]
+        chosen = st.multiselect(
+            "Close these lots first (the rest of the sale comes FIFO)", buys,
+            default=[j for j in picks.get(k, []) if j in buys], key=f"{key}_pick_lots_{k}",
+            format_func=lambda j: (f"Lot {j} · {str(oldest_first[j]['date'])[:10]} · "
+                                   f"{float(oldest_first[j]['shares']):g} @ ${float(oldest_first[j]['price']):,.2f}"))
+        if chosen:
+            picks[k] = chosen
+        else:
+            picks.pop(k, None)
+        st.caption(f"Lot ids are the buy's position in the {n}-trade ledger, oldest first")
+
+
+def render_tax_lot_panel(transactions, book_key, key="lots"):
+    """Method picker, realized/unrealized KPIs with short/long-term split, open and closed lots."""
+    method = st.selectbox("Lot method", list(TAX_LOT_METHODS), format_func=TAX_LOT_METHODS.get,
+                          key=f"{key}_method")
+    picks = st.session_state.setdefault(f"{key}_picks", {})
+    if method == "specific" and transactions:
+        _render_lot_picker(transactions, picks, key)
+    state = get_tax_lots(book_key, transactions, method, lot_picks=picks if method == "specific" else None)
+    if not state:
+        st.caption("🧾 Tax lots appear after your first trade")
+        return
+    held = tuple(t for t, b in state["books"].items() if b["open_qty"] > 0)
+    quotes = get_quotes_batch(held) if held else {}
+    report = tax_lot_report(state, {t: q.get("price") for t, q in quotes.items()})
+    tot = report["totals"]
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Realized P/L", f"${tot['realized']:+,.2f}")
+    c2.metric("Short-Term", f"${tot['short_term']:+,.2f}", help=f"Lots held {LONG_TERM_DAYS} days or less")
+    c3.metric("Long-Term", f"${tot['long_term']:+,.2f}", help=f"Lots held more than {LONG_TERM_DAYS} days")
+    st.caption(f"Unrealized ${tot['unrealized']:+,.2f} "
+               f"(short-term ${tot['unrealized_short']:+,.2f} · long-term ${tot['unrealized_long']:+,.2f}) "
+               f"on ${tot['cost_basis']:,.2f} cost basis")
+
+    lots = report["open_lots"]
+    if not lots.empty:
+        st.markdown("**Open lots**")
+        st.dataframe(pd.DataFrame({
+            "Lot": lots["lot"], "Symbol": lots["ticker"], "Opened": lots["opened"].astype(str),
+            "Shares": lots["qty"].round(4),
+            "Cost": lots["cost_px"].map("${:,.2f}".format), "Days": lots["days_held"],
+            "Term": lots["term"].str.title(),
+            "Unrealized": lots["unrealized"].map(lambda v: f"${v:+,.2f}" if pd.notna(v) else "—"),
+        }), hide_index=True, use_container_width=True)
+    closed = report["realized"]
+    if not closed.empty:
+        st.markdown("**Closed lots** (most recent 50)")
+        recent = closed.iloc[::-1].head(50)
+        st.dataframe(pd.DataFrame({
+            "Lot": recent["lot"], "Symbol": recent["ticker"], "Opened": recent["opened"].astype(str),
+            "Closed": recent["closed"].astype(str), "Shares": recent["qty"].round(4),
+            "Gain": recent["gain"].map("${:+,.2f}".format), "Term": recent["term"].str.title(),
+        }), hide_index=True, use_container_width=True)
+    if tot["unmatched"] > 0:
+        st.caption(f"⚠️ {tot['unmatched']:g} shares were sold without a matching buy and were ignored")
+
+
+# ============= MATERIALIZED BALANCES (portfolio_balances / portfolio_positions) =============
+# The trades table stays the ledger (source of truth). Cash and positions are
+# materialized into one balance row + one row per held ticker, updated in the
+# same Postgres transaction as the trade insert by the apply_paper_trade()
+# function (SQL in README). Order validation then reads one row instead of
+# replaying the whole ledger. If the SQL hasn't been installed, every helper
+# here returns None and callers fall back to the ledger replay.
+
+def _balance_owner_key(user_id, portfolio_type):
+    """Owner key for the materialized tables: 'founder' or the user's id."""
+    if portfolio_type == 'founder':
+        return 'founder'
+    return str(user_id) if user_id else None
+
+
+def _is_missing_relation_error(e):
+    """True when a Supabase error means the table/function isn't installed."""
+    msg = str(e).lower()
+    return ("could not find" in msg or "does not exist" in msg
+            or "pgrst202" in msg or "pgrst205" in msg or "42p01" in msg or "42883" in msg)
+
+
+def load_materialized_book(user_id, portfolio_type='user', with_positions=True):
+    """
+    Read the materialized cash (and positions) for one book — O(1) in trade count.
+    Returns: {'cash', 'trade_count', 'positions'} or None if the tables
+    aren't installed or this book hasn't been materialized yet.
+    """
+    owner = _balance_owner_key(user_id, portfolio_type)
+    if not SUPABASE_ENABLED or not owner:
+        return None
+    try:
+        bal = (supabase.table("portfolio_balances").select("cash, trade_count")
+               .eq("owner_key", owner).eq("portfolio_type", portfolio_type)
+               .limit(1).execute())
+        if not bal.data:
+            return None
+        book = {
+            'cash': float(bal.data[0]['cash']),
+            'trade_count': int(bal.data[0].get('trade_count') or 0),
+            'positions': None,
+        }
+        if with_positions:
+            pos = (supabase.table("portfolio_positions").select("ticker, shares, avg_price")
+                   .eq("owner_key", owner).eq("portfolio_type", portfolio_type).execute())
+            book['positions'] = [
+                {'ticker': p['ticker'], 'shares': float(p['shares']), 'avg_price': float(p['avg_price'])}
+                for p in (pos.data or [])
+            ]
+        return book
+    except Exception:
+        return None
+
+
+def load_positions_from_db(user_id, portfolio_type='user', transactions=None):
+    """
+    Current positions for a book: materialized rows when available, otherwise
+    a replay of `transactions` (or the ledger, if not given).
+    """
+    book = load_materialized_book(user_id, portfolio_type)
+    if book is not None:
+        return book['positions']
+    if transactions is None:
+        transactions = load_trades_from_db(user_id, portfolio_type)
+    return rebuild_portfolio_from_trades(transactions)
+
+
+def db_has_trades(user_id, portfolio_type='user'):
+    """Whether the DB ledger has any trades for this book, without loading it."""
+    book = load_materialized_book(user_id, portfolio_type, with_positions=False)
+    if book is not None:
+        return book['trade_count'] > 0
+    if not SUPABASE_ENABLED:
+        return False
+    try:
+        query = supabase.table("trades").select("ticker").eq("portfolio_type", portfolio_type)
+        if portfolio_type != 'founder':
+            if not user_id:
+                return False
+            query = query.eq("user_id", user_id)
+        return bool(query.limit(1).execute().data)
+    except Exception:
+        return False
+
+
+def _rebuild_book_rpc(user_id, portfolio_type):
+    """Re-materialize one book from the ledger inside Postgres (one transaction).
+
+    Pre-split trades are restated into post-split units from the server's
+    corp_splits table.
+    """
+    params = {
+        "p_portfolio_type": portfolio_type,
+        "p_user_id": user_id if portfolio_type != 'founder' else None,
+    }
+    return supabase.rpc("rebuild_paper_book", params).execute().data
+
+
+def _apply_trade_rpc(user_id, portfolio_type, action, ticker, shares, price):
+    """
+    Validate + insert a trade + update balances atomically via apply_paper_trade().
+    Returns the function's JSON result ({'ok', 'reason', 'cash', ...}), or None
+    when the function isn't installed (caller falls back to the ledger path).
+    A book with no balance row yet is materialized from the ledger first.
+    `shares` is in post-split units; the DB restates positions written before
+    a split from its own corp_splits table.
+    """
+    params = {
+        "p_portfolio_type": portfolio_type,
+        "p_user_id": user_id,
+        "p_ticker": ticker,
+        "p_trade_type": action.upper(),
+        "p_quantity": float(shares),
+        "p_price": float(price),
+    }
+    try:
+        out = supabase.rpc("apply_paper_trade", params).execute().data
+        if isinstance(out, dict) and out.get("reason") == "NO_BALANCE_ROW":
+            _rebuild_book_rpc(user_id, portfolio_type)
+            out = supabase.rpc("apply_paper_trade", params).execute().data
+        return out if isinstance(out, dict) else None
+    except Exception as e:
+        if _is_missing_relation_error(e):
+            return None
+        # The function is installed but failed — don't fall back to a second
+        # insert path that could double-book the trade.
+        return {"ok": False, "reason": "DB_ERROR", "detail": str(e)}
+
+
+def _load_ledger_strict(user_id, portfolio_type):
+    """Like load_trades_from_db, but raises instead of returning [] on errors —
+    reconciliation must never mistake a failed read for an empty ledger."""
+    query = (supabase.table("trades").select("ticker, trade_type, quantity, price, total, timestamp")
+             .eq("portfolio_type", portfolio_type))
+    if portfolio_type != 'founder':
+        query = query.eq("user_id", user_id)
+    rows = query.order("timestamp", desc=True).execute().data or []
+    return [{
+        'date': r['timestamp'][:16].replace('T', ' '),
+        'type': r['trade_type'], 'ticker': r['ticker'], 'shares': float(r['quantity']),
+        'price': float(r['price']), 'total': float(r['total']),
+    } for r in rows]
+
+
+def reconcile_portfolio_balances(user_id, portfolio_type='user', fix=True, tol=1e-4):
+    """
+    Reconciliation job: re-derive cash + positions from the trades ledger in
+    Python and compare them with the materialized rows.
+    Returns: {'ok', 'diffs', 'fixed', 'derived_cash', 'stored_cash', 'trade_count'}
+    Positions are compared in post-split units, as the app shows them. With
+    fix=True, a mismatching (or missing) book is re-materialized by
+    rebuild_paper_book() so the repair happens in one DB transaction.
+    """
+    if not SUPABASE_ENABLED or not _balance_owner_key(user_id, portfolio_type):
+        return {'ok': True, 'diffs': [], 'fixed': False, 'derived_cash': None,
+                'stored_cash': None, 'trade_count': 0}
+
+    ledger = _load_ledger_strict(user_id, portfolio_type)
+    derived_cash = STARTING_CASH
+    for t in ledger:
+        if t['type'] == 'BUY':
+            derived_cash -= t['total']
+        elif t['type'] == 'SELL':
+            derived_cash += t['total']
+    adjusted = ledger
+    try:
+        adjusted = apply_corporate_actions(ledger)["transactions"]
+    except Exception as e:
+        print(f"[CORP_ACTIONS] Reconcile {portfolio_type}: {e}")
+    derived_pos = {p['ticker']: p for p in rebuild_portfolio_from_trades(adjusted)}
+
+    stored = load_materialized_book(user_id, portfolio_type)
+    diffs = []
+    if stored is None:
+        diffs.append("balance row missing")
+    else:
+        if abs(stored['cash'] - derived_cash) > tol:
+            diffs.append(f"cash: stored {stored['cash']:.2f} vs ledger {derived_cash:.2f}")
+        if stored['trade_count'] != len(ledger):
+            diffs.append(f"trade_count: stored {stored['trade_count']} vs ledger {len(ledger)}")
+        stored_pos = {p['ticker']: p for p in stored['positions']}
+        for tk in sorted(set(stored_pos) | set(derived_pos)):
+            s, d = stored_pos.get(tk), derived_pos.get(tk)
+            if s is None or d is None:
+                diffs.append(f"{tk}: {'missing from' if s is None else 'extra in'} positions table")
+            elif abs(s['shares'] - d['shares']) > tol or abs(s['avg_price'] - d['avg_price']) > tol:
+                diffs.append(f"{tk}: stored {s['shares']:.4f} @ {s['avg_price']:.2f} "
+                             f"vs ledger {d['shares']:.4f} @ {d['avg_price']:.2f}")
+
+    fixed = False
+    if diffs and fix:
+        try:
+            out = _rebuild_book_rpc(user_id, portfolio_type)
+            if isinstance(out, dict) and not out.get("ok"):
+                diffs.append(f"rebuild refused: {out.get('reason')}")
+            else:
+                fixed = True
+        except Exception as e:
+            diffs.append(f"rebuild failed: {e}")
+
+    return {
+        'ok': not diffs,
+        'diffs': diffs,
+        'fixed': fixed,
+        'derived_cash': derived_cash,
+        'stored_cash': stored['cash'] if stored else None,
+        'trade_count': len(ledger),
+    }
+
+# ============= NAV / EQUITY CURVE ENGINE =============
+# Replays a paper book's trades against the local price store to get a daily
+# NAV, cash, exposure and drawdown series. Everything is vectorized over a
+# dates × positions matrix: trade share deltas are scattered onto trading days
+# (searchsorted), cumsum'd into holdings and multiplied by the price panel.
+# Paper books have no external cash flows, so the time-weighted return is the
+# chain of daily NAV returns.
+NAV_BENCHMARK = "SPY"
+
+
+def _trades_frame(transactions):
+    """Display-format trades (newest first) → oldest-first DataFrame with signed deltas.
+
+    'DIV' rows (from apply_corporate_actions) move cash only.
+    """
+    tx = pd.DataFrame(transactions)
+    if tx.empty:
+        return tx
+    tx = tx.iloc[::-1].reset_index(drop=True)
+    tx["day"] = pd.to_datetime(tx["date"].astype(str).str[:10])
+    tx["ticker"] = tx["ticker"].astype(str).str.upper()
+    kind = tx["type"].astype(str).str.upper()
+    sign = np.where(kind == "BUY", 1.0, -1.0)
+    is_div = (kind == "DIV").values
+    tx["dshares"] = np.where(is_div, 0.0, sign * tx["shares"].astype(float))
+    tx["dcash"] = np.where(is_div, 1.0, -sign) * tx["total"].astype(float)
+    return tx
+
+
+def _replay_nav(tx, dates, tickers, prices, base_shares, base_cash, base_px=None):
+    """Holdings / cash / market value / marks over `dates` starting from a base state.
+
+    `tx` must only hold trades falling on or after dates[0]; `prices` is a
+    dates × tickers array (NaN where no bar). Missing prices fall back to the
+    last trade price, then to `base_px` (the marks carried from the base bar),
+    then to zero.
+    """
+    n_d, n_t = len(dates), len(tickers)
+    pos = np.clip(dates.searchsorted(tx["day"].values), 0, max(n_d - 1, 0))
+    col = pd.Index(tickers).get_indexer(tx["ticker"])
+
+    delta = np.zeros((n_d, n_t))
+    np.add.at(delta, (pos, col), tx["dshares"].values)
+    shares = base_shares[None, :] + delta.cumsum(axis=0)
+    shares[np.abs(shares) < 1e-9] = 0.0
+    cash = base_cash + np.bincount(pos, weights=tx["dcash"].values, minlength=n_d).cumsum()
+
+    trade_px = np.full((n_d, n_t), np.nan)
+    is_trade = tx["dshares"].values != 0                     # dividend rows carry no mark
+    trade_px[pos[is_trade], col[is_trade]] = tx["price"].astype(float).values[is_trade]  # last trade of the day wins
+    px = pd.DataFrame(prices).ffill().fillna(pd.DataFrame(trade_px).ffill())
+    if base_px is not None:
+        px = px.fillna(pd.Series(base_px))
+    px = px.fillna(0.0).values
+
+    market_value = (shares * px).sum(axis=1)
+    return shares, cash, market_value, px
+
+
+def compute_nav_series(transactions, starting_cash=STARTING_CASH, benchmark=NAV_BENCHMARK, prev=None):
+    """
+    Daily NAV series for a paper book.
+
+    Args:
+        transactions: trades in load_trades_from_db display format (newest first)
+        prev: a previous result for the same book. When its trades are a prefix
+              of `transactions`, only the tail (from its last bar on) is replayed,
+              so a new trade or a new daily bar costs O(new days).
+
+    Returns:
+        {'series': DataFrame indexed by date with nav, cash, market_value,
+                   exposure, drawdown, twr, bench_twr, excess,
+         'summary': {...}, 'state': {...}} or None when there are no trades.
+    """
+    tx = _trades_frame(transactions)
+    if tx.empty:
+        return None
+
+    tickers = sorted(tx["ticker"].unique())
+    first_day = tx["day"].min()
+    today = pd.Timestamp(datetime.now().date())
+    panel = get_price_panel(tuple(tickers + [benchmark]), first_day.strftime("%Y-%m-%d"))
+
+    dates = panel.index[panel.index >= first_day] if not panel.empty else pd.DatetimeIndex([])
+    if len(dates) == 0 or dates[-1] < tx["day"].max():
+        # No bars yet (or trades newer than the last bar): pad with business days
+        dates = dates.union(pd.bdate_range(first_day, max(today, tx["day"].max())))
+    panel = panel.reindex(dates)
+
+    signature = list(zip(tx["date"].astype(str), tx["ticker"], tx["dshares"]))
+    state = (prev or {}).get("state")
+    incremental = (
+        state is not None
+        and state["starting_cash"] == starting_cash
+        and state["benchmark"] == benchmark
+        and signature[:state["n_trades"]] == state["signature"]
+        and state["base_date"] is not None and state["base_date"] in dates
+    )
+
+    if incremental:
+        # Resume from the penultimate bar of the previous run: everything up to
+        # base_date is unchanged, the last bar may have been a partial day.
+        old = prev["series"]
+        base_date = state["base_date"]
+        tail_dates = dates[dates > base_date]
+        base_shares = np.array([state["shares"].get(t, 0.0) for t in tickers])
+        tail_tx = tx[tx["day"] > base_date]
+        base_px = np.array([state["px"].get(t, np.nan) for t in tickers])
+        shares, cash, mv, px = _replay_nav(tail_tx, tail_dates, tickers,
+                                           panel.loc[tail_dates, tickers].values,
+                                           base_shares, state["cash"], base_px)
+        head = old.loc[:base_date]
+        nav_prev, twr_prev, peak_prev = state["nav"], state["twr"], state["peak"]
+    else:
+        tail_dates = dates
+        shares, cash, mv, px = _replay_nav(tx, dates, tickers, panel[tickers].values,
+                                           np.zeros(len(tickers)), float(starting_cash))
+        head = None
+        nav_prev, twr_prev, peak_prev = float(starting_cash), 0.0, float(starting_cash)
+
+    nav = cash + mv
+    twr = (1.0 + twr_prev) * np.cumprod(nav / np.concatenate(([nav_prev], nav[:-1]))) - 1.0
+    peak = np.maximum.accumulate(np.concatenate(([peak_prev], nav)))[1:]
+
+    tail = pd.DataFrame({
+        "nav": nav,
+        "cash": cash,
+        "market_value": mv,
+        "exposure": np.divide(mv, nav, out=np.zeros_like(nav), where=nav != 0),
+        "drawdown": nav / peak - 1.0,
+        "twr": twr,
+    }, index=tail_dates)
+    series = tail if head is None else pd.concat([head[tail.columns], tail])
+
+    bench = panel[benchmark].ffill().bfill() if benchmark in panel.columns else None
+    if bench is not None and bench.notna().any():
+        series["bench_twr"] = (bench / bench.iloc[0] - 1.0).reindex(series.index).values
+    else:
+        series["bench_twr"] = np.nan
+    series["excess"] = series["twr"] - series["bench_twr"]
+
+    if len(series) >= 2:
+        base_date = series.index[-2]
+        base_row = series.iloc[-2]
+        base_shares = shares[-1] - _last_bar_delta(tx, tickers, base_date)
+        new_state = {
+            "base_date": base_date,
+            "shares": dict(zip(tickers, base_shares.tolist())),
+            "px": dict(zip(tickers, (px[-2] if len(tail) >= 2 else np.asarray(base_px)).tolist())),
+            "cash": float(base_row["cash"]),
+            "nav": float(base_row["nav"]),
+            "twr": float(base_row["twr"]),
+            "peak": float(series["nav"].iloc[:-1].max()),
+        }
+    else:
+        new_state = {"base_date": None, "shares": {}, "px": {}, "cash": float(starting_cash),
+                     "nav": float(starting_cash), "twr": 0.0, "peak": float(starting_cash)}
+    new_state.update(n_trades=len(signature), signature=signature,
+                     starting_cash=starting_cash, benchmark=benchmark)
+
+    daily = series["nav"].pct_change().dropna()
+    last = series.iloc[-1]
+    summary = {
+        "nav": float(last["nav"]),
+        "cash": float(last["cash"]),
+        "exposure": float(last["exposure"]),
+        "total_return": float(last["twr"]),
+        "bench_return": None if pd.isna(last["bench_twr"]) else float(last["bench_twr"]),
+        "excess_return": None if pd.isna(last["excess"]) else float(last["excess"]),
+        "max_drawdown": float(series["drawdown"].min()),
+        "current_drawdown": float(last["drawdown"]),
+        "ann_vol": float(daily.std() * np.sqrt(252)) if len(daily) > 1 else None,
+        "days": int(len(series)),
+        "start": series.index[0],
+        "incremental": bool(incremental),
+    }
+    return {"series": series, "summary": summary, "state": new_state}
+
+
+def _last_bar_delta(tx, tickers, base_date):
+    """Net share change per ticker from trades mapped onto the bar after `base_date`."""
+    on_day = tx[tx["day"] > base_date]
+    net = on_day.groupby("ticker")["dshares"].sum()
+    return np.array([net.get(t, 0.0) for t in tickers])
+
+
+def get_nav_series(book_key, transactions, starting_cash=STARTING_CASH):
+    """Session-cached compute_nav_series; reuses the previous run for incremental updates."""
+    if not transactions:
+        return None
+    cache = st.session_state.setdefault("_nav_cache", {})
+    try:
+        result = compute_nav_series(transactions, starting_cash, prev=cache.get(book_key))
+    except Exception as e:
+        print(f"[NAV] {book_key}: {e}")
+        return None
+    if result is not None:
+        cache[book_key] = result
+    return result
+
+
+def render_equity_curve(result, label="Portfolio", key=None):
+    """Equity curve (NAV vs benchmark scaled to the same start) + drawdown strip."""
+    s = result["series"]
+    start_nav = float(result["state"]["starting_cash"])
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.72, 0.28],
+                        vertical_spacing=0.04)
+    fig.add_trace(go.Scatter(x=s.index, y=s["nav"], name=label, line=dict(color="#00C853", width=2)),
+                  row=1, col=1)
+    if s["bench_twr"].notna().any():
+        fig.add_trace(go.Scatter(x=s.index, y=start_nav * (1 + s["bench_twr"]), name=NAV_BENCHMARK,
+                                 line=dict(color="#9E9E9E", width=1.5, dash="dot")), row=1, col=1)
+    fig.add_trace(go.Scatter(x=s.index, y=s["drawdown"] * 100, name="Drawdown", fill="tozeroy",
+                             line=dict(color="#FF5252", width=1), showlegend=False), row=2, col=1)
+    fig.update_yaxes(title_text="NAV ($)", row=1, col=1)
+    fig.update_yaxes(title_text="DD %", row=2, col=1)
+    fig.update_layout(height=420, margin=dict(l=10, r=10, t=30, b=10),
+                      legend=dict(orientation="h", y=1.08), hovermode="x unified")
+    st.plotly_chart(fig, use_container_width=True, key=key)
+
+    sm = result["summary"]
+    parts = [f"Return {sm['total_return']*100:+.2f}%"]
+    if sm["bench_return"] is not None:
+        parts.append(f"{NAV_BENCHMARK} {sm['bench_return']*100:+.2f}%")
+    parts += [f"Max drawdown {sm['max_drawdown']*100:.1f}%", f"Exposure {sm['exposure']*100:.0f}%"]
+    if sm["ann_vol"] is not None:
+        parts.append(f"Vol {sm['ann_vol']*100:.1f}% ann.")
+    st.caption(" · ".join(parts) + f" · {sm['days']} trading days, time-weighted")
+
+
+def render_overlap_panel(positions, key="overlap"):
+    """Correlation heatmap, overlap clusters and effective-bets KPIs for a list of positions."""
+    if not positions or len(positions) < 2:
+        st.caption("🧩 Overlap analysis needs at least two positions")
+        return
+    weights = compute_portfolio_concentration(positions)
+    ov = compute_correlation_analytics(weights) if len(weights) >= 2 else None
+    if not ov:
+        st.caption("🧩 Not enough shared price history to measure overlap yet")
+        return
+
+    top = ov["clusters"][0]
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Holdings", f"{len(ov['corr'])}",
+              help="Positions with at least a quarter of price history")
+    c2.metric("Independent Bets", f"{ov['effective_bets']:.1f}",
+              help="Effective number of uncorrelated positions, (Σ wσ / σ)². "
+                   "Three chip stocks that move together count as roughly one.")
+    c3.metric("Largest Cluster", f"{top['weight']*100:.0f}%",
+              delta=f"{top['risk_share']*100:.0f}% of risk", delta_color="off",
+              help=f"Names whose average correlation is ≥ {CORR_CLUSTER_THRESHOLD:.1f}")
+
+    rows = [{
+        "Cluster": " · ".join(c["tickers"]),
+        "Weight": f"{c['weight']*100:.1f}%",
+        "Risk Share": f"{c['risk_share']*100:.1f}%",
+        "Avg Corr": f"{c['avg_corr']:.2f}" if len(c["tickers"]) > 1 else "—",
+    } for c in ov["clusters"]]
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+    corr = ov["corr"]
+    fig = go.Figure(go.Heatmap(z=corr.values, x=corr.columns, y=corr.index, zmin=-1, zmax=1,
+                               colorscale="RdBu_r", text=np.round(corr.values, 2),
+                               texttemplate="%{text}" if len(corr) <= 15 else None))
+    fig.update_layout(height=min(120 + 28 * len(corr), 700), margin=dict(l=10, r=10, t=30, b=10),
+                      title=f"Correlation of daily returns ({ov['n_obs']} days)")
+    st.plotly_chart(fig, use_container_width=True, key=f"{key}_heatmap")
+
+    pairs = ov["pairs"].head(CORR_TOP_PAIRS)
+    lines = [f"**{r.a} / {r.b}** {r.corr_1y:.2f} "
+             f"(last {ov['window']}d: {r.corr_recent:.2f}, {r.change:+.2f})" for r in pairs.itertuples()]
+    st.caption("Most correlated pairs: " + " · ".join(lines))
+
+    avg = ov["rolling_avg"]
+    if len(avg) > 1:
+        fig = go.Figure(go.Scatter(x=avg.index, y=avg.values, name="Portfolio average",
+                                   line=dict(color="#00D9FF", width=3)))
+        for label, series in ov["rolling_pairs"].items():
+            fig.add_trace(go.Scatter(x=series.index, y=series.values, name=label,
+                                     line=dict(width=1), opacity=0.7))
+        fig.update_layout(height=320, yaxis=dict(range=[-1, 1], title="Correlation"),
+                          hovermode="x unified", legend=dict(orientation="h", y=-0.2),
+                          margin=dict(l=10, r=10, t=30, b=10),
+                          title=f"Rolling {ov['window']}-day correlation")
+        st.plotly_chart(fig, use_container_width=True, key=f"{key}_rolling")
+        trend = avg.iloc[-1] - avg.iloc[-min(len(avg), 22)]
+        st.caption(f"Average correlation now {avg.iloc[-1]:.2f} ({trend:+.2f} over the last month). "
+                   "Rising correlation means your holdings are starting to move as one.")
+    if ov["excluded"]:
+        st.caption(f"Not enough history: {', '.join(ov['excluded'])}")
+
+
 # ============= SUPABASE CONFIGURATION =============
 # Read from environment variables for security (set in Render dashboard)
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
@@ -13479,6 +16055,14 @@ def _log_persistence(op, success, detail=""):
     })
     st.session_state._persistence_log = log[-20:]
 
+
+def _log_page_timing(view, seconds):
+    """Internal: record how long a page/view body took this rerun (bounded to last 30)."""
+    log = st.session_state.get("_page_timings", [])
+    log.append({"ts": datetime.now().isoformat(timespec="seconds"), "view": view, "ms": seconds * 1000})
+    st.session_state._page_timings = log[-30:]
+    print(f"[PERF] {view}: {seconds * 1000:.0f} ms")
+
 def load_user_progress():
     """Load user progress from Supabase user_state table.
     Failures are logged to st.session_state._persistence_log for debugging."""
@@ -13725,83 +16309,174 @@ def build_user_profile():
     
     return user_profile
 
+# ============= VOLATILITY TIER TABLE (daily batch) =============
+# Realized-volatility tiers are the same for every user, so they live in one
+# process-wide dict backed by the local cache DB instead of per-session state.
+# A daily batch recomputes the whole universe from a single returns matrix
+# (one std over the price panel); tickers outside the universe are computed on
+# first request and written through, so the next session gets them from memory.
+VOL_TIER_THRESHOLDS = (0.018, 0.032)   # daily std: < low ≤ medium < high
+VOL_LOOKBACK_DAYS = 252
+VOL_MAX_AGE_HOURS = 30                 # older rows are recomputed on demand
+VOL_BATCH_HOUR_UTC = int(os.environ.get("VOL_BATCH_HOUR_UTC", "9"))
+
+_VOL_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS vol_tiers (
+    ticker      TEXT PRIMARY KEY,
+    std_daily   REAL,
+    n_obs       INTEGER,
+    tier        TEXT NOT NULL,
+    method      TEXT NOT NULL,
+    computed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS vol_batch_runs (
+    started_at REAL PRIMARY KEY,
+    elapsed_s  REAL,
+    n_tickers  INTEGER,
+    n_ok       INTEGER
+);
+"""
+_VOL_TIERS = {}            # TICKER → {'tier', 'method', 'std_daily', 'computed_at'}
+_VOL_TIERS_LOCK = threading.Lock()
+_VOL_TIERS_LOADED = False
+
+
+def _vol_tier_from_std(std_daily):
+    low, high = VOL_TIER_THRESHOLDS
+    return "low" if std_daily < low else "medium" if std_daily < high else "high"
+
+
+def _vol_table():
+    """The in-memory tier table, loaded from disk on first use in this process."""
+    global _VOL_TIERS_LOADED
+    if not _VOL_TIERS_LOADED:
+        with _VOL_TIERS_LOCK:
+            if not _VOL_TIERS_LOADED:
+                try:
+                    with _local_db(_VOL_TABLE_DDL) as conn:
+                        for r in conn.execute("SELECT * FROM vol_tiers"):
+                            _VOL_TIERS[r["ticker"]] = {k: r[k] for k in ("tier", "method", "std_daily", "computed_at")}
+                except Exception as e:
+                    print(f"[VOL] Could not load vol_tiers: {e}")
+                _VOL_TIERS_LOADED = True
+    return _VOL_TIERS
+
+
+def _store_vol_rows(rows):
+    """rows: {TICKER: {'tier', 'method', 'std_daily', 'n_obs', 'computed_at'}} → memory + disk."""
+    if not rows:
+        return
+    with _VOL_TIERS_LOCK:
+        for tk, row in rows.items():
+            _VOL_TIERS[tk] = {k: row.get(k) for k in ("tier", "method", "std_daily", "computed_at")}
+    try:
+        with _local_db(_VOL_TABLE_DDL) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO vol_tiers (ticker, std_daily, n_obs, tier, method, computed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(tk, r.get("std_daily"), r.get("n_obs"), r["tier"], r["method"], r["computed_at"])
+                 for tk, r in rows.items()],
+            )
+    except Exception as e:
+        print(f"[VOL] Could not persist vol_tiers: {e}")
+
+
+def compute_vol_tiers(tickers):
+    """Realized-vol tiers for `tickers` from one returns matrix. Returns {TICKER: row}."""
+    syms = tuple(dict.fromkeys(t.upper() for t in tickers if t))
+    if not syms:
+        return {}
+    start = (datetime.now() - timedelta(days=int(VOL_LOOKBACK_DAYS * 1.5) + 10)).strftime("%Y-%m-%d")
+    panel = get_price_panel(syms, start, field="adj_close")
+    if panel.empty:
+        return {}
+    rets = panel.tail(VOL_LOOKBACK_DAYS + 1).pct_change().iloc[1:]
+    std = rets.std(ddof=0)
+    n_obs = rets.notna().sum()
+    now = time.time()
+    return {
+        tk: {"tier": _vol_tier_from_std(float(std[tk])), "method": "realized_returns",
+             "std_daily": float(std[tk]), "n_obs": int(n_obs[tk]), "computed_at": now}
+        for tk in syms if tk in std.index and n_obs.get(tk, 0) >= 60 and pd.notna(std[tk])
+    }
+
+
+def run_vol_batch(tickers=None):
+    """Recompute the tier table for the universe (default: Dip Radar universe + cached names)."""
+    t0 = time.time()
+    universe = list(tickers) if tickers else list(dict.fromkeys(_dq_universe() + list(_vol_table())))
+    rows = compute_vol_tiers(universe)
+    _store_vol_rows(rows)
+    stats = {"started_at": t0, "elapsed_s": round(time.time() - t0, 2),
+             "n_tickers": len(universe), "n_ok": len(rows)}
+    try:
+        with _local_db(_VOL_TABLE_DDL) as conn:
+            conn.execute("INSERT OR REPLACE INTO vol_batch_runs VALUES (?, ?, ?, ?)", tuple(stats.values()))
+    except Exception as e:
+        print(f"[VOL_BATCH] Could not record run stats: {e}")
+    print(f"[VOL_BATCH] {len(rows)}/{len(universe)} tickers in {stats['elapsed_s']}s")
+    return stats
+
+
+def get_last_vol_run():
+    """Most recent vol_batch_runs row as a dict, or None."""
+    try:
+        with _local_db(_VOL_TABLE_DDL) as conn:
+            r = conn.execute("SELECT * FROM vol_batch_runs ORDER BY started_at DESC LIMIT 1").fetchone()
+        return dict(r) if r else None
+    except Exception:
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def _start_vol_scheduler():
+    """Start (once per process) the daily volatility-tier batch at VOL_BATCH_HOUR_UTC (-1 disables).
+
+    The last run comes from vol_batch_runs, not vol_tiers: on-demand lookups
+    write rows too and must not hold off the batch.
+    """
+    return _start_daily_job("VOL_BATCH", VOL_BATCH_HOUR_UTC, run_vol_batch,
+                            lambda: (get_last_vol_run() or {}).get("started_at"))
+
+
 def get_stock_volatility_tier(ticker):
     """
     Returns (volatility_tier, volatility_method)
     volatility_tier in {"low", "medium", "high", "unknown"}
     volatility_method in {"realized_returns", "market_cap_proxy", "unknown"}
     """
-    from datetime import datetime, timedelta
-    import numpy as np
-    
-    # Initialize vol_cache in session state if not exists
-    if 'vol_cache' not in st.session_state:
-        st.session_state.vol_cache = {}
+    tk = (ticker or "").upper()
+    if not tk:
+        return ("unknown", "unknown")
     
-    # Check cache (reuse if < 1 hour old)
-    if ticker in st.session_state.vol_cache:
-        cached = st.session_state.vol_cache[ticker]
-        cached_time = datetime.fromisoformat(cached['updated_at'])
-        if datetime.now() - cached_time < timedelta(hours=1):
-            return (cached['tier'], cached['method'])
+    # Shared table (any session, any process restart)
+    cached = _vol_table().get(tk)
+    if cached and time.time() - cached["computed_at"] < VOL_MAX_AGE_HOURS * 3600:
+        return (cached["tier"], cached["method"])
     
-    # Try realized returns method (preferred)
+    # Try realized returns method (preferred) — written through for everyone
     try:
-        # Get ~1 year of daily price data (252 trading days)
-        price_df = get_historical_adjusted_prices(ticker, years=1)
-        
-        if not price_df.empty and len(price_df) >= 60:
-            # Compute daily returns
-            prices = price_df['price'].values
-            returns = np.diff(prices) / prices[:-1]
-            
-            # Compute standard deviation of daily returns
-            std_dev = np.std(returns)
-            
-            # Map to tiers using fixed thresholds
-            if std_dev < 0.018:
-                tier = "low"
-            elif std_dev < 0.032:
-                tier = "medium"
-            else:
-                tier = "high"
-            
-            method = "realized_returns"
-            
-            # Cache result
-            st.session_state.vol_cache[ticker] = {
-                'tier': tier,
-                'method': method,
-                'updated_at': datetime.now().isoformat()
-            }
-            
-            return (tier, method)
+        rows = compute_vol_tiers([tk])
+        if tk in rows:
+            _store_vol_rows(rows)
+            return (rows[tk]["tier"], rows[tk]["method"])
     except Exception:
         pass
     
     # Fallback to market cap proxy
     try:
-        profile = get_profile(ticker)
-        if profile and 'mktCap' in profile:
-            market_cap = profile['mktCap']
-            
+        profile = get_profile(tk)
+        market_cap = (profile or {}).get('mktCap') or (profile or {}).get('marketCap')
+        if market_cap:
             if market_cap >= 200e9:
                 tier = "low"
             elif market_cap >= 10e9:
                 tier = "medium"
             else:
                 tier = "high"
-            
-            method = "market_cap_proxy"
-            
-            # Cache result
-            st.session_state.vol_cache[ticker] = {
-                'tier': tier,
-                'method': method,
-                'updated_at': datetime.now().isoformat()
-            }
-            
-            return (tier, method)
+            _store_vol_rows({tk: {"tier": tier, "method": "market_cap_proxy",
+                                  "std_daily": None, "n_obs": 0, "computed_at": time.time()}})
+            return (tier, "market_cap_proxy")
     except Exception:
         pass
     
@@ -13871,20 +16546,24 @@ def get_concentration_thresholds(risk_tier):
     }
     return thresholds.get(risk_tier, (0.40, None))
 
-def compute_portfolio_concentration(portfolio_positions):
+def compute_portfolio_concentration(portfolio_positions, measure="value"):
     """
     Compute weight of each position in portfolio
+    measure="value": share of market value
+    measure="risk":  share of portfolio volatility (component risk from the
+                     covariance model; names without price history get 0)
     Returns dict: {ticker: weight (0-1)}
     """
     if not portfolio_positions:
         return {}
     
-    # Calculate total portfolio value
+    # Calculate total portfolio value (one batched quote request)
+    quotes = get_quotes_batch(tuple(pos['ticker'] for pos in portfolio_positions))
     total_value = 0
     position_values = {}
     
     for pos in portfolio_positions:
-        quote = get_quote(pos['ticker'])
+        quote = quotes.get(pos['ticker'].upper())
         if quote:
             current_price = quote.get('price', 0)
             position_value = pos['shares'] * current_price
@@ -13899,6 +16578,12 @@ def compute_portfolio_concentration(portfolio_positions):
     for ticker, value in position_values.items():
         weights[ticker] = value / total_value
     
+    if measure == "risk":
+        risk = compute_portfolio_risk(weights)
+        if not risk:
+            return {}
+        return {t: risk["component_pct"].get(t.upper(), 0.0) for t in weights}
+    
     return weights
 
 def get_concentration_warning(ticker, weight, risk_tier):
@@ -13954,12 +16639,18 @@ def update_concentration_flags(portfolio_positions):
     weights = compute_portfolio_concentration(portfolio_positions)
     risk_tier = st.session_state.user_profile.get("risk_tier", "unknown")
     
+    try:
+        risk_shares = compute_portfolio_concentration(portfolio_positions, measure="risk") if len(weights) > 1 else {}
+    except Exception:
+        risk_shares = {}
+    
     concentration_flags = {}
     for ticker, weight in weights.items():
         severity, _ = get_concentration_warning(ticker, weight, risk_tier)
         concentration_flags[ticker] = {
             "weight": weight,
-            "severity": severity
+            "severity": severity,
+            "risk_share": risk_shares.get(ticker)
         }
     
     st.session_state.concentration_flags = concentration_flags
@@ -13974,7 +16665,8 @@ def render_fit_check_panel(ticker=None):
     
     st.markdown("### 🎯 Fit Check")
     
-    # Get volatility tier
+    # Get volatility tier (shared table; daily batch keeps it warm)
+    _start_vol_scheduler()
     vol_tier, vol_method = get_stock_volatility_tier(ticker)
     
     # Get fit outcome
@@ -13986,11 +16678,17 @@ def render_fit_check_panel(ticker=None):
     concentration_severity = "none"
     concentration_message = ""
     
+    risk_share = None
     if user_holds_stock:
         # Compute concentration
         weights = compute_portfolio_concentration(portfolio)
         weight = weights.get(ticker, 0)
         concentration_severity, concentration_message = get_concentration_warning(ticker, weight, risk_tier)
+        if len(weights) > 1:
+            try:
+                risk_share = compute_portfolio_concentration(portfolio, measure="risk").get(ticker)
+            except Exception:
+                risk_share = None
     
     # Display concentration warning first if high severity
     if concentration_severity == "high":
@@ -14031,6 +16729,10 @@ def render_fit_check_panel(ticker=None):
             st.error(f"🚨 **Does not fit your profile**")
             st.caption(message)
     
+    if risk_share is not None and abs(risk_share - weight) >= 0.05:
+        st.caption(f"📐 {ticker} is {weight*100:.0f}% of your portfolio's value but "
+                   f"{risk_share*100:.0f}% of its volatility (covariance model).")
+    
     # Only display technical details if not unknown
     if risk_tier != "unknown" and vol_tier != "unknown":
         st.caption(f"Risk tier: **{risk_tier}** | Volatility: **{vol_tier}** (method: {vol_method})")
@@ -14511,6 +17213,50 @@ if _debug_param == "1":
                 st.session_state._persistence_log = []
                 st.rerun()
 
+        if st.button("🧮 Reconcile Paper Balances", key="dbg_reconcile_balances"):
+            _books = [("user", _uid)] if _uid else []
+            if _is_founder_user():
+                _books.append(("founder", None))
+            for _ptype, _bid in _books:
+                try:
+                    _rec = reconcile_portfolio_balances(_bid, _ptype, fix=True)
+                    if _rec["ok"]:
+                        st.success(f"{_ptype}: balances match ledger ({_rec['trade_count']} trades)")
+                    else:
+                        st.warning(f"{_ptype}: {len(_rec['diffs'])} mismatch(es)"
+                                   f"{' — rebuilt from ledger' if _rec['fixed'] else ''}")
+                        for _d in _rec["diffs"]:
+                            st.caption(f"• {_d}")
+                except Exception as _e:
+                    st.error(f"{_ptype}: {type(_e).__name__}: {_e}")
+
+        _timings = st.session_state.get("_page_timings", [])
+        if _timings:
+            st.markdown("**Page render timings (rerun body only, newest last):**")
+            _tdf = pd.DataFrame(_timings)
+            st.dataframe(_tdf.groupby("view")["ms"].agg(["count", "median", "max"]).round(0),
+                         use_container_width=True)
+
+        _aic = get_ai_cache_stats()
+        if _aic["classes"]:
+            st.markdown(f"**AI response cache:** {_aic['entries']} entries · {_aic['size_mb']} MB")
+            st.dataframe(pd.DataFrame(_aic["classes"]), hide_index=True, use_container_width=True)
+
+        _pregen_last = get_last_ai_pregen_run()
+        if _pregen_last:
+            st.caption(f"**AI pre-generation:** last run {datetime.fromtimestamp(_pregen_last['started_at']):%Y-%m-%d %H:%M} · "
+                       f"{_pregen_last['n_generated']} generated · {_pregen_last['n_skipped']} skipped · "
+                       f"{_pregen_last['n_failed']} failed · {_pregen_last['elapsed_s']}s")
+        else:
+            st.caption(f"**AI pre-generation:** no run yet. Scheduled daily at {AI_PREGEN_HOUR_UTC:02d}:00 UTC.")
+
+        _llm_rows = [r for r in get_llm_provider_stats() if r["calls"]]
+        if _llm_rows:
+            st.markdown("**LLM providers (this process):**")
+            st.dataframe(pd.DataFrame([{k: v if not isinstance(v, dict) else ", ".join(f"{kk}:{vv}" for kk, vv in v.items() if vv)
+                                        for k, v in r.items()} for r in _llm_rows]),
+                         hide_index=True, use_container_width=True)
+
         st.markdown("**Recent persistence events (newest last):**")
         _log = st.session_state.get("_persistence_log", [])
         if not _log:
@@ -16840,6 +19586,154 @@ Be specific and technical. Use proper terminology."""
     return prompt
 
 
+# ============= AI ANALYSIS PRE-GENERATION (nightly batch) =============
+# Risk flags and AI price targets take 5-30 s of LLM time the first time
+# anyone opens a ticker, and the popular tickers are opened by many users
+# every day. A nightly job generates them for the Macro Nexus + Top-100
+# universe with a small worker pool and stores one row per (ticker, kind) in
+# the local cache DB. The public getters serve a fresh row straight from the
+# table and only go live for the long tail.
+AI_PREGEN_HOUR_UTC = int(os.environ.get("AI_PREGEN_HOUR_UTC", "7"))  # 3am ET, ahead of DQ/vol
+AI_PREGEN_MAX_AGE_HOURS = 36      # older rows are ignored and the getter goes live
+AI_PREGEN_WORKERS = 4             # LLM calls in flight; provider rate limits, not CPU, bound this
+AI_PREGEN_KINDS = ("risk", "price_target")   # the analyses Company Analysis renders
+
+_AI_PREGEN_DDL = """
+CREATE TABLE IF NOT EXISTS ai_pregen (
+    ticker       TEXT NOT NULL,
+    kind         TEXT NOT NULL,
+    generated_at REAL NOT NULL,
+    payload_json TEXT NOT NULL,
+    PRIMARY KEY (ticker, kind)
+);
+CREATE TABLE IF NOT EXISTS ai_pregen_runs (
+    started_at  REAL PRIMARY KEY,
+    elapsed_s   REAL,
+    workers     INTEGER,
+    n_tickers   INTEGER,
+    n_generated INTEGER,
+    n_skipped   INTEGER,
+    n_failed    INTEGER
+);
+"""
+
+
+def load_ai_pregen(ticker, kind, max_age_hours=AI_PREGEN_MAX_AGE_HOURS):
+    """Pre-generated payload for (ticker, kind) if younger than `max_age_hours`, else None."""
+    try:
+        with _local_db(_AI_PREGEN_DDL) as conn:
+            r = conn.execute(
+                "SELECT generated_at, payload_json FROM ai_pregen WHERE ticker = ? AND kind = ?",
+                ((ticker or "").upper(), kind),
+            ).fetchone()
+    except Exception:
+        return None
+    if not r or time.time() - r["generated_at"] > max_age_hours * 3600:
+        return None
+    try:
+        return json.loads(r["payload_json"])
+    except ValueError:
+        return None
+
+
+def _store_ai_pregen(ticker, kind, payload):
+    with _local_db(_AI_PREGEN_DDL) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO ai_pregen (ticker, kind, generated_at, payload_json) VALUES (?, ?, ?, ?)",
+            (ticker.upper(), kind, time.time(), json.dumps(payload)),
+        )
+
+
+def _pregen_one(ticker, kind):
+    """Generate one (ticker, kind) payload. Returns the payload, or None to skip."""
+    if kind == "risk":
+        name = (get_profile(ticker) or {}).get("companyName", ticker)
+        return _generate_ai_risk_analysis(ticker, name)
+    if kind == "price_target":
+        # The AI target is only shown when FMP has no consensus; don't spend a call otherwise
+        consensus = get_price_target_consensus(ticker) or {}
+        if (consensus.get("targetConsensus") or 0) > 0 or (consensus.get("targetMedian") or 0) > 0:
+            return None
+        name = (get_profile(ticker) or {}).get("companyName", ticker)
+        value = _generate_ai_price_target(ticker, name)
+        return {"value": value} if value else None
+    return None
+
+
+def run_ai_pregen_batch(tickers=None, kinds=AI_PREGEN_KINDS, max_workers=AI_PREGEN_WORKERS,
+                        min_age_hours=20):
+    """Pre-generate AI analyses for the universe (or `tickers`) and store them.
+
+    Jobs are (ticker, kind) pairs on a bounded pool. Rows younger than
+    `min_age_hours` are left alone, so a run interrupted by a restart resumes
+    where it stopped. Returns run stats, also appended to ai_pregen_runs.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    if not USE_AI_ANALYSIS or not PERPLEXITY_API_KEY:
+        print("[AI_PREGEN] Skipped: AI analysis disabled or no Perplexity key")
+        return None
+    tickers = [t.upper() for t in tickers] if tickers else _dq_universe()
+    started = time.time()
+    jobs = [(tk, kind) for tk in tickers for kind in kinds
+            if load_ai_pregen(tk, kind, max_age_hours=min_age_hours) is None]
+    generated, skipped, failed = 0, len(tickers) * len(kinds) - len(jobs), 0
+
+    def _job(tk, kind):
+        payload = _pregen_one(tk, kind)
+        if payload is not None:
+            _store_ai_pregen(tk, kind, payload)
+        return payload is not None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as exe:
+        futures = {exe.submit(_job, tk, kind): (tk, kind) for tk, kind in jobs}
+        for fut in as_completed(futures):
+            try:
+                if fut.result():
+                    generated += 1
+                else:
+                    skipped += 1
+            except Exception as e:
+                failed += 1
+                print(f"[AI_PREGEN] {futures[fut]} failed: {e}")
+
+    stats = {
+        "started_at":  started,
+        "elapsed_s":   round(time.time() - started, 2),
+        "workers":     max_workers,
+        "n_tickers":   len(tickers),
+        "n_generated": generated,
+        "n_skipped":   skipped,
+        "n_failed":    failed,
+    }
+    try:
+        with _local_db(_AI_PREGEN_DDL) as conn:
+            conn.execute("INSERT OR REPLACE INTO ai_pregen_runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         tuple(stats.values()))
+    except Exception as e:
+        print(f"[AI_PREGEN] Could not record run stats: {e}")
+    print(f"[AI_PREGEN] {generated} generated, {skipped} skipped, {failed} failed for "
+          f"{len(tickers)} tickers in {stats['elapsed_s']}s (workers={max_workers})")
+    return stats
+
+
+def get_last_ai_pregen_run():
+    """Most recent ai_pregen_runs row as a dict, or None."""
+    try:
+        with _local_db(_AI_PREGEN_DDL) as conn:
+            r = conn.execute("SELECT * FROM ai_pregen_runs ORDER BY started_at DESC LIMIT 1").fetchone()
+        return dict(r) if r else None
+    except Exception:
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def _start_ai_pregen_scheduler():
+    """Start (once per process) the nightly AI pre-generation at AI_PREGEN_HOUR_UTC (-1 disables)."""
+    return _start_daily_job("AI_PREGEN", AI_PREGEN_HOUR_UTC, run_ai_pregen_batch,
+                            lambda: (get_last_ai_pregen_run() or {}).get("started_at"))
+
+
 # ============= PAGE CONTENT =============
 
 # Inject mobile CSS for responsive design
@@ -17563,10 +20457,14 @@ def render_lesson_visual(lesson_id: str):
 # FEATURE: STRESS TEST PORTFOLIO (#3)
 # ============================================================
 
-# Historical crash scenarios with real market data
+# Historical crash scenarios with real market data.
+# start/end bound the replay window: holdings are marked from the last close
+# on or before `start`, the crash is measured through `end`, and recovery is
+# searched for after that.
 CRASH_SCENARIOS = {
     "2008 Financial Crisis": {
         "period": "Sep 2008 – Mar 2009",
+        "start": "2008-09-01", "end": "2009-03-09",
         "icon": "🏦",
         "sp500_drop": -56.8,
         "duration_months": 6,
@@ -17583,6 +20481,7 @@ CRASH_SCENARIOS = {
     },
     "COVID Crash 2020": {
         "period": "Feb – Mar 2020",
+        "start": "2020-02-19", "end": "2020-03-23",
         "icon": "🦠",
         "sp500_drop": -33.9,
         "duration_months": 1.5,
@@ -17599,6 +20498,7 @@ CRASH_SCENARIOS = {
     },
     "Dot-Com Bust 2000": {
         "period": "Mar 2000 – Oct 2002",
+        "start": "2000-03-24", "end": "2002-10-09",
         "icon": "💻",
         "sp500_drop": -49.1,
         "duration_months": 30,
@@ -17615,6 +20515,7 @@ CRASH_SCENARIOS = {
     },
     "2022 Rate Hike Crash": {
         "period": "Jan – Oct 2022",
+        "start": "2022-01-03", "end": "2022-10-12",
         "icon": "📈",
         "sp500_drop": -25.4,
         "duration_months": 9,
@@ -17631,6 +20532,7 @@ CRASH_SCENARIOS = {
     },
     "Flash Crash 2010": {
         "period": "May 6, 2010",
+        "start": "2010-05-05", "end": "2010-05-07",
         "icon": "⚡",
         "sp500_drop": -9.2,
         "duration_months": 0.03,
@@ -17716,18 +20618,144 @@ def estimate_crash_impact(ticker, sector, scenario, current_value, beta=1.0):
 
 @st.cache_data(ttl=3600)
 def get_ticker_beta(ticker):
-    """Fetch beta from FMP profile"""
+    """Beta from the FMP profile (shares get_profile's cache)."""
     try:
-        url = f"{BASE_URL}/profile?symbol={ticker}&apikey={FMP_API_KEY}"
-        response = requests.get(url, timeout=10)
-        data = response.json()
-        if data and len(data) > 0:
-            return float(data[0].get("beta") or 1.0)
+        profile = get_profile(ticker)
+        if profile:
+            return float(profile.get("beta") or 1.0)
     except Exception:
         pass
     return 1.0
 
 
+# ── Historical crash replay ──────────────────────────────────
+# Replays each holding's actual adjusted price path through a crash window
+# (from the local price store) instead of a static sector drop × beta.
+# Holdings that didn't trade yet at the window start are proxied by their
+# sector ETF, falling back to SPY.
+SECTOR_ETF_PROXIES = {
+    "Technology": ("XLK",), "Financials": ("XLF",), "Financial Services": ("XLF",),
+    "Energy": ("XLE",), "Health Care": ("XLV",), "Healthcare": ("XLV",),
+    "Consumer Staples": ("XLP",), "Consumer Defensive": ("XLP",),
+    "Consumer Discretionary": ("XLY",), "Consumer Cyclical": ("XLY",),
+    "Industrials": ("XLI",), "Materials": ("XLB",), "Basic Materials": ("XLB",),
+    "Utilities": ("XLU",), "Real Estate": ("XLRE", "IYR"),
+    "Communication Services": ("XLC", "IYZ"), "Telecom": ("IYZ",),
+    "ETF": ("SPY",),
+}
+CRASH_RECOVERY_SEARCH_YEARS = 8  # how far past the window we look for break-even
+_BETA_LOOKBACK_DAYS = 504         # ~2 years of daily returns
+
+
+def _betas_from_panel(panel, tickers, benchmark="SPY", lookback=_BETA_LOOKBACK_DAYS):
+    """OLS betas vs `benchmark` from the trailing daily returns in `panel` (one pass)."""
+    if panel.empty or benchmark not in panel.columns:
+        return {}
+    rets = panel[list(dict.fromkeys(list(tickers) + [benchmark]))].tail(lookback + 1).pct_change().iloc[1:]
+    mkt = rets[benchmark]
+    ok = mkt.notna()
+    rets, mkt = rets[ok], mkt[ok]
+    var = mkt.var()
+    if not var or len(mkt) < 60:
+        return {}
+    dev = rets.sub(rets.mean())
+    cov = dev.mul(mkt - mkt.mean(), axis=0).sum() / (rets.notna().sum() - 1)
+    counts = rets.notna().sum()
+    return {t: float(cov[t] / var) for t in tickers if t in cov and counts.get(t, 0) >= 60}
+
+
+@st.cache_data(ttl=900, show_spinner=False)
+def replay_crash_scenarios(positions, cash, scenarios=None, recovery_years=CRASH_RECOVERY_SEARCH_YEARS):
+    """
+    Replay the current portfolio (buy-and-hold, today's dollar weights) through
+    historical crash windows using actual daily adjusted closes.
+
+    Args:
+        positions: [{'ticker', 'current_value', 'sector'}, ...]
+        cash: uninvested cash (held flat through the replay)
+
+    Returns:
+        {'results': {scenario: {...}}, 'betas': {ticker: beta}}.
+        Each scenario result has the portfolio value path, path max drawdown,
+        trough, worst single-day loss, recovery date / days-to-recover (None if
+        not recovered within the search horizon) and per-position window stats.
+    """
+    scenarios = scenarios or list(CRASH_SCENARIOS)
+    tickers = [p["ticker"].upper() for p in positions]
+    values = np.array([float(p["current_value"]) for p in positions])
+    chains = [
+        [t] + [x for x in SECTOR_ETF_PROXIES.get(p.get("sector"), ()) if x != t] + (["SPY"] if t != "SPY" else [])
+        for t, p in zip(tickers, positions)
+    ]
+    universe = tuple(dict.fromkeys([x for c in chains for x in c] + ["SPY"]))
+    earliest = min(pd.Timestamp(CRASH_SCENARIOS[s]["start"]) for s in scenarios) - pd.Timedelta(days=10)
+
+    panel = get_price_panel(universe, earliest.strftime("%Y-%m-%d"), field="adj_close")
+    out = {"results": {}, "betas": _betas_from_panel(panel, tickers)}
+    if panel.empty:
+        return out
+
+    today = pd.Timestamp(datetime.now().date())
+    for name in scenarios:
+        sc = CRASH_SCENARIOS[name]
+        start, end = pd.Timestamp(sc["start"]), pd.Timestamp(sc["end"])
+        horizon = min(today, end + pd.DateOffset(years=recovery_years))
+        pre = panel.loc[:start].tail(1)
+        if pre.empty:
+            continue
+        base_date = pre.index[0]
+        span = panel.loc[base_date:horizon].ffill()
+        if len(span) < 2:
+            continue
+        base = span.iloc[0]
+
+        # First series in each chain that has a price at the base date
+        chosen = [next((x for x in chain if pd.notna(base.get(x))), None) for chain in chains]
+        if any(c is None for c in chosen):
+            continue
+        # dates × positions price relatives; one matrix product gives the portfolio path
+        rel = span[chosen].values / base[chosen].values
+        path = cash + rel @ values
+        dates = span.index
+        in_win = dates <= end
+        n_win = int(in_win.sum())
+
+        win_path = path[:n_win]
+        peak = np.maximum.accumulate(win_path)
+        dd = win_path / peak - 1.0
+        trough_i = int(np.argmin(dd))
+        day_ret = np.diff(win_path) / win_path[:-1] if n_win > 1 else np.array([0.0])
+        worst_i = int(np.argmin(day_ret))
+
+        # Break-even: first close after the trough back at the pre-crash peak
+        target = peak[trough_i]
+        after = np.nonzero(path[trough_i:] >= target)[0]
+        rec_i = trough_i + int(after[0]) if len(after) and dd[trough_i] < 0 else None
+
+        rel_win = rel[:n_win]
+        pos_dd = (rel_win / np.maximum.accumulate(rel_win, axis=0) - 1.0).min(axis=0)
+        pos_at_trough = rel_win[trough_i] - 1.0
+
+        out["results"][name] = {
+            "path": pd.Series(path, index=dates),
+            "window_end": dates[n_win - 1],
+            "start_value": float(path[0]),
+            "trough_value": float(win_path[trough_i]),
+            "trough_date": dates[trough_i],
+            "max_drawdown": float(dd[trough_i]),
+            "worst_day": float(day_ret[worst_i]),
+            "worst_day_date": dates[worst_i + 1] if n_win > 1 else dates[0],
+            "recovered_date": dates[rec_i] if rec_i is not None else None,
+            "days_to_recover": int((dates[rec_i] - dates[trough_i]).days) if rec_i is not None else None,
+            "positions": [
+                {"ticker": t, "source": c, "proxied": c != t,
+                 "pct_at_trough": float(r) * 100, "max_drawdown": float(d) * 100,
+                 "value_at_trough": float(v * (1 + r))}
+                for t, c, r, d, v in zip(tickers, chosen, pos_at_trough, pos_dd, values)
+            ],
+        }
+    return out
+
 def render_stress_test_page():
     """Full stress test portfolio page"""
     st.markdown("## 💥 Stress Test Your Portfolio")
@@ -17758,29 +20786,38 @@ def render_stress_test_page():
             st.rerun()
         return
 
-    # Build current portfolio values
-    with st.spinner("📊 Fetching current prices & beta values..."):
+    # Build current portfolio values: one batched quote request, then one
+    # replay pass over the price store (which also yields the betas)
+    with st.spinner("📊 Fetching current prices & replaying crash windows..."):
+        quotes = get_quotes_batch(tuple(pos["ticker"].upper() for pos in portfolio))
         positions = []
         total_invested = 0
         for pos in portfolio:
             ticker = pos["ticker"].upper()
             shares = pos["shares"]
             avg_price = pos["avg_price"]
-            quote = get_quote(ticker)
-            current_price = quote.get("price", avg_price) if quote else avg_price
+            quote = quotes.get(ticker)
+            current_price = (quote.get("price") or avg_price) if quote else avg_price
             current_value = shares * current_price
             cost_basis = shares * avg_price
-            beta = get_ticker_beta(ticker)
-            profile = get_profile(ticker)
+            profile = None if ticker in TICKER_SECTOR_MAP else get_profile(ticker)
             sector = get_ticker_sector(ticker, profile)
             positions.append({
                 "ticker": ticker, "shares": shares,
                 "avg_price": avg_price, "current_price": current_price,
                 "current_value": current_value, "cost_basis": cost_basis,
-                "beta": beta, "sector": sector,
+                "beta": 1.0, "sector": sector,
             })
             total_invested += current_value
 
+        try:
+            replay = replay_crash_scenarios(positions, cash)
+        except Exception as e:
+            print(f"[STRESS] Crash replay failed: {e}")
+            replay = {"results": {}, "betas": {}}
+        for pos in positions:
+            pos["beta"] = replay["betas"].get(pos["ticker"]) or get_ticker_beta(pos["ticker"])
+
     total_portfolio_value = total_invested + cash
 
     # ── Current Portfolio Summary ──────────────────────────────
@@ -17827,20 +20864,36 @@ def render_stress_test_page():
     st.markdown(f"### {scenario['icon']} {selected_scenario} — What Would Happen?")
     st.caption(scenario["description"])
 
-    # Calculate impacts
+    # Calculate impacts: replayed price paths when the store has the window,
+    # otherwise the static sector-drop × beta estimate
+    replayed = replay["results"].get(selected_scenario)
     scenario_positions = []
     total_crash_value = cash  # Cash is always safe
     total_crash_loss = 0
 
-    for pos in positions:
-        pct_drop, dollar_impact, new_value = estimate_crash_impact(
-            pos["ticker"], pos["sector"], selected_scenario,
-            pos["current_value"], pos["beta"]
-        )
-        scenario_positions.append({**pos, "pct_drop": pct_drop,
-                                    "dollar_impact": dollar_impact, "new_value": new_value})
-        total_crash_value += new_value
-        total_crash_loss += dollar_impact
+    if replayed:
+        by_ticker = {r["ticker"]: r for r in replayed["positions"]}
+        for pos in positions:
+            r = by_ticker[pos["ticker"]]
+            new_value = r["value_at_trough"]
+            dollar_impact = new_value - pos["current_value"]
+            scenario_positions.append({**pos, "pct_drop": r["pct_at_trough"],
+                                        "dollar_impact": dollar_impact, "new_value": new_value,
+                                        "path_dd": r["max_drawdown"],
+                                        "proxy": r["source"] if r["proxied"] else None})
+            total_crash_value += new_value
+            total_crash_loss += dollar_impact
+    else:
+        for pos in positions:
+            pct_drop, dollar_impact, new_value = estimate_crash_impact(
+                pos["ticker"], pos["sector"], selected_scenario,
+                pos["current_value"], pos["beta"]
+            )
+            scenario_positions.append({**pos, "pct_drop": pct_drop,
+                                        "dollar_impact": dollar_impact, "new_value": new_value,
+                                        "path_dd": None, "proxy": None})
+            total_crash_value += new_value
+            total_crash_loss += dollar_impact
 
     total_crash_pct = (total_crash_loss / total_portfolio_value * 100) if total_portfolio_value > 0 else 0
 
@@ -17855,12 +20908,43 @@ def render_stress_test_page():
         st.metric("Total Loss", f"${abs(total_crash_loss):,.0f}",
                   delta=f"{total_crash_pct:.1f}%", delta_color="inverse")
     with c4:
-        recovery = scenario["recovery_months"]
-        if recovery < 12:
-            rec_str = f"{recovery:.0f} months"
+        if replayed:
+            days = replayed["days_to_recover"]
+            if days is None:
+                rec_str = "Not yet" if replayed["max_drawdown"] < 0 else "No drawdown"
+            elif days < 365:
+                rec_str = f"{days / 30.4:.1f} months"
+            else:
+                rec_str = f"{days / 365.25:.1f} years"
+            st.metric("Your Time to Recover", rec_str,
+                      help="Trough to back at the pre-crash peak, replaying your holdings' actual prices")
         else:
-            rec_str = f"{recovery/12:.1f} years"
-        st.metric("Historical Recovery", rec_str)
+            recovery = scenario["recovery_months"]
+            if recovery < 12:
+                rec_str = f"{recovery:.0f} months"
+            else:
+                rec_str = f"{recovery/12:.1f} years"
+            st.metric("Historical Recovery", rec_str)
+
+    if replayed:
+        c5, c6, c7 = st.columns(3)
+        with c5:
+            st.metric("Path Max Drawdown", f"{replayed['max_drawdown']*100:.1f}%")
+        with c6:
+            st.metric("Worst Single Day", f"{replayed['worst_day']*100:.1f}%",
+                      help=f"Close-to-close on {replayed['worst_day_date']:%b %d, %Y}")
+        with c7:
+            st.metric("Trough", f"{replayed['trough_date']:%b %d, %Y}")
+
+        _path = replayed["path"]
+        _fig = go.Figure()
+        _fig.add_trace(go.Scatter(x=_path.index, y=_path.values, name="Your portfolio (replayed)",
+                                  line=dict(color=scenario["color"], width=2)))
+        _fig.add_vline(x=replayed["window_end"], line=dict(color="rgba(255,255,255,0.3)", dash="dot"))
+        _fig.add_hline(y=replayed["start_value"], line=dict(color="rgba(255,255,255,0.3)", dash="dash"))
+        _fig.update_layout(height=300, margin=dict(l=10, r=10, t=20, b=10), showlegend=False,
+                           yaxis_title="Value ($)")
+        st.plotly_chart(_fig, use_container_width=True, key="stress_replay_path")
 
     # ── Visual bar: before vs after ───────────────────────────
     st.markdown("<br>", unsafe_allow_html=True)
@@ -17887,7 +20971,11 @@ def render_stress_test_page():
     # ── Per-stock breakdown ───────────────────────────────────
     st.markdown("---")
     st.markdown("#### 📋 Position-by-Position Breakdown")
-    st.caption("Estimates based on historical sector performance + each stock's beta (volatility vs market).")
+    if replayed:
+        st.caption("Replayed from actual daily prices, valued at the portfolio's trough. "
+                   "Holdings that weren't trading yet use their sector ETF (or SPY) as a stand-in.")
+    else:
+        st.caption("Estimates based on historical sector performance + each stock's beta (volatility vs market).")
 
     # Sort by biggest loss
     scenario_positions.sort(key=lambda x: x["dollar_impact"])
@@ -17898,7 +20986,8 @@ def render_stress_test_page():
 
         c1, c2, c3, c4, c5 = st.columns([2, 2, 2, 2, 2])
         with c1:
-            st.markdown(f"**{pos['ticker']}**  \n<span style='font-size:11px;color:rgba(255,255,255,0.4);'>{pos['sector']}</span>", unsafe_allow_html=True)
+            _via = f" · via {pos['proxy']}" if pos.get("proxy") else ""
+            st.markdown(f"**{pos['ticker']}**  \n<span style='font-size:11px;color:rgba(255,255,255,0.4);'>{pos['sector']}{_via}</span>", unsafe_allow_html=True)
         with c2:
             st.markdown(f"<span style='font-size:13px;'>Value now: **${pos['current_value']:,.0f}**</span>", unsafe_allow_html=True)
         with c3:
@@ -18016,22 +21105,17 @@ For each headline return a JSON array with objects containing:
 
 Return ONLY the raw JSON array. No markdown, no code blocks, no explanation before or after. Just the [ ... ] array."""
 
-        response = requests.post(
-            "https://api.perplexity.ai/chat/completions",
-            headers={"Authorization": f"Bearer {perplexity_key}", "Content-Type": "application/json"},
-            json={
-                "model": "sonar",
-                "messages": [
-                    {"role": "system", "content": "You are a data API. Return ONLY valid JSON arrays with no markdown, no code blocks, no preamble, no explanation. Just raw JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": 1200, "temperature": 0.2
-            },
-            timeout=20
+        content = cached_chat_completion(
+            "perplexity",
+            [
+                {"role": "system", "content": "You are a data API. Return ONLY valid JSON arrays with no markdown, no code blocks, no preamble, no explanation. Just raw JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=1200, temperature=0.2, ttl_class="news", timeout=20
         )
 
-        if response.status_code == 200:
-            content = response.json()["choices"][0]["message"]["content"].strip()
+        if content:
+            content = content.strip()
             # Aggressive cleanup — strip markdown fences, leading text, etc.
             content = content.replace("```json", "").replace("```", "").strip()
             # Find the actual JSON array in the response
@@ -18186,13 +21270,24 @@ def render_news_price_explainer():
 def get_journal_db_key(user_id):
     return f"journal_{user_id}"
 
+JOURNAL_CACHE_TTL = 300  # seconds; writes below invalidate immediately
+
+
+def _invalidate_journal_cache():
+    st.session_state.pop("_journal_cache", None)
+
+
 def load_journal_entries(user_id=None):
     """Load journal entries from Supabase or session state"""
     if user_id and SUPABASE_ENABLED:
+        cached = st.session_state.get("_journal_cache")
+        if cached and cached[0] == user_id and time.time() - cached[1] < JOURNAL_CACHE_TTL:
+            return cached[2]
         try:
             result = supabase.table("investing_journal").select("*").eq(
                 "user_id", user_id).order("created_at", desc=True).execute()
             if result.data:
+                st.session_state["_journal_cache"] = (user_id, time.time(), result.data)
                 return result.data
         except Exception:
             pass
@@ -18219,6 +21314,7 @@ def save_journal_entry(entry, user_id=None):
                 "reviewed_at": entry.get("reviewed_at"),
             }
             supabase.table("investing_journal").insert(entry_data).execute()
+            _invalidate_journal_cache()
             return True
         except Exception:
             pass
@@ -18238,6 +21334,7 @@ def update_journal_grade(entry_id, grade, reasoning, user_id=None):
                 "grade_reasoning": reasoning,
                 "reviewed_at": datetime.now().isoformat()
             }).eq("id", entry_id).execute()
+            _invalidate_journal_cache()
             return True
         except Exception:
             pass
@@ -18281,15 +21378,10 @@ Return a JSON object ONLY with:
 {{"grade": "B+", "reasoning": "2-3 sentences explaining the grade in plain English for a beginner"}}"""
 
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {openai_key}", "Content-Type": "application/json"},
-            json={"model": "gpt-4o-mini", "messages": [{"role": "user", "content": prompt}],
-                  "max_tokens": 300, "temperature": 0.3},
-            timeout=15
-        )
-        if response.status_code == 200:
-            content = response.json()["choices"][0]["message"]["content"].strip()
+        content = cached_chat_completion("openai", [{"role": "user", "content": prompt}],
+                                         max_tokens=300, temperature=0.3, ttl_class="grading", timeout=15)
+        if content:
+            content = content.strip()
             content = content.replace("```json", "").replace("```", "").strip()
             result = json.loads(content)
             return result.get("grade"), result.get("reasoning")
@@ -24877,6 +27969,8 @@ elif selected_page == "📊 Company Analysis":
         fcf_per_share = calculate_fcf_per_share(ticker, cash_df, quote)
         
         # Get price target for estimate - try consensus API first, then summary, then AI fallback
+        # (AI analyses for popular tickers are pre-generated nightly; see run_ai_pregen_batch)
+        _start_ai_pregen_scheduler()
         price_target_consensus = get_price_target_consensus(ticker)
         price_target_data = get_price_target_summary(ticker)
         
@@ -28121,6 +31215,10 @@ fundamentals deteriorate. Use this alongside actual business analysis (revenue g
         
         if results and results.get("scenarios"):
             scenarios = results["scenarios"]
+            listed = results["start_dates"]["stock"]
+            if listed > results["start_dates"]["sp500"]:
+                st.caption(f"🆕 {ticker} only has prices from {listed:%b %d, %Y}, so its scenarios "
+                           "start then. The S&P 500 scenarios use the full window.")
             
             st.markdown("### 📊 Results Comparison")
             
@@ -28142,6 +31240,33 @@ fundamentals deteriorate. Use this alongside actual business analysis (revenue g
             if fig:
                 st.plotly_chart(fig, use_container_width=True)
             
+            if results.get("paths"):
+                path_fig = go.Figure()
+                path_colors = {"lump_stock": "#9D4EDD", "lump_sp500": "#FFD700",
+                               "dca_stock": "#00D9FF", "dca_sp500": "#00FF96"}
+                for key in scenario_keys:
+                    if key in results["paths"]:
+                        path = results["paths"][key]
+                        path_fig.add_trace(go.Scatter(x=path.index, y=path.values, name=scenarios[key]['name'],
+                                                      line=dict(color=path_colors[key], width=2)))
+                invested_path = results["invested_paths"].get("dca_stock")
+                if invested_path is not None:
+                    path_fig.add_trace(go.Scatter(x=invested_path.index, y=invested_path.values,
+                                                  name="Paycheck $ put in",
+                                                  line=dict(color="#888888", width=1, dash="dot")))
+                path_fig.update_layout(title="Value Over Time", yaxis_title="Value ($)", height=380,
+                                       hovermode="x unified", legend=dict(orientation="h", y=-0.2),
+                                       margin=dict(l=10, r=10, t=40, b=10))
+                st.plotly_chart(path_fig, use_container_width=True)
+            
+            with st.expander(f"🔮 What could the next {years} years look like?", expanded=False):
+                proj = project_contribution_plan(ticker, 100, "biweekly", years)
+                if proj:
+                    render_projection_fan(proj, f"Paycheck {ticker}: $100 every 2 weeks, next {years} years",
+                                          key=f"four_scen_fan_{ticker}_{years}")
+                else:
+                    st.caption("Not enough price history to simulate forward.")
+            
             st.markdown("---")
             
             with st.expander("💡 Understanding the Results", expanded=True):
@@ -28968,12 +32093,26 @@ elif selected_page == "👤 Naman's Portfolio":
     st.markdown("---")
     
     def calc_ytd_return(ticker):
-        """Calculate YTD return from Jan 1 of current year to now.
-        Tries FMP quote (ytdReturn) → FMP historical → yfinance in that order."""
+        """Calculate YTD total return from the last close of the prior year to now.
+        Tries the local price store (dividend-adjusted) → FMP quote (ytdReturn,
+        price only) → yfinance in that order."""
         from datetime import datetime
         year = datetime.now().year
 
-        # 1) Try FMP real-time quote — fastest, most reliable
+        # 1) Local price store, dividend-adjusted closes (splits and dividends included)
+        try:
+            panel = get_price_panel((ticker,), f"{year - 1}-12-15", field="adj_close")
+            closes = panel[ticker.upper()].dropna() if not panel.empty else pd.Series(dtype=float)
+            prior = closes[closes.index.year < year]
+            if not prior.empty and len(closes) > len(prior):
+                start_price = float(prior.iloc[-1])
+                end_price = float(closes.iloc[-1])
+                if start_price > 0:
+                    return round(((end_price - start_price) / start_price) * 100, 2)
+        except Exception:
+            pass
+
+        # 2) FMP real-time quote
         try:
             q = get_quote(ticker)
             if q:
@@ -28983,27 +32122,6 @@ elif selected_page == "👤 Naman's Portfolio":
         except Exception:
             pass
 
-        # 2) Try FMP historical — compute from Jan 1 close to latest close
-        try:
-            df = get_historical_price(ticker, 1)
-            if df is not None and not df.empty:
-                price_col = None
-                for c in ['close', 'price', 'adjClose', 'adjclose', 'Close']:
-                    if c in df.columns:
-                        price_col = c
-                        break
-                if price_col and 'date' in df.columns:
-                    df = df.copy()
-                    df['date'] = pd.to_datetime(df['date'], errors='coerce')
-                    ytd_df = df[df['date'].dt.year == year].sort_values('date')
-                    if len(ytd_df) >= 2:
-                        start_price = float(ytd_df.iloc[0][price_col])
-                        end_price = float(ytd_df.iloc[-1][price_col])
-                        if start_price > 0:
-                            return round(((end_price - start_price) / start_price) * 100, 2)
-        except Exception:
-            pass
-
         # 3) Fallback: yfinance
         try:
             import yfinance as yf
@@ -30120,9 +33238,8 @@ elif selected_page == "📡 Dip Radar":
     _dr_portfolio_tickers = []
     try:
         if st.session_state.get("is_logged_in") and st.session_state.get("user_id"):
-            _dr_trades = load_trades_from_db(st.session_state.user_id, "user")
-            if _dr_trades:
-                _dr_positions = rebuild_portfolio_from_trades(_dr_trades)
+            _dr_positions = load_positions_from_db(st.session_state.user_id, "user")
+            if _dr_positions:
                 _dr_portfolio_tickers = [p["ticker"] for p in _dr_positions if p.get("shares", 0) > 0]
     except Exception:
         _dr_portfolio_tickers = []
@@ -30242,6 +33359,30 @@ elif selected_page == "📡 Dip Radar":
             st.session_state.show_login_popup = True
             st.rerun()
 
+    # ── Nightly DQ table status + manual run / benchmark ──
+    with st.expander("🗄️ Precomputed DQ table", expanded=False):
+        _dq_last = get_last_dq_run()
+        if _dq_last:
+            st.caption(
+                f"Last batch {datetime.fromtimestamp(_dq_last['started_at']).strftime('%b %d %H:%M')} · "
+                f"{_dq_last['n_ok']}/{_dq_last['n_tickers']} tickers in {_dq_last['elapsed_s']:.0f}s · "
+                f"p50 {_dq_last['p50_s']:.1f}s · p95 {_dq_last['p95_s']:.1f}s per ticker · "
+                f"{_dq_last['workers']} workers"
+            )
+        else:
+            st.caption(f"No batch has run yet. Scheduled daily at {DQ_BATCH_HOUR_UTC:02d}:00 UTC.")
+        _dq_c1, _dq_c2 = st.columns(2)
+        with _dq_c1:
+            if st.button("▶️ Run batch now", key="dq_batch_run", use_container_width=True):
+                with st.spinner(f"Scoring {len(_dq_universe())} tickers…"):
+                    _dq_stats = run_dq_batch()
+                st.success(f"Stored {_dq_stats['n_ok']} rows in {_dq_stats['elapsed_s']:.0f}s "
+                           f"({_dq_stats['n_failed']} failed)")
+        with _dq_c2:
+            if st.button("⏱️ Benchmark (20 tickers)", key="dq_batch_bench", use_container_width=True):
+                with st.spinner("Benchmarking batch job…"):
+                    st.dataframe(benchmark_dq_batch(), use_container_width=True, hide_index=True)
+
     st.markdown("---")
     st.caption("*DQ Score powered by FMP API, yfinance, and Perplexity AI. Educational purposes only. Not financial advice.*")
 
@@ -31596,15 +34737,21 @@ elif selected_page == "💼 Paper Portfolio":
     st.header("💼 Paper Portfolio")
     st.caption("*Practice trading with fake money. Track your performance vs the market.*")
     
-    # ── TABS: Portfolio | Journal | Stress Test ──────────────────────────
-    _pp_tab1, _pp_tab2, _pp_tab3 = st.tabs(["📈 My Portfolio", "📓 Investing Journal", "💥 Stress Test"])
-    with _pp_tab2:
+    # ── VIEWS: Portfolio | Journal | Stress Test ─────────────────────────
+    # st.tabs executes every tab body on each rerun; a segmented radio only runs
+    # the active view, so the journal query and the stress replay stay idle
+    # until they're opened.
+    _pp_views = ["📈 My Portfolio", "📓 Investing Journal", "💥 Stress Test"]
+    _pp_view = st.radio("View", _pp_views, horizontal=True, key="pp_view", label_visibility="collapsed")
+    _pp_t0 = time.perf_counter()
+    
+    if _pp_view == "📓 Investing Journal":
         render_investing_journal()
     
-    with _pp_tab3:
+    elif _pp_view == "💥 Stress Test":
         render_stress_test_page()
     
-    with _pp_tab1:
+    else:
     
         # Unhinged comment for Paper Portfolio
         unhinged_paper = get_unhinged_comment("paper_portfolio")
@@ -31652,7 +34799,7 @@ elif selected_page == "💼 Paper Portfolio":
                 st.session_state.cash = cash
             
                 # Rebuild portfolio from transactions
-                st.session_state.portfolio = rebuild_portfolio_from_trades(db_transactions)
+                st.session_state.portfolio = load_positions_from_db(user_id, 'user', db_transactions)
     
         # Load founder trades (public, always load)
         if SUPABASE_ENABLED:
@@ -31665,7 +34812,16 @@ elif selected_page == "💼 Paper Portfolio":
                 st.session_state.founder_cash = founder_cash
             
                 # Rebuild founder portfolio
-                st.session_state.founder_portfolio = rebuild_portfolio_from_trades(founder_db_transactions)
+                st.session_state.founder_portfolio = load_positions_from_db(None, 'founder', founder_db_transactions)
+
+        # ============= CORPORATE ACTIONS =============
+        # Positions in post-split share units; paid dividends credited as cash
+        _ca_user = get_corporate_adjusted("user", st.session_state.transactions)
+        _ca_founder = get_corporate_adjusted("founder", st.session_state.founder_transactions)
+        if _ca_user["splits_applied"]:
+            st.session_state.portfolio = rebuild_portfolio_from_trades(_ca_user["transactions"])
+        if _ca_founder["splits_applied"]:
+            st.session_state.founder_portfolio = rebuild_portfolio_from_trades(_ca_founder["transactions"])
     
         # Trade UI state
         if 'show_order_modal' not in st.session_state:
@@ -31683,7 +34839,7 @@ elif selected_page == "💼 Paper Portfolio":
     
         # ============= HELPER FUNCTIONS =============
         def calculate_portfolio_equity(transactions, portfolio, realized_gains):
-            """Calculate portfolio equity from trade history"""
+            """Calculate portfolio equity from trade history (plus 'DIV' rows from corporate actions)"""
             # Calculate cash from starting position and all transactions
             cash = STARTING_CASH
         
@@ -31691,8 +34847,8 @@ elif selected_page == "💼 Paper Portfolio":
             for txn in transactions:
                 if txn['type'] == 'BUY':
                     cash -= txn['total']  # Subtract cost
-                elif txn['type'] == 'SELL':
-                    cash += txn['total']  # Add proceeds
+                elif txn['type'] in ('SELL', 'DIV'):
+                    cash += txn['total']  # Add proceeds / dividends
         
             # Calculate market value of current positions
             market_value = 0.0
@@ -31904,7 +35060,7 @@ elif selected_page == "💼 Paper Portfolio":
                                     st.session_state.founder_transactions = founder_db_transactions
                                     founder_cash, _ = calculate_cash_from_db(None, portfolio_type='founder')
                                     st.session_state.founder_cash = founder_cash
-                                    st.session_state.founder_portfolio = rebuild_portfolio_from_trades(founder_db_transactions)
+                                    st.session_state.founder_portfolio = load_positions_from_db(None, 'founder', founder_db_transactions)
                             else:
                                 # Reload user portfolio immediately
                                 user_id = st.session_state.get("user_id")
@@ -31914,7 +35070,7 @@ elif selected_page == "💼 Paper Portfolio":
                                         st.session_state.transactions = db_transactions
                                         cash, _ = calculate_cash_from_db(user_id, portfolio_type='user')
                                         st.session_state.cash = cash
-                                        st.session_state.portfolio = rebuild_portfolio_from_trades(db_transactions)
+                                        st.session_state.portfolio = load_positions_from_db(user_id, 'user', db_transactions)
                         
                             st.success(message)
                             st.rerun()  # Force full page refresh
@@ -31951,7 +35107,7 @@ elif selected_page == "💼 Paper Portfolio":
                 if SUPABASE_ENABLED:
                     db_cash, db_err = calculate_cash_from_db(None, portfolio_type='founder')
                     # Only trust DB if it reflects trades (not the STARTING_CASH fallback)
-                    has_db_trades = bool(load_trades_from_db(None, portfolio_type='founder'))
+                    has_db_trades = db_has_trades(None, portfolio_type='founder')
                     if not db_err and has_db_trades:
                         st.session_state.founder_cash = db_cash
                 cash = st.session_state.get('founder_cash', STARTING_CASH)
@@ -31960,7 +35116,7 @@ elif selected_page == "💼 Paper Portfolio":
                 user_id = st.session_state.get("user_id")
                 if SUPABASE_ENABLED and user_id:
                     db_cash, db_err = calculate_cash_from_db(user_id, portfolio_type='user')
-                    has_db_trades = bool(load_trades_from_db(user_id, portfolio_type='user'))
+                    has_db_trades = db_has_trades(user_id, portfolio_type='user')
                     if not db_err and has_db_trades:
                         st.session_state.cash = db_cash
                 cash = st.session_state.get('cash', STARTING_CASH)
@@ -32231,7 +35387,7 @@ elif selected_page == "💼 Paper Portfolio":
         
             # Calculate metrics using real equity calculation
             user_equity, user_ytd_return, user_cash, user_market_value = calculate_portfolio_equity(
-                st.session_state.transactions,
+                _ca_user["ledger"],
                 st.session_state.portfolio,
                 st.session_state.realized_gains
             )
@@ -32270,17 +35426,34 @@ elif selected_page == "💼 Paper Portfolio":
                          help="Uninvested cash sitting in your account")
             col_d.metric("💰 Portfolio Value", f"${user_equity:,.2f}",
                          help="Cash + current market value of all positions")
-            col_e.metric("🎯 Buying Power", f"${user_cash:,.2f}",
-                         help="Cash you can deploy into new trades right now")
-        
-            # Simple line chart placeholder
-            # TODO: Implement actual YTD chart with historical data
-            st.caption("📈 Chart: Performance tracking chart coming soon")
+            col_e.metric("🎯 Buying Power", f"${user_cash - _ca_user['dividend_cash']:,.2f}",
+                         help="Cash you can deploy into new trades right now (dividends are shown in value, "
+                              "not yet tradable)")
+            if _ca_user["dividend_cash"] or _ca_user["accrued"] or _ca_user["splits_applied"]:
+                _ca_parts = [f"💸 Dividends received ${_ca_user['dividend_cash']:,.2f}"]
+                if _ca_user["accrued"]:
+                    _ca_parts.append(f"${_ca_user['accrued']:,.2f} declared, not yet paid")
+                if _ca_user["splits_applied"]:
+                    _ca_parts.append(f"{_ca_user['splits_applied']} trade(s) restated for stock splits")
+                st.caption(" · ".join(_ca_parts))
+        
+            # Daily equity curve replayed from the trade ledger (NAV engine)
+            _user_nav = get_nav_series("user", _ca_user["ledger"])
+            if _user_nav:
+                render_equity_curve(_user_nav, "You", key="pp_nav_user")
+            else:
+                st.caption("📈 Your equity curve appears after your first trade")
     
         # User positions table
         st.markdown("---")
         st.markdown("### 📋 Your Positions")
         render_positions_table(st.session_state.portfolio, st.session_state.realized_gains, 'user')
+        if len(st.session_state.portfolio) >= 2:
+            with st.expander("🧩 Overlap & Correlation", expanded=False):
+                render_overlap_panel(st.session_state.portfolio, key="pp_overlap_user")
+        if st.session_state.transactions:
+            with st.expander("🧾 Tax Lots & Realized P/L", expanded=False):
+                render_tax_lot_panel(_ca_user["transactions"], "user", key="pp_lots_user")
     
         # Transaction history
         with st.expander("📜 Transaction History", expanded=False):
@@ -32307,7 +35480,7 @@ elif selected_page == "💼 Paper Portfolio":
             
                 # Calculate metrics using real equity calculation
                 founder_equity, founder_ytd_return, founder_cash, founder_market_value = calculate_portfolio_equity(
-                    st.session_state.founder_transactions,
+                    _ca_founder["ledger"],
                     st.session_state.founder_portfolio,
                     st.session_state.founder_realized_gains
                 )
@@ -32344,10 +35517,13 @@ elif selected_page == "💼 Paper Portfolio":
                              help="Uninvested cash sitting in your account")
                 col_d.metric("💰 Portfolio Value", f"${founder_equity:,.2f}",
                              help="Cash + current market value of all positions")
-                col_e.metric("🎯 Buying Power", f"${founder_cash:,.2f}",
-                             help="Cash you can deploy into new trades right now")
+                col_e.metric("🎯 Buying Power", f"${founder_cash - _ca_founder['dividend_cash']:,.2f}",
+                             help="Cash you can deploy into new trades right now (dividends are shown in value, "
+                                  "not yet tradable)")
             
-                st.caption("📈 Chart: Performance tracking chart coming soon")
+                _founder_nav = get_nav_series("founder", _ca_founder["ledger"])
+                if _founder_nav:
+                    render_equity_curve(_founder_nav, "Founder", key="pp_nav_founder")
         
             st.markdown("---")
             st.markdown("### 📋 Founder Positions")
@@ -32369,7 +35545,7 @@ elif selected_page == "💼 Paper Portfolio":
         
             # Calculate metrics using real equity calculation
             founder_equity, founder_ytd_return, founder_cash, founder_market_value = calculate_portfolio_equity(
-                st.session_state.founder_transactions,
+                _ca_founder["ledger"],
                 st.session_state.founder_portfolio,
                 st.session_state.founder_realized_gains
             )
@@ -32406,8 +35582,13 @@ elif selected_page == "💼 Paper Portfolio":
                          help="Uninvested cash")
             col_d.metric("💰 Portfolio Value", f"${founder_equity:,.2f}",
                          help="Cash + current market value of all positions")
-            col_e.metric("🎯 Buying Power", f"${founder_cash:,.2f}",
-                         help="Cash you can deploy into new trades right now")
+            col_e.metric("🎯 Buying Power", f"${founder_cash - _ca_founder['dividend_cash']:,.2f}",
+                         help="Cash you can deploy into new trades right now (dividends are shown in value, "
+                              "not yet tradable)")
+
+            _founder_nav = get_nav_series("founder", _ca_founder["ledger"])
+            if _founder_nav:
+                render_equity_curve(_founder_nav, "Founder", key="pp_nav_founder_ro")
         
             st.markdown("---")
             st.markdown("### 📋 Founder Positions")
@@ -32480,7 +35661,27 @@ elif selected_page == "💼 Paper Portfolio":
         **Leader:** {leader[0]} ({leader[1]:+.2f}%)
         """)
     
-        st.caption("📊 Overlay chart (User vs Founder vs SPY) coming soon")
+        # Overlay: time-weighted return of each book vs SPY over the same days
+        _overlay = [(name, get_nav_series(book, txns)) for name, book, txns in (
+            ("You", "user", _ca_user["ledger"]),
+            ("Founder", "founder", _ca_founder["ledger"]),
+        )]
+        _overlay = [(name, res) for name, res in _overlay if res]
+        if _overlay:
+            _fig = go.Figure()
+            for (name, res), color in zip(_overlay, ("#00C853", "#FFD600")):
+                _s = res["series"]
+                _fig.add_trace(go.Scatter(x=_s.index, y=_s["twr"] * 100, name=name,
+                                          line=dict(color=color, width=2)))
+            _longest = max((res["series"] for _, res in _overlay), key=len)
+            if _longest["bench_twr"].notna().any():
+                _fig.add_trace(go.Scatter(x=_longest.index, y=_longest["bench_twr"] * 100, name=NAV_BENCHMARK,
+                                          line=dict(color="#9E9E9E", width=1.5, dash="dot")))
+            _fig.update_layout(height=360, yaxis_title="Return (%)", hovermode="x unified",
+                               margin=dict(l=10, r=10, t=30, b=10), legend=dict(orientation="h", y=1.1))
+            st.plotly_chart(_fig, use_container_width=True, key="pp_nav_overlay")
+        else:
+            st.caption("📊 Overlay chart (User vs Founder vs SPY) appears once either book has trades")
     
         # Reset option
         st.divider()
@@ -32496,6 +35697,8 @@ elif selected_page == "💼 Paper Portfolio":
     
         # AI Coach integration
         #REMOVED: render_ai_coach("Paper Portfolio", ticker=None, facts=None)
+    
+    _log_page_timing(f"Paper Portfolio / {_pp_view}", time.perf_counter() - _pp_t0)
 
 elif selected_page == "✅ Portfolio Risk Analyzer":
     # 🔒 Founder-only — non-founders see sign-in CTA instead of the page
@@ -32528,60 +35731,43 @@ elif selected_page == "✅ Portfolio Risk Analyzer":
             st.error(f"Allocations must sum to 100% (currently {sum(p['allocation'] for p in portfolio)}%)")
         else:
             with st.spinner("Analyzing portfolio... preparing roasts... 🔥"):
+                bundles, missing_quotes = load_portfolio_bundles(portfolio)
                 portfolio_data = []
                 total_risk_score = 0
                 all_risk_factors = []
                 
-                for item in portfolio:
-                    quote = get_quote(item['ticker'])
-                    profile = get_profile(item['ticker'])
-                    ratios_ttm = get_ratios_ttm(item['ticker'])
-                    income_df = get_income_statement(item['ticker'], 'annual', 1)
-                    balance_df = get_balance_sheet(item['ticker'], 'annual', 1)
-                    cash_df = get_cash_flow(item['ticker'], 'annual', 1)
+                for bundle in bundles:
+                    risk_score, risk_factors = calculate_risk_score(bundle)
                     
-                    if quote:
-                        sector = profile.get('sector', 'Unknown') if profile else 'Unknown'
-                        
-                        pe = get_pe_ratio(item['ticker'], quote, ratios_ttm, income_df)
-                        ps = get_ps_ratio(item['ticker'], ratios_ttm)
-                        de_ratio = calculate_debt_to_equity(balance_df)
-                        quick_ratio = calculate_quick_ratio(balance_df)
-                        
-                        risk_score, risk_factors = calculate_risk_score(
-                            item['ticker'], quote, balance_df, cash_df, sector
-                        )
-                        
-                        weighted_risk = risk_score * (item['allocation'] / 100)
-                        total_risk_score += weighted_risk
-                        
-                        if risk_factors:
-                            all_risk_factors.append({
-                            "ticker": item['ticker'],
-                            "allocation": item['allocation'],
-                            "factors": risk_factors
-                            })
-                        
-                        industry_pe = get_industry_benchmark(sector, 'pe')
-                        industry_de = get_industry_benchmark(sector, 'debt_to_equity')
-                        industry_qr = get_industry_benchmark(sector, 'quick_ratio')
-                        
-                        portfolio_data.append({
-                            "ticker": item['ticker'],
-                            "name": quote.get('name', item['ticker']),
-                            "allocation": item['allocation'],
-                            "sector": sector,
-                            "beta": quote.get('beta', 1.0),
-                            "pe": pe,
-                            "ps": ps,
-                            "de_ratio": de_ratio,
-                            "quick_ratio": quick_ratio,
-                            "marketCap": quote.get('marketCap', 0),
-                            "risk_score": risk_score,
-                            "industry_pe": industry_pe,
-                            "industry_de": industry_de,
-                            "industry_qr": industry_qr
+                    weighted_risk = risk_score * (bundle.allocation / 100)
+                    total_risk_score += weighted_risk
+                    
+                    if risk_factors:
+                        all_risk_factors.append({
+                        "ticker": bundle.ticker,
+                        "allocation": bundle.allocation,
+                        "factors": risk_factors
                         })
+                    
+                    portfolio_data.append({
+                        "ticker": bundle.ticker,
+                        "name": bundle.name,
+                        "allocation": bundle.allocation,
+                        "sector": bundle.sector,
+                        "beta": bundle.beta,
+                        "pe": bundle.pe,
+                        "ps": bundle.ps,
+                        "de_ratio": bundle.de_ratio,
+                        "quick_ratio": bundle.quick_ratio,
+                        "marketCap": bundle.market_cap,
+                        "risk_score": risk_score,
+                        "industry_pe": get_industry_benchmark(bundle.sector, 'pe'),
+                        "industry_de": get_industry_benchmark(bundle.sector, 'debt_to_equity'),
+                        "industry_qr": get_industry_benchmark(bundle.sector, 'quick_ratio')
+                    })
+                
+                if missing_quotes:
+                    st.warning(f"⚠️ No quote for: {', '.join(missing_quotes)} — left out of the analysis")
                 
                 if portfolio_data:
                     df = pd.DataFrame(portfolio_data)
@@ -32595,7 +35781,13 @@ elif selected_page == "✅ Portfolio Risk Analyzer":
                     
                     st.markdown("### 📊 Portfolio Risk Profile")
                     
-                    roast = get_roast_comment(portfolio_data, total_risk_score)
+                    try:
+                        cov_risk = compute_portfolio_risk({b.ticker: b.allocation for b in bundles})
+                    except Exception as e:
+                        print(f"[RISK] Covariance model failed: {e}")
+                        cov_risk = None
+                    
+                    roast = get_roast_comment(bundles, total_risk_score, cov_risk)
                     st.markdown(f"""
                     <div class="roast-box">
                     {roast}
@@ -32637,6 +35829,35 @@ elif selected_page == "✅ Portfolio Risk Analyzer":
                     col5.metric("Weighted Mkt Cap", format_number(total_market_cap),
                                help=explain_metric("Market Cap", total_market_cap))
                     
+                    if cov_risk:
+                        st.markdown("### 📐 Correlation-Aware Risk")
+                        _conf = int(cov_risk['confidence'] * 100)
+                        r1, r2, r3, r4 = st.columns(4)
+                        r1.metric("Volatility (annual)", f"{cov_risk['vol_annual']*100:.1f}%",
+                                  help="How much the whole portfolio typically swings in a year, counting how your stocks move together")
+                        r2.metric(f"1-Day VaR ({_conf}%)", f"{cov_risk['var_hist']*100:.2f}%",
+                                  delta=f"normal model {cov_risk['var_param']*100:.2f}%", delta_color="off",
+                                  help=f"On {100-_conf} days out of 100, expect to lose at least this much (from the last {cov_risk['n_obs']} trading days)")
+                        r3.metric(f"1-Day CVaR ({_conf}%)", f"{cov_risk['cvar_hist']*100:.2f}%",
+                                  delta=f"normal model {cov_risk['cvar_param']*100:.2f}%", delta_color="off",
+                                  help="Average loss on those bad days")
+                        r4.metric("Diversification Ratio", f"{cov_risk['diversification_ratio']:.2f}",
+                                  help="Weighted stock volatility ÷ portfolio volatility. 1.0 = no diversification benefit; higher is better")
+                        
+                        _rc = pd.DataFrame({
+                            "Ticker": cov_risk['tickers'],
+                            "Weight": [f"{cov_risk['weights'][t]*100:.1f}%" for t in cov_risk['tickers']],
+                            "Share of Risk": [f"{cov_risk['component_pct'][t]*100:.1f}%" for t in cov_risk['tickers']],
+                            "Stock Volatility": [f"{cov_risk['asset_vol'][t]*100:.1f}%" for t in cov_risk['tickers']],
+                            "Marginal Risk": [f"{cov_risk['marginal'][t]*100:.1f}%" for t in cov_risk['tickers']],
+                        })
+                        st.dataframe(_rc, use_container_width=True, hide_index=True)
+                        _caption = (f"Ledoit-Wolf shrinkage covariance (shrinkage {cov_risk['shrinkage']:.2f}) over "
+                                    f"{cov_risk['n_obs']} aligned trading days.")
+                        if cov_risk['excluded']:
+                            _caption += f" Not enough price history: {', '.join(cov_risk['excluded'])}."
+                        st.caption(_caption)
+                    
                             
                     if all_risk_factors:
                         st.markdown("### 🚨 Individual Stock Risk Factors")
@@ -32799,8 +36020,12 @@ elif selected_page == "📜 Founder Track Record":
             st.session_state.founder_realized_gains
         )
     
-    def calculate_track_record_metrics(transactions, portfolio, realized_gains):
-        """Calculate all track record metrics"""
+    def calculate_track_record_metrics(transactions, portfolio, realized_gains, lot_unrealized=None):
+        """Calculate all track record metrics
+
+        Pass `lot_unrealized` from the same lot report as `realized_gains` so
+        both halves of total P/L use one cost method (else average cost).
+        """
         # Calculate portfolio equity using same logic as Paper Portfolio
         cash = STARTING_CASH
         
@@ -32808,8 +36033,8 @@ elif selected_page == "📜 Founder Track Record":
         for txn in transactions:
             if txn['type'] == 'BUY':
                 cash -= txn['total']  # Subtract cost
-            elif txn['type'] == 'SELL':
-                cash += txn['total']  # Add proceeds
+            elif txn['type'] in ('SELL', 'DIV'):
+                cash += txn['total']  # Add proceeds / dividends
         
         # Calculate market value of current positions
         market_value = 0.0
@@ -32843,6 +36068,9 @@ elif selected_page == "📜 Founder Track Record":
             ytd_return_pct = 0.0
             unrealized_pl = 0.0
         
+        if lot_unrealized is not None and transactions:
+            unrealized_pl = lot_unrealized
+        
         # Total P/L = realized + unrealized
         total_pl = realized_gains + unrealized_pl
         
@@ -32864,7 +36092,26 @@ elif selected_page == "📜 Founder Track Record":
     
     # ============= GET DATA =============
     portfolio, transactions, realized_gains = get_founder_data()
-    metrics = calculate_track_record_metrics(transactions, portfolio, realized_gains)
+    # Split-adjusted ledger + dividend cash rows
+    founder_ca = get_corporate_adjusted("founder", transactions)
+    if founder_ca["splits_applied"]:
+        portfolio = rebuild_portfolio_from_trades(founder_ca["transactions"])
+    # Realized and unrealized P/L both from the FIFO lot ledger, so the total
+    # doesn't mix FIFO realized with average-cost unrealized after partial sells
+    founder_lots = get_tax_lots("founder", founder_ca["transactions"])
+    founder_lot_totals = None
+    unpriced = []
+    if founder_lots:
+        held = tuple(t for t, bk in founder_lots["books"].items() if bk["open_qty"] > 0)
+        quotes = get_quotes_batch(held) if held else {}
+        lot_prices = {t: (quotes.get(t) or {}).get('price') for t in held}
+        unpriced = [t for t, px in lot_prices.items() if not px]
+        founder_lot_totals = tax_lot_report(founder_lots, lot_prices)["totals"]
+    unrealized_fifo = None
+    if founder_lot_totals:
+        realized_gains = founder_lot_totals["realized"]
+        unrealized_fifo = founder_lot_totals["unrealized"]
+    metrics = calculate_track_record_metrics(founder_ca["ledger"], portfolio, realized_gains, unrealized_fifo)
     
     # ============= SECTION A: HEADER SUMMARY (KPI CARDS) =============
     st.markdown("## 📊 Performance Summary")
@@ -32890,6 +36137,37 @@ elif selected_page == "📜 Founder Track Record":
         st.metric("Total P/L", f"${metrics['total_pl']:,.2f}")
     with col8:
         st.metric("Cash", f"${metrics['cash']:,.2f}")
+    if founder_lot_totals:
+        st.caption(f"Realized (FIFO lots): short-term ${founder_lot_totals['short_term']:+,.2f} · "
+                   f"long-term ${founder_lot_totals['long_term']:+,.2f} · "
+                   f"dividends ${founder_ca['dividend_cash']:,.2f}")
+    if unpriced:
+        st.caption(f"⚠️ Unrealized P/L is incomplete — no current price for {', '.join(sorted(unpriced))}")
+    
+    # Row 3: path-dependent stats from the daily NAV series
+    nav_result = get_nav_series("founder", founder_ca["ledger"])
+    if nav_result:
+        nav_summary = nav_result['summary']
+        col9, col10, col11, col12 = st.columns(4)
+        with col9:
+            st.metric("Time-Weighted Return", f"{nav_summary['total_return']*100:+.2f}%")
+        with col10:
+            _bench = nav_summary['bench_return']
+            st.metric(f"{NAV_BENCHMARK} (same period)", f"{_bench*100:+.2f}%" if _bench is not None else "—",
+                      delta=f"{nav_summary['excess_return']*100:+.2f}% vs {NAV_BENCHMARK}" if _bench is not None else None)
+        with col11:
+            st.metric("Max Drawdown", f"{nav_summary['max_drawdown']*100:.2f}%")
+        with col12:
+            st.metric("Exposure", f"{nav_summary['exposure']*100:.0f}%")
+    
+    st.markdown("---")
+    
+    # ============= SECTION A2: EQUITY CURVE =============
+    st.markdown("## 📈 Equity Curve")
+    if nav_result:
+        render_equity_curve(nav_result, "Founder", key="ftr_nav")
+    else:
+        st.info("The equity curve starts with the first trade.")
     
     st.markdown("---")
     
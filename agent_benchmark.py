@@ -0,0 +1,440 @@
+"""
+Stock Research Agent - Offline Benchmark
+========================================
+Measures StockResearchAgent without OpenAI or FMP keys (and without network access).
+
+Two local stand-ins are started on 127.0.0.1:
+    - Mock chat server: an OpenAI-compatible /v1/chat/completions endpoint that replays
+      the scripted tool-calling transcripts in SCRIPTS (streaming and non-streaming).
+    - FMP fixture server: serves recorded FMP responses from benchmarks/fmp_fixtures.json.
+
+Both add fixed, simulated latency so wall time reflects how well the agent overlaps
+LLM and tool work. For each query in the suite the benchmark reports LLM round trips,
+tool calls, wall time, prompt tokens, tool-cache hits and FMP requests.
+
+Usage:
+    python agent_benchmark.py                          # run the suite (research_stream)
+    python agent_benchmark.py --mode sync              # research() instead
+    python agent_benchmark.py --mode two-call          # research_stream_two_call()
+    python agent_benchmark.py --no-compact             # tool-result compaction off
+    python agent_benchmark.py --json results.json      # also write the rows as JSON
+
+    # CI: exit 1 when a query regresses against benchmarks/agent_baseline.json
+    python agent_benchmark.py --baseline
+
+    # Refresh the baseline after an intended change
+    python agent_benchmark.py --write-baseline
+
+    # Record fixtures from live FMP (needs FMP_API_KEY): keys missing from the file are
+    # fetched and saved, so delete benchmarks/fmp_fixtures.json first to re-record everything
+    python agent_benchmark.py --record
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import stock_research_agent as sra
+
+# ============================================================
+# CONFIG
+# ============================================================
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+FIXTURES_PATH = os.path.join(BENCH_DIR, "fmp_fixtures.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "agent_baseline.json")
+LIVE_FMP_URL = "https://financialmodelingprep.com/api/v3"
+
+# Simulated latency (seconds)
+LLM_FIRST_TOKEN_S = 0.15   # before the first chunk of every completion
+LLM_CHUNK_S = 0.01         # between streamed chunks
+FMP_LATENCY_S = 0.08       # per FMP request
+
+# Regression thresholds for --baseline
+DEFAULT_TOLERANCE = 0.3    # relative increase allowed for wall time and prompt tokens
+WALL_SLACK_S = 0.1         # absolute slack on wall time for noisy CI machines
+
+
+# ============================================================
+# SCRIPTS - What the mock model "decides" for each query
+# ============================================================
+# Each query in stock_research_agent.BENCHMARK_QUERIES maps to its turns: a list of
+# (tool_name, arguments) calls for a tool round, or a string for the final answer.
+
+_ANSWER = (
+    "**Quick summary:** Neutral-to-bullish. The business is growing and highly profitable, "
+    "but the valuation already prices in a lot of that growth.\n\n"
+    "**Key metrics:** The P/E is well above the market average, which means investors pay "
+    "a premium for expected earnings growth. Margins are strong and debt is manageable.\n\n"
+    "**Bull case:** Revenue keeps compounding and margins hold up.\n"
+    "**Bear case:** Growth slows while the multiple compresses.\n\n"
+    "**What to watch:** Next quarter's guidance and analyst target revisions.\n\n"
+    "*This is educational, not financial advice.*"
+)
+
+SCRIPTS = {
+    "Is NVDA overvalued?": [
+        [("get_stock_quote", {"ticker": "NVDA"}), ("get_financial_ratios", {"ticker": "NVDA"}),
+         ("get_analyst_estimates", {"ticker": "NVDA"})],
+        [("get_income_statement", {"ticker": "NVDA"}), ("get_stock_news", {"ticker": "NVDA"})],
+        _ANSWER,
+    ],
+    "Compare AAPL vs MSFT vs GOOGL": [
+        [("compare_stocks", {"tickers": ["AAPL", "MSFT", "GOOGL"]})],
+        [("get_company_profile", {"ticker": "AAPL"}), ("get_company_profile", {"ticker": "MSFT"}),
+         ("get_company_profile", {"ticker": "GOOGL"})],
+        _ANSWER,
+    ],
+    "Give me a bull and bear case for TSLA": [
+        [("get_stock_quote", {"ticker": "TSLA"}), ("get_financial_ratios", {"ticker": "TSLA"}),
+         ("get_company_profile", {"ticker": "TSLA"}), ("get_stock_news", {"ticker": "TSLA"}),
+         ("get_analyst_estimates", {"ticker": "TSLA"})],
+        [("get_income_statement", {"ticker": "TSLA", "period": "quarter"})],
+        _ANSWER,
+    ],
+    "What's happening with PLTR lately?": [
+        [("get_stock_news", {"ticker": "PLTR"}), ("get_stock_quote", {"ticker": "PLTR"})],
+        _ANSWER,
+    ],
+    "Should a beginner invest in AMD or INTC?": [
+        [("get_stock_quote", {"ticker": "AMD"}), ("get_stock_quote", {"ticker": "INTC"}),
+         ("get_financial_ratios", {"ticker": "AMD"}), ("get_financial_ratios", {"ticker": "INTC"})],
+        [("get_company_profile", {"ticker": "AMD"}), ("get_company_profile", {"ticker": "INTC"}),
+         ("get_analyst_estimates", {"ticker": "AMD"}), ("get_analyst_estimates", {"ticker": "INTC"})],
+        _ANSWER,
+    ],
+    "How does NVDA stack up against AMD?": [
+        [("compare_stocks", {"tickers": ["NVDA", "AMD"]}), ("get_stock_news", {"ticker": "NVDA"})],
+        _ANSWER,
+    ],
+}
+
+
+# ============================================================
+# MOCK CHAT SERVER - OpenAI-compatible, replays SCRIPTS
+# ============================================================
+
+def _script_turn(messages: list) -> int:
+    """
+    Next turn of the conversation. Scripted tool-call ids are call_<turn>_<n>; the latest
+    tool round is never folded away by the agent, so the highest turn seen + 1 is next.
+    """
+    last = -1
+    for m in messages:
+        for tc in m.get("tool_calls") or []:
+            try:
+                last = max(last, int(str(tc.get("id", "")).split("_")[1]))
+            except (IndexError, ValueError):
+                pass
+    return last + 1
+
+
+def _usage(messages: list, completion: str) -> dict:
+    prompt = len(json.dumps(messages)) // 4
+    done = max(1, len(completion) // 4)
+    return {"prompt_tokens": prompt, "completion_tokens": done, "total_tokens": prompt + done}
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = request.get("messages", [])
+        query = next((m.get("content") for m in messages if m.get("role") == "user"), "")
+        script = SCRIPTS.get(query)
+        if script is None:
+            self._send_json(404, {"error": {"message": f"No benchmark script for query: {query!r}"}})
+            return
+
+        turn = _script_turn(messages)
+        step = script[min(turn, len(script) - 1)]
+        with self.server.lock:
+            self.server.requests += 1
+
+        if isinstance(step, str):
+            pieces = [step[i:i + 24] for i in range(0, len(step), 24)]
+            tool_calls = []
+        else:
+            pieces = []
+            tool_calls = [{
+                "id": f"call_{turn}_{n}",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(args)},
+            } for n, (name, args) in enumerate(step)]
+        completion = "".join(pieces) + "".join(tc["function"]["arguments"] for tc in tool_calls)
+        usage = _usage(messages, completion)
+
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            self._stream(request.get("model", ""), pieces, tool_calls, usage if include_usage else None)
+        else:
+            time.sleep(LLM_FIRST_TOKEN_S + LLM_CHUNK_S * (len(pieces) + 2 * len(tool_calls)))
+            message = {"role": "assistant", "content": "".join(pieces) or None}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self._send_json(200, {
+                "id": f"chatcmpl-bench-{turn}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", ""),
+                "choices": [{"index": 0, "message": message,
+                             "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                "usage": usage,
+            })
+
+    def _stream(self, model: str, pieces: list, tool_calls: list, usage: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def emit(delta: dict = None, finish: str = None, usage_only: dict = None):
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk",
+                     "created": int(time.time()), "model": model}
+            if usage_only is not None:
+                chunk.update({"choices": [], "usage": usage_only})
+            else:
+                chunk["choices"] = [{"index": 0, "delta": delta or {}, "finish_reason": finish}]
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        time.sleep(LLM_FIRST_TOKEN_S)
+        emit({"role": "assistant", "content": ""})
+        for piece in pieces:
+            time.sleep(LLM_CHUNK_S)
+            emit({"content": piece})
+        for n, tc in enumerate(tool_calls):
+            args = tc["function"]["arguments"]
+            time.sleep(LLM_CHUNK_S)
+            emit({"tool_calls": [{"index": n, "id": tc["id"], "type": "function",
+                                  "function": {"name": tc["function"]["name"], "arguments": ""}}]})
+            half = len(args) // 2
+            for part in (args[:half], args[half:]):
+                time.sleep(LLM_CHUNK_S)
+                emit({"tool_calls": [{"index": n, "function": {"arguments": part}}]})
+        emit(finish="tool_calls" if tool_calls else "stop")
+        if usage is not None:
+            emit(usage_only=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+# ============================================================
+# FMP FIXTURE SERVER - Recorded responses, optional live recording
+# ============================================================
+
+def fixture_key(path: str, params: list) -> str:
+    """endpoint/TICKER[?sorted params], apikey excluded."""
+    params = sorted((k, v) for k, v in params if k != "apikey")
+    return path + ("?" + urlencode(params) if params else "")
+
+
+class FMPFixtureHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _lookup(self, path: str, params: list):
+        fixtures = self.server.fixtures
+        key = fixture_key(path, params)
+        if key in fixtures:
+            return fixtures[key]
+        if path in fixtures:
+            return fixtures[path]
+        # Batched quotes (quote/AAPL,MSFT) are assembled from per-ticker fixtures
+        endpoint, _, tickers = path.partition("/")
+        if "," in tickers:
+            rows = []
+            for ticker in tickers.split(","):
+                rows.extend(self._lookup(f"{endpoint}/{ticker}", params) or [])
+            return rows
+        if self.server.record:
+            return self._record(key, path, params)
+        with self.server.lock:
+            self.server.missing.add(key)
+        return []
+
+    def _record(self, key: str, path: str, params: list):
+        query = urlencode(sorted([(k, v) for k, v in params if k != "apikey"] + [("apikey", sra.FMP_API_KEY)]))
+        with urllib.request.urlopen(f"{LIVE_FMP_URL}/{path}?{query}", timeout=15) as resp:
+            data = json.loads(resp.read())
+        with self.server.lock:
+            self.server.fixtures[key] = data
+            self.server.recorded += 1
+        return data
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = parts.path.split("/api/v3/", 1)[-1].strip("/")
+        time.sleep(FMP_LATENCY_S)
+        with self.server.lock:
+            self.server.requests += 1
+        try:
+            data = self._lookup(path, parse_qsl(parts.query))
+        except Exception as e:
+            data = {"Error Message": str(e)}
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(handler, **attrs) -> ThreadingHTTPServer:
+    """Start a handler on a free localhost port in a daemon thread; server.url is its base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+
+def run_benchmark(mode: str = "stream", compact: bool = True, record: bool = False,
+                  queries: list = None) -> list:
+    """
+    Run the query suite against the local servers. The agent's tool cache is cleared once at
+    the start, so later queries see the hits a warm process would. Returns one row per query.
+    """
+    fixtures = load_fixtures()
+    chat = start_server(MockChatHandler)
+    fmp = start_server(FMPFixtureHandler, fixtures=fixtures, record=record,
+                       missing=set(), recorded=0)
+    saved_url = sra.FMP_BASE_URL
+    sra.FMP_BASE_URL = f"{fmp.url}/api/v3"
+    sra._FMP_CACHE.clear()
+    agent = sra.StockResearchAgent(compact=compact, base_url=f"{chat.url}/v1")
+
+    rows = []
+    try:
+        for query in queries or sra.BENCHMARK_QUERIES:
+            llm_before, fmp_before = chat.requests, fmp.requests
+            hits_before = sra.get_fmp_cache_stats()["hits"]
+            start = time.perf_counter()
+            if mode == "sync":
+                answer = agent.research(query) or ""
+            elif mode == "two-call":
+                answer = "".join(agent.research_stream_two_call(query))
+            else:
+                answer = "".join(agent.research_stream(query))
+            rows.append({
+                "query": query,
+                "rounds": chat.requests - llm_before,
+                "tool_calls": sum(r["tools"] for r in agent.round_log),
+                "wall_s": round(time.perf_counter() - start, 3),
+                "prompt_tokens": agent.prompt_tokens_sent,
+                "cache_hits": sra.get_fmp_cache_stats()["hits"] - hits_before,
+                "fmp_requests": fmp.requests - fmp_before,
+                "answered": _ANSWER[:40] in answer,
+            })
+    finally:
+        sra.FMP_BASE_URL = saved_url
+        chat.shutdown()
+        fmp.shutdown()
+
+    if record and fmp.recorded:
+        with open(FIXTURES_PATH, "w") as f:
+            json.dump(fmp.fixtures, f, indent=1, sort_keys=True)
+        print(f"Recorded {fmp.recorded} new FMP responses into {FIXTURES_PATH}")
+    if fmp.missing:
+        print(f"Warning: no fixtures for {sorted(fmp.missing)} (served as empty results)")
+    return rows
+
+
+def check_regressions(rows: list, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """Compare rows with a baseline written by --write-baseline; returns failure messages."""
+    failures = []
+    expected = baseline.get("queries", {})
+    for row in rows:
+        base = expected.get(row["query"])
+        if base is None:
+            continue
+        for key in ("rounds", "tool_calls"):
+            if row[key] > base[key]:
+                failures.append(f"{row['query']}: {key} {base[key]} -> {row[key]}")
+        if row["prompt_tokens"] > base["prompt_tokens"] * (1 + tolerance):
+            failures.append(f"{row['query']}: prompt_tokens {base['prompt_tokens']} -> {row['prompt_tokens']}")
+        if row["wall_s"] > base["wall_s"] * (1 + tolerance) + WALL_SLACK_S:
+            failures.append(f"{row['query']}: wall_s {base['wall_s']} -> {row['wall_s']}")
+        if not row["answered"]:
+            failures.append(f"{row['query']}: no final answer")
+    return failures
+
+
+def print_table(rows: list):
+    header = f"{'query':<42} {'rounds':>6} {'tools':>5} {'wall_s':>7} {'tokens':>7} {'hits':>5} {'fmp':>4}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['query'][:42]:<42} {r['rounds']:>6} {r['tool_calls']:>5} {r['wall_s']:>7.2f} "
+              f"{r['prompt_tokens']:>7} {r['cache_hits']:>5} {r['fmp_requests']:>4}")
+    print("-" * len(header))
+    print(f"{'TOTAL':<42} {sum(r['rounds'] for r in rows):>6} {sum(r['tool_calls'] for r in rows):>5} "
+          f"{sum(r['wall_s'] for r in rows):>7.2f} {sum(r['prompt_tokens'] for r in rows):>7} "
+          f"{sum(r['cache_hits'] for r in rows):>5} {sum(r['fmp_requests'] for r in rows):>4}")
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline StockResearchAgent benchmark")
+    parser.add_argument("--mode", choices=["stream", "two-call", "sync"], default="stream")
+    parser.add_argument("--no-compact", action="store_true", help="disable tool-result compaction")
+    parser.add_argument("--json", metavar="PATH", help="write result rows to PATH")
+    parser.add_argument("--baseline", metavar="PATH", nargs="?", const=BASELINE_PATH,
+                        help="fail (exit 1) on regression vs PATH (default: committed baseline)")
+    parser.add_argument("--write-baseline", metavar="PATH", nargs="?", const=BASELINE_PATH,
+                        help="save this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--record", action="store_true", help="fetch missing fixtures from live FMP")
+    args = parser.parse_args()
+
+    results = run_benchmark(mode=args.mode, compact=not args.no_compact, record=args.record)
+    print_table(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump({"mode": args.mode, "compact": not args.no_compact,
+                       "queries": {r["query"]: r for r in results}}, f, indent=2)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = check_regressions(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        sys.exit(1 if problems else 0)
@@ -21,9 +21,16 @@ Usage:
 """
 
 import os
+import sys
 import json
+import time
+import threading
 import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 from openai import OpenAI
 
 # ============================================================
@@ -31,11 +38,138 @@ from openai import OpenAI
 # ============================================================
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-openai-key-here")
 FMP_API_KEY = os.getenv("FMP_API_KEY", "your-fmp-key-here")
-FMP_BASE_URL = "https://financialmodelingprep.com/api/v3"
+FMP_BASE_URL = os.getenv("FMP_BASE_URL", "https://financialmodelingprep.com/api/v3")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # None = api.openai.com; set to point at a compatible server
 
 # OpenAI model - gpt-4o is best for function calling, gpt-3.5-turbo is cheaper
 MODEL = "gpt-4o"
 
+# Tool calls within one round run concurrently on this shared, bounded pool
+TOOL_MAX_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", "8"))
+_TOOL_POOL = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="agent-tool")
+
+# FMP responses are cached per process; TTL (seconds) depends on how fast the data moves
+FMP_CACHE_TTL = {
+    "quote": 60,
+    "ratios-ttm": 6 * 3600,
+    "income-statement": 24 * 3600,
+    "profile": 24 * 3600,
+    "stock_news": 15 * 60,
+    "analyst-estimates": 6 * 3600,
+    "price-target-consensus": 6 * 3600,
+}
+FMP_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_FMP_CACHE_ENTRIES", "2048"))
+
+# compare_stocks: ticker cap and the pool used for its per-ticker fan-out
+COMPARE_MAX_TICKERS = 12
+_FETCH_POOL = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="agent-fetch")
+
+
+# ============================================================
+# HTTP - One pooled session and a TTL cache behind every tool
+# ============================================================
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL."""
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, value, ttl: float):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+    
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+_FMP_CACHE = TTLCache(FMP_CACHE_MAX_ENTRIES)
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=TOOL_MAX_WORKERS * 2))
+
+
+def fmp_get(endpoint: str, ticker: str = "", **params):
+    """
+    GET an FMP endpoint through the shared session and cache.
+    The cache key uses the upper-cased ticker so "aapl" and "AAPL" share an entry.
+    Only non-empty list payloads are cached; errors and empty results are always refetched.
+    """
+    ticker = ticker.upper().strip()
+    key = (endpoint, ticker, tuple(sorted(params.items())))
+    cached = _FMP_CACHE.get(key)
+    if cached is not None:
+        return cached
+    
+    url = f"{FMP_BASE_URL}/{endpoint}/{ticker}" if ticker else f"{FMP_BASE_URL}/{endpoint}"
+    resp = _HTTP.get(url, params={**params, "apikey": FMP_API_KEY}, timeout=10)
+    data = resp.json()
+    if isinstance(data, list) and data:
+        _FMP_CACHE.put(key, data, FMP_CACHE_TTL.get(endpoint, 300))
+    return data
+
+
+def fmp_get_batch(endpoint: str, tickers: list) -> dict:
+    """
+    Fetch a comma-batched FMP endpoint (e.g. quote/AAPL,MSFT) in one request.
+    Tickers already in the cache are served locally; the rest are fetched together and
+    cached under the same per-ticker keys fmp_get uses. Returns {TICKER: row}.
+    """
+    ttl = FMP_CACHE_TTL.get(endpoint, 300)
+    rows, missing = {}, []
+    for ticker in tickers:
+        cached = _FMP_CACHE.get((endpoint, ticker, ()))
+        if cached is not None:
+            rows[ticker] = cached[0]
+        else:
+            missing.append(ticker)
+    
+    if missing:
+        resp = _HTTP.get(f"{FMP_BASE_URL}/{endpoint}/{','.join(missing)}",
+                         params={"apikey": FMP_API_KEY}, timeout=10)
+        data = resp.json()
+        for row in data if isinstance(data, list) else []:
+            symbol = str(row.get("symbol", "")).upper()
+            if symbol in missing:
+                rows[symbol] = row
+                _FMP_CACHE.put((endpoint, symbol, ()), [row], ttl)
+    return rows
+
+
+def get_fmp_cache_stats() -> dict:
+    """Hit/miss counters for the tool cache (per process)."""
+    return _FMP_CACHE.stats()
+
 
 # ============================================================
 # TOOLS - These are the functions the AI agent can call
@@ -44,9 +178,7 @@ MODEL = "gpt-4o"
 def get_stock_quote(ticker: str) -> dict:
     """Get current stock price, change, volume, market cap."""
     try:
-        url = f"{FMP_BASE_URL}/quote/{ticker.upper()}?apikey={FMP_API_KEY}"
-        resp = requests.get(url, timeout=10)
-        data = resp.json()
+        data = fmp_get("quote", ticker)
         if not data:
             return {"error": f"No data found for {ticker}"}
         q = data[0]
@@ -71,9 +203,7 @@ def get_stock_quote(ticker: str) -> dict:
 def get_financial_ratios(ticker: str) -> dict:
     """Get key financial ratios: P/E, P/B, ROE, debt/equity, margins."""
     try:
-        url = f"{FMP_BASE_URL}/ratios-ttm/{ticker.upper()}?apikey={FMP_API_KEY}"
-        resp = requests.get(url, timeout=10)
-        data = resp.json()
+        data = fmp_get("ratios-ttm", ticker)
         if not data:
             return {"error": f"No ratios found for {ticker}"}
         r = data[0]
@@ -97,9 +227,7 @@ def get_financial_ratios(ticker: str) -> dict:
 def get_income_statement(ticker: str, period: str = "annual", limit: int = 4) -> dict:
     """Get income statement data: revenue, earnings, growth trends."""
     try:
-        url = f"{FMP_BASE_URL}/income-statement/{ticker.upper()}?period={period}&limit={limit}&apikey={FMP_API_KEY}"
-        resp = requests.get(url, timeout=10)
-        data = resp.json()
+        data = fmp_get("income-statement", ticker, period=period, limit=limit)
         if not data:
             return {"error": f"No income data for {ticker}. Try using get_financial_ratios and get_company_profile instead for margin and growth data."}
         
@@ -134,9 +262,7 @@ def get_income_statement(ticker: str, period: str = "annual", limit: int = 4) ->
 def get_company_profile(ticker: str) -> dict:
     """Get company description, sector, industry, CEO, employees."""
     try:
-        url = f"{FMP_BASE_URL}/profile/{ticker.upper()}?apikey={FMP_API_KEY}"
-        resp = requests.get(url, timeout=10)
-        data = resp.json()
+        data = fmp_get("profile", ticker)
         if not data:
             return {"error": f"No profile found for {ticker}"}
         p = data[0]
@@ -160,9 +286,7 @@ def get_company_profile(ticker: str) -> dict:
 def get_stock_news(ticker: str, limit: int = 5) -> dict:
     """Get latest news articles about a stock."""
     try:
-        url = f"{FMP_BASE_URL}/stock_news?tickers={ticker.upper()}&limit={limit}&apikey={FMP_API_KEY}"
-        resp = requests.get(url, timeout=10)
-        data = resp.json()
+        data = fmp_get("stock_news", tickers=ticker.upper(), limit=limit)
         if not data:
             return {"error": f"No news found for {ticker}"}
         
@@ -183,14 +307,10 @@ def get_stock_news(ticker: str, limit: int = 5) -> dict:
 def get_analyst_estimates(ticker: str) -> dict:
     """Get analyst price targets and consensus estimates."""
     try:
-        url = f"{FMP_BASE_URL}/analyst-estimates/{ticker.upper()}?limit=1&apikey={FMP_API_KEY}"
-        resp = requests.get(url, timeout=10)
-        data = resp.json()
+        data = fmp_get("analyst-estimates", ticker, limit=1)
         
         # Also get price target consensus
-        url2 = f"{FMP_BASE_URL}/price-target-consensus/{ticker.upper()}?apikey={FMP_API_KEY}"
-        resp2 = requests.get(url2, timeout=10)
-        target_data = resp2.json()
+        target_data = fmp_get("price-target-consensus", ticker)
         
         result = {"ticker": ticker.upper()}
         
@@ -217,25 +337,51 @@ def get_analyst_estimates(ticker: str) -> dict:
         return {"error": str(e)}
 
 
+COMPARE_COLUMNS = ["ticker", "price", "market_cap", "pe_ratio", "ps_ratio", "roe", "net_margin", "debt_to_equity"]
+
+
 def compare_stocks(tickers: list) -> dict:
-    """Compare key metrics across multiple stocks (up to 5)."""
+    """
+    Compare key metrics across multiple stocks (up to COMPARE_MAX_TICKERS).
+    One batched quote request plus concurrent ratio fetches; the result is a
+    columnar table (column names once, one row per ticker) to keep tokens down.
+    """
     try:
-        comparisons = []
-        for ticker in tickers[:5]:
-            quote = get_stock_quote(ticker)
-            ratios = get_financial_ratios(ticker)
-            if "error" not in quote and "error" not in ratios:
-                comparisons.append({
-                    "ticker": ticker.upper(),
-                    "price": quote.get("price"),
-                    "market_cap": quote.get("market_cap"),
-                    "pe_ratio": ratios.get("pe_ratio_ttm"),
-                    "ps_ratio": ratios.get("ps_ratio_ttm"),
-                    "roe": ratios.get("roe_ttm"),
-                    "net_margin": ratios.get("net_margin"),
-                    "debt_to_equity": ratios.get("debt_to_equity"),
-                })
-        return {"comparison": comparisons}
+        symbols = []
+        for ticker in tickers:
+            symbol = str(ticker).upper().strip()
+            if symbol and symbol not in symbols:
+                symbols.append(symbol)
+        truncated = len(symbols) > COMPARE_MAX_TICKERS
+        symbols = symbols[:COMPARE_MAX_TICKERS]
+        
+        ratio_futures = {t: _FETCH_POOL.submit(get_financial_ratios, t) for t in symbols}
+        quotes = fmp_get_batch("quote", symbols)
+        
+        rows, missing = [], []
+        for ticker in symbols:
+            quote = quotes.get(ticker)
+            ratios = ratio_futures[ticker].result()
+            if quote is None or "error" in ratios:
+                missing.append(ticker)
+                continue
+            rows.append([
+                ticker,
+                quote.get("price"),
+                quote.get("marketCap"),
+                ratios.get("pe_ratio_ttm"),
+                ratios.get("ps_ratio_ttm"),
+                ratios.get("roe_ttm"),
+                ratios.get("net_margin"),
+                ratios.get("debt_to_equity"),
+            ])
+        
+        result = {"comparison": {"columns": COMPARE_COLUMNS, "rows": rows}}
+        if missing:
+            result["missing"] = missing
+        if truncated:
+            result["note"] = f"Only the first {COMPARE_MAX_TICKERS} tickers were compared"
+        return result
     except Exception as e:
         return {"error": str(e)}
 
@@ -336,14 +482,14 @@ TOOLS = [
         "type": "function",
         "function": {
             "name": "compare_stocks",
-            "description": "Compare key financial metrics across multiple stocks side by side. Use when asked to compare or choose between stocks.",
+            "description": "Compare key financial metrics across multiple stocks side by side. Returns a table: 'columns' names the fields, each entry in 'rows' is one ticker. Use when asked to compare or choose between stocks.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "tickers": {
                         "type": "array",
                         "items": {"type": "string"},
-                        "description": "List of ticker symbols to compare (max 5)"
+                        "description": "List of ticker symbols to compare (max 12)"
                     }
                 },
                 "required": ["tickers"]
@@ -364,6 +510,192 @@ TOOL_FUNCTIONS = {
 }
 
 
+def execute_tool_call(tool_call) -> tuple:
+    """Run one tool call. Returns (result, seconds); never raises."""
+    start = time.perf_counter()
+    func_name = tool_call.function.name
+    try:
+        func_args = json.loads(tool_call.function.arguments or "{}")
+        if func_name in TOOL_FUNCTIONS:
+            result = TOOL_FUNCTIONS[func_name](**func_args)
+        else:
+            result = {"error": f"Unknown function: {func_name}"}
+    except Exception as e:
+        result = {"error": f"{func_name} failed: {e}"}
+    return result, time.perf_counter() - start
+
+
+def execute_tool_calls(tool_calls) -> list:
+    """
+    Dispatch every tool call of a round on the shared pool.
+    Results come back in the original tool_calls order as (tool_call, result, seconds).
+    """
+    tool_calls = list(tool_calls)
+    if len(tool_calls) == 1:
+        return [(tool_calls[0], *execute_tool_call(tool_calls[0]))]
+    futures = [_TOOL_POOL.submit(execute_tool_call, tc) for tc in tool_calls]
+    return [(tc, *f.result()) for tc, f in zip(tool_calls, futures)]
+
+
+# ============================================================
+# COMPACTION - Keep tool payloads and history small in the prompt
+# ============================================================
+
+# Fields each tool result keeps in the prompt (what the system prompt's analysis uses)
+TOOL_RESULT_FIELDS = {
+    "get_stock_quote": ["ticker", "name", "price", "change_pct", "market_cap", "pe_ratio",
+                        "year_high", "year_low", "volume"],
+    "get_company_profile": ["ticker", "name", "sector", "industry", "description", "employees", "country"],
+    "get_stock_news": ["ticker", "articles"],
+}
+ARTICLE_FIELDS = ["title", "source", "date", "summary"]
+TEXT_LIMITS = {"description": 300, "summary": 120}
+
+# Once tool output from earlier rounds exceeds this many (estimated) tokens, fold it into a facts block
+TOOL_HISTORY_TOKEN_BUDGET = int(os.getenv("AGENT_TOOL_TOKEN_BUDGET", "1500"))
+FACTS_HEADER = "Data already gathered by earlier tool calls (compacted):"
+
+# Fixed query set used to compare prompt tokens with and without compaction
+BENCHMARK_QUERIES = [
+    "Is NVDA overvalued?",
+    "Compare AAPL vs MSFT vs GOOGL",
+    "Give me a bull and bear case for TSLA",
+    "What's happening with PLTR lately?",
+    "Should a beginner invest in AMD or INTC?",
+    "How does NVDA stack up against AMD?",
+]
+
+
+def _compact_value(value, key: str = ""):
+    """Round floats to ~4 significant figures, abbreviate large numbers, trim long text, drop empty fields."""
+    if isinstance(value, dict):
+        return {k: _compact_value(v, k) for k, v in value.items() if v not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [_compact_value(v) for v in value]
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        for div, suffix in ((1e12, "T"), (1e9, "B"), (1e6, "M")):
+            if abs(value) >= div:
+                return f"{value / div:.4g}{suffix}"
+        if isinstance(value, float):
+            # Significant figures, so small ratios (beta 0.004, yield 0.0031) aren't zeroed
+            return round(value, 2) if abs(value) >= 100 else float(f"{value:.4g}")
+        return value
+    if isinstance(value, str) and key in TEXT_LIMITS and len(value) > TEXT_LIMITS[key]:
+        return value[:TEXT_LIMITS[key]].rsplit(" ", 1)[0] + "..."
+    return value
+
+
+def compact_tool_result(func_name: str, result) -> dict:
+    """Trim a tool result to the fields the analysis uses and shrink its numbers/text."""
+    if not isinstance(result, dict) or "error" in result:
+        return result
+    fields = TOOL_RESULT_FIELDS.get(func_name)
+    if fields:
+        result = {k: result[k] for k in fields if k in result}
+    if func_name == "get_stock_news":
+        result["articles"] = [{k: a.get(k) for k in ARTICLE_FIELDS} for a in result.get("articles", [])]
+    return _compact_value(result)
+
+
+def dump_tool_result(result) -> str:
+    return json.dumps(result, separators=(",", ":"), ensure_ascii=False)
+
+
+def _field(obj, key: str):
+    """Messages and tool calls are either dicts or OpenAI SDK objects."""
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+def estimate_tokens(messages: list) -> int:
+    """Rough prompt size (~4 characters per token) of a message list."""
+    chars = 0
+    for m in messages:
+        chars += len(_field(m, "content") or "")
+        for tc in _field(m, "tool_calls") or []:
+            fn = _field(tc, "function")
+            chars += len(_field(fn, "name") or "") + len(_field(fn, "arguments") or "")
+    return chars // 4
+
+
+def _summarize_payload(value):
+    """Facts-block form of a tool payload: no long text, short lists."""
+    if isinstance(value, dict):
+        return {k: _summarize_payload(v) for k, v in value.items()
+                if k not in ("description", "summary", "url")}
+    if isinstance(value, list):
+        return [_summarize_payload(v) for v in value[:3]]
+    return value
+
+
+def fold_tool_history(messages: list, budget: int = TOOL_HISTORY_TOKEN_BUDGET) -> int:
+    """
+    Replace every tool round except the latest with one compact facts message once
+    their tool output exceeds `budget` tokens. Assistant tool-call messages are removed
+    together with their tool replies so no tool_call_id is left dangling.
+    Returns the number of rounds folded.
+    """
+    starts = [i for i, m in enumerate(messages)
+              if _field(m, "role") == "assistant" and _field(m, "tool_calls")]
+    if len(starts) < 2:
+        return 0
+    old = messages[starts[0]:starts[-1]]
+    if estimate_tokens([m for m in old if _field(m, "role") == "tool"]) <= budget:
+        return 0
+
+    calls, lines = {}, []
+    for m in old:
+        for tc in _field(m, "tool_calls") or []:
+            calls[_field(tc, "id")] = _field(tc, "function")
+        if _field(m, "role") != "tool":
+            continue
+        fn = calls.get(_field(m, "tool_call_id"))
+        try:
+            payload = dump_tool_result(_summarize_payload(json.loads(_field(m, "content"))))
+        except (TypeError, ValueError):
+            payload = str(_field(m, "content"))[:200]
+        lines.append(f"- {_field(fn, 'name') or 'tool'}({_field(fn, 'arguments') or ''}): {payload}")
+
+    facts_idx = next((i for i, m in enumerate(messages[:starts[0]])
+                      if (_field(m, "content") or "").startswith(FACTS_HEADER)), None)
+    del messages[starts[0]:starts[-1]]
+    if facts_idx is None:
+        messages.insert(starts[0], {"role": "system", "content": FACTS_HEADER + "\n" + "\n".join(lines)})
+    else:
+        messages[facts_idx]["content"] += "\n" + "\n".join(lines)
+    return len(starts) - 1
+
+
+class StreamedToolCall:
+    """A tool call assembled from streamed deltas; quacks like the SDK's tool_call object."""
+
+    def __init__(self):
+        self.id = ""
+        self.type = "function"
+        self.function = SimpleNamespace(name="", arguments="")
+        self.announced = False
+
+    def add_delta(self, delta):
+        if delta.id:
+            self.id = delta.id
+        fn = delta.function
+        if fn is not None:
+            if fn.name:
+                self.function.name += fn.name
+            if fn.arguments:
+                self.function.arguments += fn.arguments
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": "function",
+            "function": {"name": self.function.name, "arguments": self.function.arguments},
+        }
+
+
 # ============================================================
 # THE AGENT - This is the core loop
 # ============================================================
@@ -376,7 +708,7 @@ class StockResearchAgent:
     1. User asks a question (e.g., "Is NVDA overvalued?")
     2. Agent sends question to OpenAI with available tools
     3. OpenAI decides which tools to call (may call multiple!)
-    4. Agent executes those tool calls (FMP API requests)
+    4. Agent executes those tool calls concurrently (FMP API requests)
     5. Agent sends results back to OpenAI
     6. OpenAI synthesizes everything into a research response
     7. If OpenAI needs more data, it calls more tools (loop continues)
@@ -384,10 +716,14 @@ class StockResearchAgent:
     The agent can handle up to 10 rounds of tool calls per query.
     """
     
-    def __init__(self, model: str = MODEL, verbose: bool = False):
+    def __init__(self, model: str = MODEL, verbose: bool = False, compact: bool = True,
+                 base_url: str = None):
         self.model = model
         self.verbose = verbose
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.compact = compact  # trim tool payloads and fold old rounds (see COMPACTION)
+        self.client = OpenAI(api_key=OPENAI_API_KEY, base_url=base_url or OPENAI_BASE_URL)
+        self.round_log = []  # per-round timings of the last query
+        self.prompt_tokens_sent = 0  # prompt tokens across all rounds of the last query
         self.system_prompt = """You are a senior equity research analyst AI assistant built into the "Investing Made Simple" platform. Your job is to help beginner-to-intermediate investors understand stocks through clear, data-driven analysis.
 
 When a user asks about a stock or investing topic:
@@ -427,6 +763,8 @@ IMPORTANT: Do NOT make up data. Only use data from your tool calls. Always provi
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": query},
         ]
+        self.round_log = []
+        self.prompt_tokens_sent = 0
         
         # Agent loop - keeps going until OpenAI gives a final text response
         max_rounds = 10
@@ -435,12 +773,15 @@ IMPORTANT: Do NOT make up data. Only use data from your tool calls. Always provi
                 print(f"\n--- Agent Round {round_num + 1} ---")
             
             # Call OpenAI
+            llm_start = time.perf_counter()
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 tools=TOOLS,
                 tool_choice="auto",  # Let the model decide when to use tools
             )
+            llm_seconds = time.perf_counter() - llm_start
+            self._count_prompt_tokens(response, messages)
             
             message = response.choices[0].message
             
@@ -453,28 +794,12 @@ IMPORTANT: Do NOT make up data. Only use data from your tool calls. Always provi
             # Process tool calls
             messages.append(message)  # Add assistant's tool call message
             
-            for tool_call in message.tool_calls:
-                func_name = tool_call.function.name
-                func_args = json.loads(tool_call.function.arguments)
-                
-                if self.verbose:
-                    print(f"  Calling: {func_name}({func_args})")
-                
-                # Execute the function
-                if func_name in TOOL_FUNCTIONS:
-                    result = TOOL_FUNCTIONS[func_name](**func_args)
-                else:
-                    result = {"error": f"Unknown function: {func_name}"}
-                
-                if self.verbose:
-                    print(f"  Result keys: {list(result.keys()) if isinstance(result, dict) else 'N/A'}")
-                
-                # Add tool result to messages
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "content": json.dumps(result),
-                })
+            if self.verbose:
+                for tool_call in message.tool_calls:
+                    print(f"  Calling: {tool_call.function.name}({tool_call.function.arguments})")
+            
+            # Execute the round's tool calls concurrently, keep the original order
+            self._run_tools(messages, message.tool_calls, round_num, llm_seconds)
         
         return "Agent reached maximum rounds without completing. Please try a simpler question."
 
@@ -482,6 +807,11 @@ IMPORTANT: Do NOT make up data. Only use data from your tool calls. Always provi
         """
         Streaming version - yields chunks as they come in.
         
+        One streamed completion per round: text is yielded as it arrives, and each
+        tool call is dispatched to the tool pool as soon as its arguments are complete
+        (i.e. when the next call starts or the stream ends), while the model is still
+        generating the rest of the round.
+        
         Use this for a better UX in Streamlit:
             agent = StockResearchAgent()
             with st.chat_message("assistant"):
@@ -491,21 +821,95 @@ IMPORTANT: Do NOT make up data. Only use data from your tool calls. Always provi
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": query},
         ]
+        self.round_log = []
+        self.prompt_tokens_sent = 0
         
         max_rounds = 10
         for round_num in range(max_rounds):
-            # First, non-streaming call to check for tool use
+            round_state = self._round_state()
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                tools=TOOLS,
+                tool_choice="auto",
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            
+            text, calls, futures, usage_chunk = [], {}, {}, None
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage_chunk = chunk
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    text.append(delta.content)
+                    yield delta.content
+                
+                for tc_delta in delta.tool_calls or []:
+                    if tc_delta.index not in calls:
+                        # Calls stream one after another: a new index closes the previous ones
+                        for index, call in calls.items():
+                            if index not in futures:
+                                futures[index] = _TOOL_POOL.submit(execute_tool_call, call)
+                        calls[tc_delta.index] = StreamedToolCall()
+                    call = calls[tc_delta.index]
+                    call.add_delta(tc_delta)
+                    if call.function.name and not call.announced:
+                        call.announced = True
+                        yield f"\n🔍 *Fetching {call.function.name.replace('_', ' ')}...*\n"
+            
+            llm_seconds = time.perf_counter() - round_state[0]
+            self._count_prompt_tokens(usage_chunk, messages)
+            
+            # No tool calls: the text we just streamed is the final answer
+            if not calls:
+                return
+            
+            for index, call in calls.items():
+                if index not in futures:
+                    futures[index] = _TOOL_POOL.submit(execute_tool_call, call)
+            
+            order = sorted(calls)
+            tool_calls = [calls[i] for i in order]
+            messages.append({
+                "role": "assistant",
+                "content": "".join(text) or None,
+                "tool_calls": [call.as_dict() for call in tool_calls],
+            })
+            self._run_tools(messages, tool_calls, round_num, llm_seconds,
+                            futures=[futures[i] for i in order], round_state=round_state)
+
+    def research_stream_two_call(self, query: str):
+        """
+        Previous streaming approach, kept for latency comparison (see compare_streaming):
+        a non-streaming call each round to detect tool use, then a second, streamed
+        call that regenerates the final answer.
+        """
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": query},
+        ]
+        self.round_log = []
+        self.prompt_tokens_sent = 0
+        
+        max_rounds = 10
+        for round_num in range(max_rounds):
+            llm_start = time.perf_counter()
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 tools=TOOLS,
                 tool_choice="auto",
             )
+            llm_seconds = time.perf_counter() - llm_start
+            self._count_prompt_tokens(response, messages)
             
             message = response.choices[0].message
             
-            # If no tool calls, stream the final response
             if not message.tool_calls:
+                self._count_prompt_tokens(None, messages)
                 stream = self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
@@ -513,30 +917,130 @@ IMPORTANT: Do NOT make up data. Only use data from your tool calls. Always provi
                     stream=True,
                 )
                 for chunk in stream:
-                    if chunk.choices[0].delta.content:
+                    if chunk.choices and chunk.choices[0].delta.content:
                         yield chunk.choices[0].delta.content
                 return
             
-            # Process tool calls (same as non-streaming)
             messages.append(message)
-            
             for tool_call in message.tool_calls:
-                func_name = tool_call.function.name
-                func_args = json.loads(tool_call.function.arguments)
-                
-                # Show user what's happening
-                yield f"\n🔍 *Fetching {func_name.replace('_', ' ')}...*\n"
-                
-                if func_name in TOOL_FUNCTIONS:
-                    result = TOOL_FUNCTIONS[func_name](**func_args)
-                else:
-                    result = {"error": f"Unknown function: {func_name}"}
-                
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "content": json.dumps(result),
-                })
+                yield f"\n🔍 *Fetching {tool_call.function.name.replace('_', ' ')}...*\n"
+            
+            self._run_tools(messages, message.tool_calls, round_num, llm_seconds)
+
+    def _count_prompt_tokens(self, response, messages: list):
+        """Add this call's prompt tokens (API usage if reported, else an estimate)."""
+        usage = getattr(response, "usage", None)
+        tokens = getattr(usage, "prompt_tokens", None) if usage else None
+        self.prompt_tokens_sent += tokens if tokens else estimate_tokens(messages)
+
+    @staticmethod
+    def _round_state() -> tuple:
+        return time.perf_counter(), _FMP_CACHE.hits
+
+    def _run_tools(self, messages: list, tool_calls, round_num: int, llm_seconds: float,
+                   futures: list = None, round_state: tuple = None):
+        """
+        Execute one round of tool calls on the shared pool and append results in order.
+        When the calls were already dispatched (streaming), pass their futures and the
+        _round_state() taken before dispatch so cache hits cover them; tools_wall_s is
+        then only the wait left after the stream ended.
+        """
+        hits_before = (round_state or self._round_state())[1]
+        start = time.perf_counter()
+        if futures is None:
+            outcomes = execute_tool_calls(tool_calls)
+        else:
+            outcomes = [(tc, *f.result()) for tc, f in zip(tool_calls, futures)]
+        wall = time.perf_counter() - start
+        cache_hits = _FMP_CACHE.hits - hits_before
+        
+        for tool_call, result, seconds in outcomes:
+            if self.verbose:
+                keys = list(result.keys()) if isinstance(result, dict) else 'N/A'
+                print(f"  {tool_call.function.name}: {seconds:.2f}s, result keys: {keys}")
+            if self.compact:
+                content = dump_tool_result(compact_tool_result(tool_call.function.name, result))
+            else:
+                content = json.dumps(result)
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": content,
+            })
+        
+        folded = fold_tool_history(messages) if self.compact else 0
+        if folded and self.verbose:
+            print(f"  Folded {folded} earlier round(s) into the facts block")
+        
+        serial = sum(seconds for _, _, seconds in outcomes)
+        self.round_log.append({
+            "round": round_num + 1,
+            "llm_s": round(llm_seconds, 3),
+            "tools": len(outcomes),
+            "tools_wall_s": round(wall, 3),
+            "tools_serial_s": round(serial, 3),
+            "cache_hits": cache_hits,
+            "prompt_tokens": self.prompt_tokens_sent,
+        })
+        if self.verbose:
+            print(f"  Round {round_num + 1}: LLM {llm_seconds:.2f}s, "
+                  f"{len(outcomes)} tools in {wall:.2f}s (serial would be {serial:.2f}s), "
+                  f"{cache_hits} cache hits")
+
+
+def compare_compaction(queries: list = BENCHMARK_QUERIES, model: str = MODEL) -> list:
+    """
+    Run each benchmark query with compaction off and on and report prompt tokens sent.
+    Both runs start from an empty tool cache so they fetch the same data.
+    Returns one row per query: {query, tokens_raw, tokens_compact, saved_pct}.
+    """
+    rows = []
+    raw_agent = StockResearchAgent(model=model, compact=False)
+    compact_agent = StockResearchAgent(model=model, compact=True)
+    for query in queries:
+        _FMP_CACHE.clear()
+        raw_agent.research(query)
+        _FMP_CACHE.clear()
+        compact_agent.research(query)
+        raw, compact = raw_agent.prompt_tokens_sent, compact_agent.prompt_tokens_sent
+        rows.append({
+            "query": query,
+            "tokens_raw": raw,
+            "tokens_compact": compact,
+            "saved_pct": round((1 - compact / raw) * 100, 1) if raw else 0.0,
+        })
+    return rows
+
+
+def compare_streaming(queries: list = BENCHMARK_QUERIES, model: str = MODEL) -> list:
+    """
+    Time research_stream against research_stream_two_call on each benchmark query.
+    first_text_s is when the first answer chunk (not a 'Fetching...' notice) arrived.
+    Every timed run starts from an empty tool cache, so neither path gets the
+    other's warm FMP results.
+    """
+    def timed(gen) -> tuple:
+        _FMP_CACHE.clear()
+        start, first = time.perf_counter(), None
+        for chunk in gen:
+            if first is None and not chunk.startswith("\n🔍"):
+                first = time.perf_counter() - start
+        total = time.perf_counter() - start
+        return (first if first is not None else total), total
+    
+    rows = []
+    agent = StockResearchAgent(model=model)
+    for query in queries:
+        two_first, two_total = timed(agent.research_stream_two_call(query))
+        one_first, one_total = timed(agent.research_stream(query))
+        rows.append({
+            "query": query,
+            "two_call_first_text_s": round(two_first, 2),
+            "two_call_total_s": round(two_total, 2),
+            "stream_first_text_s": round(one_first, 2),
+            "stream_total_s": round(one_total, 2),
+        })
+    return rows
 
 
 # ============================================================
@@ -591,6 +1095,18 @@ STREAMLIT_EXAMPLE = """
 # ============================================================
 
 if __name__ == "__main__":
+    if "--compare-compaction" in sys.argv:
+        for row in compare_compaction():
+            print(f"{row['query']:<45} raw {row['tokens_raw']:>7}  compact {row['tokens_compact']:>7}"
+                  f"  saved {row['saved_pct']}%")
+        sys.exit(0)
+    if "--compare-streaming" in sys.argv:
+        for row in compare_streaming():
+            print(f"{row['query']:<45} two-call first text {row['two_call_first_text_s']:>6}s"
+                  f" total {row['two_call_total_s']:>6}s | streaming first text"
+                  f" {row['stream_first_text_s']:>6}s total {row['stream_total_s']:>6}s")
+        sys.exit(0)
+
     print("=" * 60)
     print("  Stock Research AI Agent")
     print("  Type 'quit' to exit")